@@ -1,24 +1,55 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Form
+from fastapi import FastAPI, HTTPException, Depends, File, Form, Header, Query, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_
 from typing import List, Dict, Any, Optional
+import logging
 import threading
 from datetime import datetime, timedelta
 import uuid
 import os
 from pydantic import BaseModel
 
-from DatabaseManager import get_db, China2025B, UserSession, create_tables
+from DatabaseManager import (
+    get_db, SessionLocal, China2025B, UserSession, Scenario, create_tables, bump_data_version, get_data_version,
+    BUDGET_CYCLE, read_router, shard_router, business_unit_session, DIMENSION_COLUMNS, HISTORY_COLUMNS,
+    PLAN_COLUMNS, PERIOD_COLUMNS, column_expression, decode_dimensions
+)
+from fact_store import (
+    select_rows, period_values, grouped_totals, merge_grouped_totals, list_periods, overlay_periods, is_long_layout
+)
+from budget_cycles import list_cycles, cycle_totals
+from budget_validation import BudgetRowUpdate, validate_updates
+from budget_import import BudgetImport, ImportFormatError, iter_upload_rows
+from budget_search import SORT_COLUMNS, merge_pages, search_rows
+from derived_metrics import METRICS, parse_metrics, attach_row_metrics, attach_group_metrics
+from change_journal import apply_updates, changes_since
+from what_if import (
+    Adjustment, Evaluation, ScenarioError, apply_adjustments, save_scenario, scenario_adjustments, scenario_record
+)
+from change_events import change_broker
+from admission import AdmissionMiddleware, admission
+from portal_logging import (
+    RequestLoggingMiddleware, dropped_records, log_payload, setup_logging, stop_logging
+)
+from analytics import GROUP_COLUMNS as ANALYTICS_GROUP_COLUMNS, AnalyticsUnavailable, analytics_engine
+from powerbi_sync import get_sync, sync_all
+from powerbi_service import powerbi_service
+from job_queue import enqueue, get_job, register_handler, start_workers, stop_workers
 from config import config
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(
     title="Budget Portal API", 
     version="1.0.0",
     description="Budget Portal API for managing budget data and PowerBI integration"
 )
 
+# Bounds requests in flight per endpoint class; added first so CORS headers wrap its 503s
+app.add_middleware(AdmissionMiddleware)
+
 # CORS middleware - configure based on environment
 if config.is_production():
     allowed_origins = [
@@ -38,12 +69,77 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost: the request id is set before admission queueing and every response carries it
+app.add_middleware(RequestLoggingMiddleware)
+
 # Thread lock for concurrent operations
 data_lock = threading.RLock()
+# With sharded storage each business unit's file has its own writer, so saves only queue per BU
+business_unit_locks: Dict[str, threading.RLock] = {}
+
+def write_lock(business_unit: str):
+    if not shard_router.enabled:
+        return data_lock
+    with data_lock:
+        return business_unit_locks.setdefault(business_unit, threading.RLock())
 
 @app.on_event("startup")
 async def startup_event():
+    # Log records are written by a background thread; requests only enqueue them
+    setup_logging()
     create_tables()
+    start_workers()
+    change_broker.start()
+    if config.ANALYTICS_ENGINE == 'duckdb' and config.ANALYTICS_SOURCE == 'parquet':
+        # Build the analytics snapshot in the background instead of in the first query
+        from analytics import read_manifest, request_refresh
+        if read_manifest() is None:
+            request_refresh()
+    # Token acquisition and connection setup happen here, not on the first submit
+    if powerbi_service.is_configured():
+        threading.Thread(target=powerbi_service.start, name="powerbi-warmup", daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    stop_workers()
+    powerbi_service.stop()
+    await change_broker.stop()
+    stop_logging()
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """Allow admin endpoints only with the configured X-Admin-Token (open in development if unset)"""
+    if config.ADMIN_TOKEN:
+        if x_admin_token != config.ADMIN_TOKEN:
+            raise HTTPException(status_code=403, detail="Admin token required")
+    elif config.is_production():
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set)")
+
+def get_read_db(request: Request):
+    """Session for GET endpoints: a read replica unless this user or BU saved moments ago
+
+    With sharded storage a request naming a business unit reads its shard.
+    """
+    business_unit = request.path_params.get('business_unit') or request.query_params.get('business_unit')
+    if business_unit and shard_router.enabled:
+        db = shard_router.session(business_unit)
+    else:
+        db = read_router.session(
+            request.path_params.get('user_id') or request.query_params.get('user_id'), business_unit
+        )
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_write_db(request: Request):
+    """Session for writes to the business unit in the path or query (its shard when sharded)"""
+    db = business_unit_session(
+        request.path_params.get('business_unit') or request.query_params.get('business_unit')
+    )
+    try:
+        yield db
+    finally:
+        db.close()
 
 class LoginRequest(BaseModel):
     user_id: str
@@ -52,49 +148,83 @@ class LoginRequest(BaseModel):
 class BudgetUpdateRequest(BaseModel):
     user_id: str
     business_unit: str
-    updates: List[Dict]
+    updates: List[BudgetRowUpdate]
+
+class WhatIfRequest(BaseModel):
+    user_id: str
+    business_unit: str
+    adjustments: List[Adjustment]
+
+class ScenarioRequest(WhatIfRequest):
+    name: str
+
+def requested_metrics(metrics: Optional[str]) -> List[str]:
+    """Derived metric names from the ``metrics`` query parameter (400 if unknown)"""
+    try:
+        return parse_metrics(metrics)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def all_rows(db: Session, metric_names: List[str]) -> List[Dict[str, Any]]:
+    """Every row of the database (or shard) as API dictionaries"""
+    data = db.query(China2025B).all()
+    result = [
+        {
+            "id": item.id,
+            "user_id": item.user_id,
+            "business_unit": item.business_unit,
+            "Sales_Region": item.Sales_Region,
+            "Customer_Note": item.Customer_Note,
+            "Customer_Group": item.Customer_Group,
+            "BizType": item.BizType,
+            "Vendor_Category": item.Vendor_Category,
+            "Vendor_Grouping": item.Vendor_Grouping,
+            "ProductNature": item.ProductNature,
+            "Y2019A": item.Y2019A,
+            "Y2020A": item.Y2020A,
+            "Y2021A": item.Y2021A,
+            "Y2022A": item.Y2022A,
+            "Y2023A": item.Y2023A,
+            "Y2024B": item.Y2024B,
+            "Y2024Q3F": item.Y2024Q3F,
+            "Y2024A08": item.Y2024A08,
+            "Y2024R08": item.Y2024R08,
+            "avg1924": item.avg1924,
+            "Y2025B": item.Y2025B,
+            "Y2026P": item.Y2026P,
+            "Y2027P": item.Y2027P,
+            "Y2028P": item.Y2028P,
+            "Y2029P": item.Y2029P,
+            "Sales_Remark": item.Sales_Remark
+        } for item in data
+    ]
+    if is_long_layout() or metric_names:
+        # Year values come from the per-BU pivot of budget_facts, metrics from the per-BU cache
+        by_business_unit = {}
+        for record in result:
+            by_business_unit.setdefault(record["business_unit"], []).append(record)
+        for business_unit, records in by_business_unit.items():
+            overlay_periods(db, business_unit, records)
+            attach_row_metrics(db, business_unit, records, metric_names)
+    return result
 
 @app.get("/data")
-async def get_data(db: Session = Depends(get_db)):
+def get_data(metrics: Optional[str] = None, db: Session = Depends(get_read_db)):
     """Get all data from china_2025B table"""
+    metric_names = requested_metrics(metrics)
     try:
-        data = db.query(China2025B).all()
-        result = [
-            {
-                "id": item.id,
-                "user_id": item.user_id,
-                "business_unit": item.business_unit,
-                "Sales_Region": item.Sales_Region,
-                "Customer_Note": item.Customer_Note,
-                "Customer_Group": item.Customer_Group,
-                "BizType": item.BizType,
-                "Vendor_Category": item.Vendor_Category,
-                "Vendor_Grouping": item.Vendor_Grouping,
-                "ProductNature": item.ProductNature,
-                "Y2019A": item.Y2019A,
-                "Y2020A": item.Y2020A,
-                "Y2021A": item.Y2021A,
-                "Y2022A": item.Y2022A,
-                "Y2023A": item.Y2023A,
-                "Y2024B": item.Y2024B,
-                "Y2024Q3F": item.Y2024Q3F,
-                "Y2024A08": item.Y2024A08,
-                "Y2024R08": item.Y2024R08,
-                "avg1924": item.avg1924,
-                "Y2025B": item.Y2025B,
-                "Y2026P": item.Y2026P,
-                "Y2027P": item.Y2027P,
-                "Y2028P": item.Y2028P,
-                "Y2029P": item.Y2029P,
-                "Sales_Remark": item.Sales_Remark
-            } for item in data
-        ]
+        if shard_router.enabled:
+            # Every shard is read in parallel; the merged rows keep the id order
+            parts = shard_router.map(lambda shard: all_rows(shard, metric_names))
+            result = sorted((record for part in parts for record in part), key=lambda record: record["id"])
+        else:
+            result = all_rows(db, metric_names)
         return {"success": True, "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch data: {str(e)}")
 
 @app.post("/api/login")
-async def login(request: LoginRequest, db: Session = Depends(get_db)):
+def login(request: LoginRequest, db: Session = Depends(get_db)):
     """Authenticate user and create session"""
     try:
         user = db.query(UserSession).filter(UserSession.user_id == request.user_id).first()
@@ -140,9 +270,17 @@ async def login(request: LoginRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
 
 @app.get("/api/data/{user_id}/{business_unit}")
-async def get_user_data(user_id: str, business_unit: str, db: Session = Depends(get_db)):
+def get_user_data(
+    user_id: str,
+    business_unit: str,
+    metrics: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
     """Get data for specific user with RLS"""
+    metric_names = requested_metrics(metrics)
     try:
+        # Read before the rows, so a concurrent save can only make the client refetch once more
+        data_version = get_data_version(db, business_unit)
         # First try to get data from local database
         local_data = db.query(China2025B).filter(
             and_(
@@ -215,137 +353,133 @@ async def get_user_data(user_id: str, business_unit: str, db: Session = Depends(
                 "Sales_Remark": item.Sales_Remark
             } for item in local_data
         ]
+        overlay_periods(db, business_unit, result)
+        attach_row_metrics(db, business_unit, result, metric_names)
         
-        return {"success": True, "data": result}
+        return {"success": True, "data": result, "data_version": data_version}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch data: {str(e)}")
 
 @app.post("/api/update")
-async def update_budget_data(
-    request: BudgetUpdateRequest,
-    db: Session = Depends(get_db)
-):
+def update_budget_data(request: BudgetUpdateRequest):
     """Update budget data with thread safety"""
-    with data_lock:
+    log_payload("Update request", request)
+    # The business unit comes from the body, so the session is opened here rather than by a dependency
+    db = business_unit_session(request.business_unit)
+    with write_lock(request.business_unit):
         try:
-            updated_records = []
-            
-            for update in request.updates:
-                record_id = update.get("id")
-                if not record_id:
-                    continue
-                
-                # Get existing record
-                record = db.query(China2025B).filter(
-                    and_(
-                        China2025B.id == record_id,
-                        China2025B.user_id == request.user_id,
-                        China2025B.business_unit == request.business_unit
-                    )
-                ).first()
-                
-                if record:
-                    # Update editable fields only
-                    if "Y2025B" in update:
-                        record.Y2025B = update["Y2025B"]
-                    if "Y2026P" in update:
-                        record.Y2026P = update["Y2026P"]
-                    if "Y2027P" in update:
-                        record.Y2027P = update["Y2027P"]
-                    if "Y2028P" in update:
-                        record.Y2028P = update["Y2028P"]
-                    if "Y2029P" in update:
-                        record.Y2029P = update["Y2029P"]
-                    if "Sales_Remark" in update:
-                        record.Sales_Remark = update["Sales_Remark"]
-                    
-                    updated_records.append(record.id)
-
-            # Query the database and convert results to a list of dictionaries
-            # Only for DEMO (save to excel)
-            # Delete this later
-            # =============================================================
-            records = db.query(China2025B).filter(
-                and_(
-                    China2025B.user_id == request.user_id,
-                    China2025B.business_unit == request.business_unit
-                )
-            ).all()
-            data = [
-                {
-                    "id": record.id,
-                    "user_id": record.user_id,
-                    "business_unit": record.business_unit,
-                    "Y2025B": record.Y2025B,
-                    "Y2026P": record.Y2026P,
-                    "Y2027P": record.Y2027P,
-                    "Y2028P": record.Y2028P,
-                    "Y2029P": record.Y2029P,
-                    "Sales_Remark": record.Sales_Remark
-                }
-                for record in records
-            ]
-            pd.DataFrame(data).to_excel('temp1_Powerbi_submission_data.xlsx', sheet_name=f"{request.business_unit}", index=False)
-            # =============================================================
+            # The whole batch is validated at once; rows with errors are not applied
+            updates, errors = validate_updates(
+                db, request.user_id, request.business_unit, request.updates
+            )
+            # Changed cells are journaled in the same transaction as the update
+            updated_records, change_count = apply_updates(
+                db, request.user_id, request.business_unit, updates
+            )
+
+            data_version = None
+            if change_count:
+                data_version = bump_data_version(db, request.business_unit)
             
             db.commit()
+            # The user's next reads go to the primary until replicas have caught up
+            read_router.mark_written(request.user_id, request.business_unit)
+            if data_version is not None:
+                change_broker.publish(request.business_unit, data_version)
             
+            message = f"Updated {len(updated_records)} records"
+            rejected_count = len({error["id"] for error in errors})
+            if rejected_count:
+                message += f", rejected {rejected_count}"
             return {
                 "success": True,
                 "updated_records": updated_records,
-                "message": f"Updated {len(updated_records)} records"
+                "rejected": errors,
+                "data_version": data_version,
+                "message": message
             }
             
         except Exception as e:
             db.rollback()
             raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
+        finally:
+            db.close()
+
+@app.post("/api/import/{user_id}/{business_unit}")
+def import_budget_file(
+    user_id: str,
+    business_unit: str,
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    db: Session = Depends(get_write_db)
+):
+    """Apply edited rows from an uploaded XLSX/CSV file, reporting a result per row"""
+    with write_lock(business_unit):
+        try:
+            rows = iter_upload_rows(file.file, file.filename)
+            report = BudgetImport(db, user_id, business_unit).run(rows)
+            
+            data_version = None
+            if dry_run:
+                db.rollback()
+            else:
+                if report["changed_cells"]:
+                    data_version = bump_data_version(db, business_unit)
+                db.commit()
+                read_router.mark_written(user_id, business_unit)
+                if data_version is not None:
+                    change_broker.publish(business_unit, data_version)
+            
+            report.update({"success": True, "dry_run": dry_run, "data_version": data_version})
+            return report
+            
+        except ImportFormatError as e:
+            db.rollback()
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            db.rollback()
+            raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
 
 @app.post("/api/submit")
-async def submit_budget_data(
+def submit_budget_data(
     user_id: str,
     business_unit: str,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_write_db)
 ):
-    """Submit budget data and trigger PowerBI refresh"""
-    with data_lock:
+    """Submit budget data and queue the PowerBI update"""
+    with write_lock(business_unit):
         try:
-            # Mark all user's records as submitted
-            records = db.query(China2025B).filter(
+            record_count = db.query(China2025B).filter(
                 and_(
                     China2025B.user_id == user_id,
                     China2025B.business_unit == business_unit,
                 )
-            ).all()
+            ).count()
             
-            if not records:
+            if not record_count:
                 raise HTTPException(status_code=400, detail="No records to submit")
             
-            submitted_data = [
-                {
-                    "user_id": record.user_id,
-                    "business_unit": record.business_unit,
-                    "Y2025B": record.Y2025B,
-                    "Y2026P": record.Y2026P,
-                    "Y2027P": record.Y2027P,
-                    "Y2028P": record.Y2028P,
-                    "Y2029P": record.Y2029P,
-                    "Sales_Remark": record.Sales_Remark
-                } for record in records
-            ]
-            
+            # Durable jobs, coalesced per BU: repeated submits before the
+            # worker picks the job up collapse into a single export. Jobs live in
+            # the primary; a shard session would also lock the shard while enqueueing.
+            payload = {"user_id": user_id, "business_unit": business_unit}
             db.commit()
-            
-            # Background task to update PowerBI
-            background_tasks.add_task(
-                update_powerbi_async,
-                submitted_data
-            )
+            jobs_db = SessionLocal()
+            try:
+                job = enqueue(jobs_db, "powerbi_submit", payload, dedupe_key=business_unit)
+                enqueue(jobs_db, "xlsx_export", payload, dedupe_key=business_unit)
+                jobs_db.commit()
+                job_id = job.id
+            finally:
+                jobs_db.close()
+            read_router.mark_written(user_id, business_unit)
+            change_broker.publish(business_unit, get_data_version(db, business_unit), "submit")
             
             return {
                 "success": True,
-                "submitted_records": len(records),
+                "submitted_records": record_count,
+                "job_id": job_id,
                 "message": "Data submitted successfully. PowerBI will be updated shortly."
             }
             
@@ -353,42 +487,563 @@ async def submit_budget_data(
             db.rollback()
             raise HTTPException(status_code=500, detail=f"Submission failed: {str(e)}")
 
-async def update_powerbi_async(data: List[Dict[str, Any]]):
-    """Background task to update PowerBI
+@register_handler("powerbi_submit")
+def update_powerbi(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job handler: write the BU's submission feed and sync the PowerBI push dataset"""
+    business_unit = payload["business_unit"]
+    # pyarrow is loaded on first export rather than at startup
+    from export_service import SUBMISSION_SCHEMA, SUBMISSION_FEED_NAME, rows_to_table, replace_business_unit_rows
+    db = business_unit_session(business_unit)
     try:
-        success = powerbi_service.push_data_to_dataset(data)
-        if success:
-            # Trigger dataset refresh
+        rows = list(select_rows(db, SUBMISSION_SCHEMA.names, China2025B.business_unit == business_unit))
+    finally:
+        db.close()
+    
+    table = rows_to_table(rows, SUBMISSION_SCHEMA)
+    # The feed holds every BU (GetData.py, submit-all); only this BU's rows are replaced
+    path = replace_business_unit_rows(table, SUBMISSION_FEED_NAME, business_unit)
+    logger.info("PowerBI submission Parquet updated with %s records of %s: %s", len(rows), business_unit, path)
+    result = {"records": len(rows), "path": path}
+    
+    if config.POWERBI_SYNC_ENABLED:
+        # Push only rows changed since the last successful sync
+        sync_result = get_sync(business_unit).run()
+        logger.info("PowerBI push dataset synced: %s rows in %s batches", sync_result['rows'], sync_result['batches'])
+        if sync_result['rows'] and config.POWERBI_REFRESH_AFTER_SYNC:
             powerbi_service.refresh_dataset()
-            print(f"PowerBI updated successfully with {len(data)} records")
+        result["sync"] = sync_result
+    return result
+
+@register_handler("xlsx_export")
+def prebuild_xlsx_export(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job handler: build the cached Excel export so the next download is served from disk"""
+    from export_service import get_or_build_xlsx
+    db = business_unit_session(payload["business_unit"])
+    try:
+        return {"path": get_or_build_xlsx(db, payload["business_unit"])}
+    finally:
+        db.close()
+
+@app.get("/api/arrow")
+def get_arrow_data(business_unit: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """Get budget rows as an Arrow IPC stream for zero-copy readers"""
+    from export_service import FULL_SCHEMA, ARROW_STREAM_MEDIA_TYPE, rows_to_table, to_arrow_ipc
+    try:
+        criteria = [China2025B.business_unit == business_unit] if business_unit else []
+        if shard_router.enabled and not business_unit:
+            parts = shard_router.map(lambda shard: list(select_rows(shard, FULL_SCHEMA.names)))
+            rows = sorted((row for part in parts for row in part), key=lambda row: row[0])
         else:
-            print("Failed to update PowerBI")
+            rows = select_rows(db, FULL_SCHEMA.names, *criteria)
+        table = rows_to_table(list(decode_dimensions(rows, FULL_SCHEMA.names)), FULL_SCHEMA)
+        return Response(content=to_arrow_ipc(table), media_type=ARROW_STREAM_MEDIA_TYPE)
     except Exception as e:
-        print(f"PowerBI update error: {str(e)}")
-    """
+        raise HTTPException(status_code=500, detail=f"Failed to export Arrow data: {str(e)}")
+
+ROLLUP_GROUP_COLUMNS = ['business_unit'] + DIMENSION_COLUMNS
+
+@app.get("/api/rollup")
+def get_rollup(
+    group_by: str = 'Sales_Region',
+    business_unit: Optional[str] = None,
+    cycle: Optional[str] = None,
+    metrics: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Sum the year columns grouped by business unit and/or dimension columns (comma separated)"""
+    metric_names = requested_metrics(metrics)
+    group_columns = [name.strip() for name in group_by.split(',') if name.strip()]
+    invalid = [name for name in group_columns if name not in ROLLUP_GROUP_COLUMNS]
+    if not group_columns or invalid:
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by must be one or more of: {', '.join(ROLLUP_GROUP_COLUMNS)}"
+        )
+    historical = cycle is not None and cycle != BUDGET_CYCLE
+    if historical and cycle not in list_cycles(db):
+        raise HTTPException(status_code=404, detail=f"Unknown budget cycle: {cycle}")
     
     try:
-        df = pd.DataFrame(data)
-        df.to_csv('temp1_Powerbi_submission_data.csv', index=False)
-        print(f"PowerBI submission CSV updated with {len(data)} records")
+        # Grouping runs on the integer dimension keys; labels are resolved afterwards
+        value_columns = HISTORY_COLUMNS + PLAN_COLUMNS
+        if historical:
+            rows = cycle_totals(db, cycle, group_columns, value_columns, business_unit)
+        else:
+            keys = [column_expression(name) for name in group_columns]
+            criteria = [China2025B.business_unit == business_unit] if business_unit else []
+            if shard_router.enabled and not business_unit:
+                # Each shard groups its own rows in parallel; groups are summed across shards
+                rows = merge_grouped_totals(
+                    shard_router.map(lambda shard: grouped_totals(shard, keys, value_columns)), len(keys)
+                )
+            else:
+                rows = grouped_totals(db, keys, value_columns, *criteria)
+        
+        groups = []
+        for row in decode_dimensions(rows, group_columns + ['records'] + value_columns):
+            group = dict(zip(group_columns + ['records'], row))
+            group.update({col: float(value or 0) for col, value in zip(value_columns, row[len(group_columns) + 1:])})
+            groups.append(group)
+        attach_group_metrics(groups, metric_names)
+        groups.sort(key=lambda group: [str(group[name] or '') for name in group_columns])
+        
+        return {
+            "group_by": group_columns,
+            "business_unit": business_unit,
+            "cycle": cycle or BUDGET_CYCLE,
+            "metrics": metric_names,
+            "groups": groups,
+            "count": len(groups)
+        }
     except Exception as e:
-        print(f"PowerBI CSV update error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to build rollup: {str(e)}")
+
+@app.get("/api/query")
+def query_rows(
+    request: Request,
+    business_unit: Optional[List[str]] = Query(None),
+    q: Optional[str] = None,
+    match: str = 'contains',
+    sort: str = 'id',
+    order: str = 'asc',
+    limit: int = 100,
+    offset: int = 0,
+    db: Session = Depends(get_read_db)
+):
+    """Rows across business units filtered by dimension labels (repeatable, e.g. ?Sales_Region=East)
+    and a prefix/contains search on Customer_Note (q)"""
+    if match not in ('prefix', 'contains'):
+        raise HTTPException(status_code=400, detail="match must be prefix or contains")
+    if sort not in SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(SORT_COLUMNS)}")
+    if order not in ('asc', 'desc'):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    if limit < 1 or offset < 0:
+        raise HTTPException(status_code=400, detail="limit must be positive and offset not negative")
+    limit = min(limit, config.QUERY_MAX_LIMIT)
+    filters = {
+        column: request.query_params.getlist(column)
+        for column in DIMENSION_COLUMNS if request.query_params.getlist(column)
+    }
+
+    try:
+        note = q.strip() if q else None
+        if shard_router.enabled:
+            # Each shard returns its first offset + limit matches; the page is cut from the merge
+            pages = shard_router.map(
+                lambda shard: search_rows(shard, filters, business_unit, note, match, sort, order == 'desc',
+                                          offset + limit, 0),
+                business_unit
+            )
+            rows, has_more = merge_pages(pages, sort, order == 'desc', limit, offset)
+        else:
+            rows, has_more = search_rows(
+                db, filters, business_unit, note, match, sort, order == 'desc', limit, offset
+            )
+        return {
+            "filters": filters,
+            "business_units": business_unit or [],
+            "q": q,
+            "rows": rows,
+            "count": len(rows),
+            "offset": offset,
+            "limit": limit,
+            "has_more": has_more
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to query rows: {str(e)}")
+
+@app.get("/api/forecast")
+def get_forecast(
+    method: str = 'trend',
+    window: int = 3,
+    business_unit: Optional[str] = None,
+    periods: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Baseline projections of the plan years from each row's history, column by column"""
+    from forecast import FORECAST_PERIODS, METHODS, forecast_business_units, merge_forecasts, validate
+    try:
+        validate(method, window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    period_names = [name.strip() for name in periods.split(',') if name.strip()] if periods else FORECAST_PERIODS
+    if not period_names or any(name not in FORECAST_PERIODS for name in period_names):
+        raise HTTPException(status_code=400, detail=f"periods must be some of: {', '.join(FORECAST_PERIODS)}")
+
+    def business_units_forecast(session: Session) -> Dict[str, Any]:
+        units = [business_unit] if business_unit else [
+            row[0] for row in session.query(China2025B.business_unit).distinct().order_by(China2025B.business_unit)
+        ]
+        return forecast_business_units(session, units, method, window, period_names)
+
+    try:
+        if shard_router.enabled and not business_unit:
+            result = merge_forecasts(shard_router.map(business_units_forecast))
+        else:
+            result = business_units_forecast(db)
+        # Plain lists of numbers: skip FastAPI's per-value encoding, which dominates on large BUs
+        return JSONResponse({
+            "method": method,
+            "description": METHODS[method][0],
+            "window": window if method == 'moving_average' else None,
+            "periods": period_names,
+            **result
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute forecast: {str(e)}")
+
+def preview_adjustments(user_id: str, business_unit: str, adjustments: List[Adjustment], sample: int) -> Dict[str, Any]:
+    db = business_unit_session(business_unit)
+    try:
+        return Evaluation(db, user_id, business_unit, adjustments).preview(db, max(0, min(sample, 1000)))
+    except ScenarioError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to evaluate adjustments: {str(e)}")
+    finally:
+        db.close()
+
+def commit_adjustments(user_id: str, business_unit: str, adjustments: List[Adjustment]) -> Dict[str, Any]:
+    db = business_unit_session(business_unit)
+    with write_lock(business_unit):
+        try:
+            # Re-evaluated under the lock, so the journal records the values being replaced
+            evaluation = Evaluation(db, user_id, business_unit, adjustments)
+            errors = evaluation.errors()
+            if errors:
+                raise HTTPException(status_code=400, detail={
+                    "message": f"{len(errors)} adjusted cells fail validation; nothing was applied",
+                    "errors": errors[:100]
+                })
+            change_count = apply_adjustments(db, evaluation)
+
+            data_version = None
+            if change_count:
+                data_version = bump_data_version(db, business_unit)
+            db.commit()
+            read_router.mark_written(user_id, business_unit)
+            if data_version is not None:
+                change_broker.publish(business_unit, data_version)
+            return {
+                "success": True,
+                "matched_rows": int(evaluation.matched.sum()),
+                "changed_cells": change_count,
+                "data_version": data_version,
+                "message": f"Changed {change_count} cells in {int(evaluation.matched.sum())} matched rows"
+            }
+
+        except HTTPException:
+            db.rollback()
+            raise
+        except ScenarioError as e:
+            db.rollback()
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            db.rollback()
+            raise HTTPException(status_code=500, detail=f"Failed to apply adjustments: {str(e)}")
+        finally:
+            db.close()
+
+@app.post("/api/what-if/preview")
+def preview_what_if(request: WhatIfRequest, sample: int = 20):
+    """Totals before and after, validation errors and sample rows for adjustments; writes nothing"""
+    return preview_adjustments(request.user_id, request.business_unit, request.adjustments, sample)
+
+@app.post("/api/what-if/apply")
+def apply_what_if(request: WhatIfRequest):
+    """Apply adjustments with set-based UPDATEs; rejected as a whole if any adjusted cell fails validation"""
+    log_payload("What-if apply request", request)
+    return commit_adjustments(request.user_id, request.business_unit, request.adjustments)
+
+def find_scenario(db: Session, scenario_id: int) -> Scenario:
+    scenario = db.query(Scenario).filter(Scenario.id == scenario_id).first()
+    if scenario is None:
+        raise HTTPException(status_code=404, detail="Scenario not found")
+    return scenario
+
+@app.post("/api/scenarios")
+def save_named_scenario(request: ScenarioRequest, db: Session = Depends(get_db)):
+    """Store named adjustments (replacing the user's scenario of the same name); no rows are copied"""
+    try:
+        scenario = save_scenario(db, request.name, request.user_id, request.business_unit, request.adjustments)
+        db.commit()
+        return {"success": True, "scenario": scenario_record(scenario)}
+    except ScenarioError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to save scenario: {str(e)}")
+
+@app.get("/api/scenarios")
+def list_scenarios(user_id: str, business_unit: Optional[str] = None, db: Session = Depends(get_db)):
+    """Named scenarios of a user"""
+    try:
+        query = db.query(Scenario).filter(Scenario.user_id == user_id)
+        if business_unit:
+            query = query.filter(Scenario.business_unit == business_unit)
+        return {"scenarios": [scenario_record(scenario) for scenario in query.order_by(Scenario.name).all()]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to list scenarios: {str(e)}")
+
+@app.get("/api/scenarios/{scenario_id}")
+def evaluate_scenario(scenario_id: int, sample: int = 20, db: Session = Depends(get_db)):
+    """A named scenario evaluated against the current rows"""
+    scenario = find_scenario(db, scenario_id)
+    preview = preview_adjustments(scenario.user_id, scenario.business_unit, scenario_adjustments(scenario), sample)
+    return {"scenario": scenario_record(scenario), **preview}
+
+@app.post("/api/scenarios/{scenario_id}/apply")
+def apply_scenario(scenario_id: int, db: Session = Depends(get_db)):
+    """Apply a named scenario's adjustments to the current rows (the scenario is kept)"""
+    scenario = find_scenario(db, scenario_id)
+    return commit_adjustments(scenario.user_id, scenario.business_unit, scenario_adjustments(scenario))
+
+@app.delete("/api/scenarios/{scenario_id}")
+def delete_scenario(scenario_id: int, db: Session = Depends(get_db)):
+    """Delete a named scenario"""
+    scenario = find_scenario(db, scenario_id)
+    try:
+        db.delete(scenario)
+        db.commit()
+        return {"success": True}
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to delete scenario: {str(e)}")
+
+@register_handler("analytics_snapshot")
+def refresh_analytics_snapshot(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job handler: rebuild the Parquet snapshot read by the analytics endpoints"""
+    from analytics import refresh_snapshot
+    return refresh_snapshot()
+
+def analytics_groups(group_by: str) -> List[str]:
+    group_columns = [name.strip() for name in group_by.split(',') if name.strip()]
+    if not group_columns or any(name not in ANALYTICS_GROUP_COLUMNS for name in group_columns):
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by must be one or more of: {', '.join(ANALYTICS_GROUP_COLUMNS)}"
+        )
+    return group_columns
+
+def analytics_unavailable(e: AnalyticsUnavailable) -> HTTPException:
+    """503 for analytics that are off or not installed; Retry-After marks it as an expected rejection"""
+    return HTTPException(status_code=503, detail=str(e),
+                         headers={"Retry-After": str(int(config.ANALYTICS_REFRESH_SECONDS))})
+
+@app.get("/api/analytics/status")
+def get_analytics_status():
+    """Analytics engine, data source and the snapshot being queried"""
+    try:
+        return analytics_engine.status()
+    except AnalyticsUnavailable as e:
+        raise analytics_unavailable(e)
+
+@app.get("/api/analytics/trends")
+def get_analytics_trends(
+    group_by: str = 'business_unit',
+    periods: Optional[str] = None,
+    business_unit: Optional[str] = None
+):
+    """Multi-year totals per group, computed by the analytics engine"""
+    from analytics import trends
+    group_columns = analytics_groups(group_by)
+    period_names = [name.strip() for name in periods.split(',') if name.strip()] if periods else PERIOD_COLUMNS
+    invalid = [name for name in period_names if name not in PERIOD_COLUMNS]
+    if not period_names or invalid:
+        raise HTTPException(status_code=400, detail=f"periods must be some of: {', '.join(PERIOD_COLUMNS)}")
+    try:
+        return {"group_by": group_columns, "periods": period_names, **trends(group_columns, period_names, business_unit)}
+    except AnalyticsUnavailable as e:
+        raise analytics_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute trends: {str(e)}")
+
+@app.get("/api/analytics/distribution")
+def get_analytics_distribution(
+    period: str = 'Y2025B',
+    group_by: str = 'business_unit',
+    business_unit: Optional[str] = None
+):
+    """Spread of one period's row values per group (mean, stddev, quantiles)"""
+    from analytics import distribution
+    group_columns = analytics_groups(group_by)
+    if period not in PERIOD_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"period must be one of: {', '.join(PERIOD_COLUMNS)}")
+    try:
+        return {"group_by": group_columns, "period": period, **distribution(period, group_columns, business_unit)}
+    except AnalyticsUnavailable as e:
+        raise analytics_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute distribution: {str(e)}")
+
+@app.get("/api/cycles")
+def get_cycles(db: Session = Depends(get_read_db)):
+    """Stored budget cycles and the active one"""
+    try:
+        return {"active": BUDGET_CYCLE, "cycles": list_cycles(db)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to list budget cycles: {str(e)}")
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Derived metrics selectable with ?metrics= on the row endpoints and rollups"""
+    return {
+        "metrics": [
+            {"name": name, "inputs": inputs, "description": description}
+            for name, (inputs, description, _) in METRICS.items()
+        ]
+    }
+
+@app.get("/api/periods")
+def get_periods(db: Session = Depends(get_read_db)):
+    """Year periods available in the current storage layout"""
+    try:
+        return {"layout": config.STORAGE_LAYOUT, "periods": list_periods(db)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to list periods: {str(e)}")
+
+@app.get("/api/periods/{period}")
+def get_period_values(period: str, business_unit: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """Values of a single period per row, without reading the other year columns"""
+    if period not in list_periods(db):
+        raise HTTPException(status_code=404, detail=f"Unknown period: {period}")
+    
+    try:
+        criteria = [China2025B.business_unit == business_unit] if business_unit else []
+        if shard_router.enabled and not business_unit:
+            parts = shard_router.map(lambda shard: period_values(shard, period))
+            pairs = sorted(pair for part in parts for pair in part)
+        else:
+            pairs = period_values(db, period, *criteria)
+        values = [{"id": row_id, "value": value} for row_id, value in pairs]
+        return {"period": period, "business_unit": business_unit, "values": values, "count": len(values)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch period: {str(e)}")
+
+@app.get("/api/export/{user_id}/{business_unit}")
+def export_budget_data(user_id: str, business_unit: str, db: Session = Depends(get_read_db)):
+    """Download the business unit's data as an Excel file (cached per data version)"""
+    user = db.query(UserSession).filter(
+        and_(
+            UserSession.user_id == user_id,
+            UserSession.business_unit == business_unit
+        )
+    ).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="No data found for user and business unit")
+    
+    from export_service import XLSX_MEDIA_TYPE, get_or_build_xlsx
+    try:
+        path = get_or_build_xlsx(db, business_unit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+    
+    return FileResponse(
+        path,
+        media_type=XLSX_MEDIA_TYPE,
+        filename=f"budget_data_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    )
+
+@app.get("/api/business-units")
+def get_business_units(db: Session = Depends(get_read_db)):
+    """List the business units that have users"""
+    try:
+        rows = db.query(UserSession.business_unit).distinct().order_by(UserSession.business_unit).all()
+        return {"success": True, "business_units": [row[0] for row in rows]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch business units: {str(e)}")
+
+@app.post("/api/admin/submit-all", dependencies=[Depends(require_admin)])
+def submit_all_business_units(db: Session = Depends(get_db)):
+    """Export every business unit from one snapshot in parallel and update PowerBI once"""
+    from export_service import export_all_business_units
+    try:
+        report = export_all_business_units(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch submission failed: {str(e)}")
+    
+    if config.POWERBI_SYNC_ENABLED and report["records"]:
+        try:
+            report["sync"] = sync_all()
+        except Exception as e:
+            report["sync_error"] = str(e)
+    
+    return {"success": True, **report}
+
+@app.get("/api/jobs/{job_id}")
+def get_job_status(job_id: int, db: Session = Depends(get_db)):
+    """Get the status of a background job"""
+    job = get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"success": True, **job}
+
+@app.get("/api/changes")
+def get_changes(
+    since: int = 0,
+    limit: int = 1000,
+    business_unit: Optional[str] = None,
+    cycle: str = BUDGET_CYCLE,
+    db: Session = Depends(get_read_db)
+):
+    """Get cell changes of a budget cycle (the active one by default) with a sequence number greater than `since`"""
+    if shard_router.enabled and not business_unit:
+        raise HTTPException(
+            status_code=400, detail="business_unit is required: sequence numbers are per business unit when sharded"
+        )
+    try:
+        limit = max(1, min(limit, 10000))
+        changes = changes_since(db, since, limit, business_unit, cycle)
+        return {
+            "success": True,
+            "changes": changes,
+            "last_seq": changes[-1]["seq"] if changes else since,
+            "has_more": len(changes) == limit
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch changes: {str(e)}")
+
+@app.get("/api/events")
+async def change_events(request: Request, business_unit: Optional[str] = None):
+    """Server-sent events of (business_unit, data_version) as updates and submits commit"""
+    return StreamingResponse(
+        change_broker.stream(business_unit, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint with environment info"""
-    return {
+    health = {
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
         "environment": config.ENVIRONMENT,
-        "version": "1.0.0"
+        "version": "1.0.0",
+        # Records dropped because the log queue was full (LOG_QUEUE_SIZE)
+        "log_records_dropped": dropped_records()
+    }
+    if powerbi_service.is_configured():
+        health["powerbi_connected"] = powerbi_service.is_connected()
+    return health
+
+@app.get("/api/admission")
+async def get_admission_stats():
+    """In-flight requests, queue depth and rejections per endpoint class"""
+    return {
+        "wait_seconds": config.ADMISSION_WAIT_SECONDS,
+        "max_queue": config.ADMISSION_MAX_QUEUE,
+        "max_queued_per_user": config.ADMISSION_MAX_QUEUED_PER_USER,
+        "classes": admission.snapshot()
     }
 
 @app.get("/api/submission-status/{user_id}/{business_unit}")
-async def get_submission_status(
+def get_submission_status(
     user_id: str, 
     business_unit: str, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get submission status for user"""
     try:
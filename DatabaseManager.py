@@ -1,50 +1,283 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Index
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, DateTime, Boolean, Index, Text, Table, select, func
+from sqlalchemy.engine import URL
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from urllib.parse import quote, unquote
+import logging
 import os
-from dotenv import load_dotenv
+import threading
+import time
+import uuid
 from config import config
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # Use config to get database URL (supports both SQLite and PostgreSQL)
 DATABASE_URL = config.DATABASE_URL
 
-# Configure engine based on database type
-if DATABASE_URL.startswith('postgresql'):
-    engine = create_engine(
-        DATABASE_URL,
-        pool_pre_ping=True,
-        echo=False,
-        pool_size=10,
-        max_overflow=20
-    )
-else:
+def _create_engine(url: Union[str, URL]):
+    # Configure engine based on database type
+    if str(url).startswith('postgresql'):
+        return create_engine(
+            url,
+            pool_pre_ping=True,
+            echo=False,
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW
+        )
     # SQLite configuration for development
-    engine = create_engine(
-        DATABASE_URL, 
+    return create_engine(
+        url, 
         connect_args={"check_same_thread": False},
         pool_pre_ping=True,
-        echo=False
+        echo=False,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW
     )
 
+engine = _create_engine(DATABASE_URL)
+
+# Budget cycle partitioning: the active cycle's rows live in China_<cycle>.
+# On PostgreSQL each cycle table is a LIST partition of budget_rows; on SQLite a
+# cycle can live in its own database file attached as schema "cycle_<cycle>".
+BUDGET_CYCLE = config.BUDGET_CYCLE
+# Placeholder schema of the per-cycle tables, resolved by schema_translate_map
+CYCLE_SCHEMA = "budget_cycle"
+
+def cycle_table_name(cycle: str) -> str:
+    return f"China_{cycle}"
+
+def cycle_db_path(cycle: str) -> str:
+    return os.path.join(config.BUDGET_CYCLE_DB_DIR, f"{cycle_table_name(cycle)}.db")
+
+def cycle_files() -> Dict[str, str]:
+    """Cycle -> database file for every per-cycle SQLite file (plus the active cycle)"""
+    files = {BUDGET_CYCLE: cycle_db_path(BUDGET_CYCLE)}
+    if os.path.isdir(config.BUDGET_CYCLE_DB_DIR):
+        for name in os.listdir(config.BUDGET_CYCLE_DB_DIR):
+            if name.startswith("China_") and name.endswith(".db"):
+                files[name[len("China_"):-len(".db")]] = os.path.join(config.BUDGET_CYCLE_DB_DIR, name)
+    return files
+
+if engine.dialect.name == 'sqlite' and config.BUDGET_CYCLE_DB_DIR:
+    @event.listens_for(engine, "connect")
+    def _attach_cycle_databases(dbapi_connection, connection_record):
+        # SQLite allows 10 attached databases by default
+        os.makedirs(config.BUDGET_CYCLE_DB_DIR, exist_ok=True)
+        for cycle, path in sorted(cycle_files().items()):
+            dbapi_connection.execute(f'ATTACH DATABASE ? AS "cycle_{cycle}"', (path,))
+
+def cycle_schema(cycle: str) -> Optional[str]:
+    """Schema holding a cycle's tables (None is the main database / default schema)"""
+    if engine.dialect.name != 'sqlite' or not config.BUDGET_CYCLE_DB_DIR:
+        return None
+    # Cycles created before per-cycle files were enabled stay in the main file
+    with engine.connect() as conn:
+        in_main = conn.exec_driver_sql(
+            "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+            (cycle_table_name(cycle),)
+        ).first()
+    return None if in_main else f"cycle_{cycle}"
+
+CYCLE_SCHEMA_MAP = {CYCLE_SCHEMA: cycle_schema(BUDGET_CYCLE)}
+engine = engine.execution_options(schema_translate_map=CYCLE_SCHEMA_MAP)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Optional read replicas for GET endpoints; writes always go to the primary
+replica_engines = [
+    _create_engine(url).execution_options(schema_translate_map=CYCLE_SCHEMA_MAP)
+    for url in config.DATABASE_REPLICA_URLS
+]
+
+class ReadRouter:
+    """Picks the engine for read-only sessions
+
+    Replicas are used round-robin. A user or business unit that saved within
+    READ_YOUR_WRITES_SECONDS reads from the primary so it sees its own edits,
+    and a replica that fails to connect is skipped for REPLICA_RETRY_SECONDS.
+    """
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self._next = 0
+        self._recent_writes: Dict[str, float] = {}
+        self._down_until: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def mark_written(self, *keys: Optional[str]):
+        """Pin ``keys`` (user ids, business units) to the primary for the read-your-writes window"""
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if key:
+                    self._recent_writes[key] = now
+            if len(self._recent_writes) > 10000:
+                cutoff = now - config.READ_YOUR_WRITES_SECONDS
+                self._recent_writes = {k: t for k, t in self._recent_writes.items() if t >= cutoff}
+
+    def _pick(self, keys) -> Optional[int]:
+        if not self.replicas:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if key and now - self._recent_writes.get(key, float('-inf')) < config.READ_YOUR_WRITES_SECONDS:
+                    return None
+            for _ in range(len(self.replicas)):
+                index = self._next % len(self.replicas)
+                self._next += 1
+                if self._down_until.get(index, 0) <= now:
+                    return index
+        return None
+
+    def session(self, *keys: Optional[str]):
+        """Session for read-only work, on a healthy replica unless ``keys`` wrote recently"""
+        index = self._pick(keys)
+        if index is None:
+            return SessionLocal()
+        db = SessionLocal(bind=self.replicas[index])
+        try:
+            db.connection()
+        except OperationalError as e:
+            db.close()
+            logger.warning("Read replica %s unavailable, using the primary: %s", index, e)
+            with self._lock:
+                self._down_until[index] = time.monotonic() + config.REPLICA_RETRY_SECONDS
+            return SessionLocal()
+        return db
+
+read_router = ReadRouter(replica_engines)
 Base = declarative_base()
 
+# Column groups shared by the API serializers and the PowerBI exports
+DESCRIPTIVE_COLUMNS = ['Sales_Region', 'Customer_Note', 'Customer_Group', 'BizType',
+    'Vendor_Category', 'Vendor_Grouping', 'ProductNature']
+HISTORY_COLUMNS = ['Y2019A', 'Y2020A', 'Y2021A', 'Y2022A', 'Y2023A', 'Y2024B',
+    'Y2024Q3F', 'Y2024A08', 'Y2024R08', 'avg1924']
+PLAN_COLUMNS = ['Y2025B', 'Y2026P', 'Y2027P', 'Y2028P', 'Y2029P']
+EDITABLE_COLUMNS = PLAN_COLUMNS + ['Sales_Remark']
+PERIOD_COLUMNS = HISTORY_COLUMNS + PLAN_COLUMNS
+
+# Descriptive columns stored as integer keys into small dim_<column> tables
+DIMENSION_COLUMNS = ['Sales_Region', 'Customer_Group', 'BizType',
+    'Vendor_Category', 'Vendor_Grouping', 'ProductNature']
+
+dimension_tables = {
+    column: Table(
+        f"dim_{column}", Base.metadata,
+        Column('id', Integer, primary_key=True, autoincrement=True),
+        Column('value', String, nullable=False, unique=True)
+    )
+    for column in DIMENSION_COLUMNS
+}
+
+class DimensionCache:
+    """Process-wide id -> label lookup for the dimension tables
+
+    The tables are tiny and only grow when new labels are loaded, so they are
+    read once and re-read on a miss (e.g. a label added by another process).
+    """
+    RELOAD_INTERVAL_SECONDS = 5
+
+    def __init__(self):
+        self._labels: Dict[str, List[Optional[str]]] = {}
+        self._keys: Dict[str, Dict[str, int]] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        labels, keys = {}, {}
+        with engine.connect() as conn:
+            for column, table in dimension_tables.items():
+                rows = conn.execute(select(table.c.id, table.c.value)).all()
+                values = [None] * (max((key for key, _ in rows), default=0) + 1)
+                for key, value in rows:
+                    values[key] = value
+                labels[column] = values
+                keys[column] = {value: key for key, value in rows}
+        self._labels, self._keys = labels, keys
+        self._loaded_at = time.monotonic()
+
+    def _reload_on_miss(self) -> bool:
+        with self._lock:
+            if time.monotonic() - self._loaded_at < self.RELOAD_INTERVAL_SECONDS:
+                return False
+            self._load()
+            return True
+
+    def invalidate(self):
+        with self._lock:
+            self._labels, self._keys = {}, {}
+            self._loaded_at = 0.0
+
+    def labels(self, column: str) -> List[Optional[str]]:
+        """Label list indexed by key (index 0 and unused keys are None)"""
+        if not self._labels:
+            with self._lock:
+                if not self._labels:
+                    self._load()
+        return self._labels[column]
+
+    def label(self, column: str, key: Optional[int]) -> Optional[str]:
+        if key is None:
+            return None
+        values = self.labels(column)
+        if key >= len(values) or values[key] is None:
+            if not self._reload_on_miss():
+                return None
+            values = self._labels[column]
+            if key >= len(values):
+                return None
+        return values[key]
+
+    def decode(self, column: str, keys: Iterable[Optional[int]]) -> List[Optional[str]]:
+        """Labels for many keys at once"""
+        return [self.label(column, key) for key in keys]
+
+    def key(self, column: str, value: Optional[str]) -> Optional[int]:
+        """Key of a label, or None if the label does not exist"""
+        if value is None:
+            return None
+        self.labels(column)
+        key = self._keys[column].get(value)
+        if key is None and self._reload_on_miss():
+            key = self._keys[column].get(value)
+        return key
+
+dimension_cache = DimensionCache()
+
+def decode_dimensions(rows, names: List[str]):
+    """Yield query result tuples with dimension keys replaced by their labels"""
+    positions = [(i, name) for i, name in enumerate(names) if name in DIMENSION_COLUMNS]
+    if not positions:
+        yield from (tuple(row) for row in rows)
+        return
+    for row in rows:
+        row = list(row)
+        for i, name in positions:
+            row[i] = dimension_cache.label(name, row[i])
+        yield tuple(row)
+
 class China2025B(Base):
-    __tablename__ = "China_2025B"
+    # Rows of the active budget cycle (China_2025B unless BUDGET_CYCLE says otherwise)
+    __tablename__ = cycle_table_name(BUDGET_CYCLE)
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    budget_cycle = Column(String, nullable=False, default=BUDGET_CYCLE)
     user_id = Column(String, nullable=False, index=True)
     business_unit = Column(String, nullable=False, index=True)
-    Sales_Region = Column(String, nullable=True)
+    # Dimension keys; the string attributes are resolved through dimension_cache
+    Sales_Region_id = Column(Integer, nullable=True)
     Customer_Note = Column(String, nullable=True)
-    Customer_Group = Column(String, nullable=True)
-    BizType = Column(String, nullable=True)
-    Vendor_Category = Column(String, nullable=True)
-    Vendor_Grouping = Column(String, nullable=True)
-    ProductNature = Column(String, nullable=True)
+    Customer_Group_id = Column(Integer, nullable=True)
+    BizType_id = Column(Integer, nullable=True)
+    Vendor_Category_id = Column(Integer, nullable=True)
+    Vendor_Grouping_id = Column(Integer, nullable=True)
+    ProductNature_id = Column(Integer, nullable=True)
     Y2019A = Column(Float, nullable=True)
     Y2020A = Column(Float, nullable=True)
     Y2021A = Column(Float, nullable=True)
@@ -62,11 +295,26 @@ class China2025B(Base):
     Y2029P = Column(Float, nullable=True)
     Sales_Remark = Column(String, nullable=True)
     
-    # Indexes for performance
+    # Indexes for performance (PostgreSQL index names are unique per schema)
     __table_args__ = (
-        Index('idx_user_id', 'user_id'),
+        Index('idx_user_id' if BUDGET_CYCLE == '2025B' else f'idx_user_id_{BUDGET_CYCLE}', 'user_id'),
+        # Dimension filters of /api/query; edits never touch these columns
+        *[Index(f'idx_{BUDGET_CYCLE}_{column}', f'{column}_id') for column in DIMENSION_COLUMNS],
+        {'schema': CYCLE_SCHEMA},
     )
 
+def _dimension_label(column: str):
+    return property(lambda self: dimension_cache.label(column, getattr(self, f"{column}_id")))
+
+for _column in DIMENSION_COLUMNS:
+    setattr(China2025B, _column, _dimension_label(_column))
+
+def column_expression(name: str):
+    """SQL column for an API column name (dimension columns map to their key column)"""
+    if name in DIMENSION_COLUMNS:
+        return getattr(China2025B, f"{name}_id")
+    return getattr(China2025B, name)
+
 class UserSession(Base):
     __tablename__ = "user_sessions"
     
@@ -79,8 +327,375 @@ class UserSession(Base):
         Index('idx_user_sessions_user_id', 'user_id'),
     )
 
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+    
+    business_unit = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class ChangeJournal(Base):
+    __tablename__ = "change_journal"
+    
+    # Monotonic sequence number; AUTOINCREMENT keeps SQLite from reusing values
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    row_id = Column(Integer, nullable=False)
+    # Row ids are only unique within a cycle's table (or cycle file)
+    budget_cycle = Column(String, nullable=False, default=BUDGET_CYCLE)
+    business_unit = Column(String, nullable=False)
+    column_name = Column(String, nullable=False)
+    old_value = Column(String, nullable=True)
+    new_value = Column(String, nullable=True)
+    user_id = Column(String, nullable=False)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Indexes for performance
+    __table_args__ = (
+        Index('idx_change_journal_row_id', 'row_id'),
+        Index('idx_change_journal_bu_seq', 'business_unit', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+
+class BudgetFact(Base):
+    """One year-column cell of a budget row (used when STORAGE_LAYOUT is 'long')"""
+    __tablename__ = f"budget_facts_{BUDGET_CYCLE}"
+    
+    row_id = Column(Integer, primary_key=True)
+    period = Column(String, primary_key=True)
+    value = Column(Float, nullable=True)
+    
+    # Indexes for performance
+    __table_args__ = (
+        Index(f'idx_budget_facts_{BUDGET_CYCLE}_period', 'period', 'row_id'),
+        {'schema': CYCLE_SCHEMA},
+    )
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+    
+    # One watermark per downstream consumer (e.g. the PowerBI push dataset)
+    name = Column(String, primary_key=True)
+    last_seq = Column(Integer, nullable=False, default=0)
+    last_synced_at = Column(DateTime, nullable=True)
+    rows_pushed = Column(Integer, nullable=False, default=0)
+
+class Job(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)
+    # Jobs with the same kind and key are coalesced while still queued (e.g. one submit per BU)
+    dedupe_key = Column(String, nullable=True)
+    payload = Column(Text, nullable=True)
+    status = Column(String, nullable=False, default='queued')  # queued, running, succeeded, failed, coalesced
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    coalesced_into = Column(Integer, nullable=True)
+    last_error = Column(Text, nullable=True)
+    result = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Indexes for performance
+    __table_args__ = (
+        Index('idx_jobs_status_run_after', 'status', 'run_after'),
+        Index('idx_jobs_kind_key', 'kind', 'dedupe_key'),
+    )
+
+class Scenario(Base):
+    __tablename__ = "scenarios"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    business_unit = Column(String, nullable=False)
+    # JSON list of what-if adjustments, applied in order to the current rows whenever evaluated
+    adjustments = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Indexes for performance
+    __table_args__ = (
+        Index('idx_scenarios_owner_name', 'user_id', 'business_unit', 'name', unique=True),
+    )
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    
+    version = Column(Integer, primary_key=True)
+    description = Column(String, nullable=True)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+# Tables that move into the per-business-unit files when SQLITE_SHARD_DIR is set
+SHARD_TABLES = [China2025B.__table__, BudgetFact.__table__, ChangeJournal.__table__, DataVersion.__table__]
+
+class ShardRouter:
+    """Engines for per-business-unit SQLite files (SQLITE_SHARD_DIR)
+
+    Each business unit's rows, year cells, change journal and data version live
+    in <dir>/<business unit>.db, so saves to different business units commit to
+    different files and never wait on each other's write lock. Every shard
+    connection attaches the primary database as "portal", so users, jobs,
+    dimension labels and earlier cycles still resolve by table name.
+
+    A shard is built once from the business unit's rows in the primary (ids and
+    journal sequence numbers are kept); the primary's copy is not read after that.
+    Each shard records the primary's database_stamp() it was built from, and a
+    shard of another primary (e.g. one recreated by GetData.py) is refused.
+    """
+    PRIMARY_SCHEMA = "portal"
+    # One-row table in every shard: the stamp of the primary it was built from
+    BUILD_TABLE = "shard_build"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._engines: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._primary_stamp: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def path(self, business_unit: str) -> str:
+        # Percent-encoded so any business unit name (spaces, "/") is one file name
+        return os.path.join(self.directory, f"{quote(business_unit, safe='')}.db")
+
+    def business_units(self) -> List[str]:
+        """Business units that have a shard file"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(unquote(name[:-len(".db")]) for name in os.listdir(self.directory) if name.endswith(".db"))
+
+    def _open(self, path: str):
+        # URL.create keeps the path as is; a "sqlite:///..." string would have its %XX escapes decoded
+        shard_engine = _create_engine(URL.create("sqlite", database=path))
+        primary = engine.url.database
+
+        @event.listens_for(shard_engine, "connect")
+        def _attach_primary(dbapi_connection, connection_record):
+            dbapi_connection.execute(f'ATTACH DATABASE ? AS "{self.PRIMARY_SCHEMA}"', (primary,))
+        return shard_engine.execution_options(schema_translate_map={CYCLE_SCHEMA: None})
+
+    def _known(self, business_unit: str) -> bool:
+        """Whether the primary has rows or users for the business unit"""
+        with engine.connect() as conn:
+            return conn.execute(
+                select(UserSession.id).where(UserSession.business_unit == business_unit).limit(1)
+            ).first() is not None or conn.execute(
+                select(China2025B.id).where(China2025B.business_unit == business_unit).limit(1)
+            ).first() is not None
+
+    def primary_stamp(self) -> str:
+        if self._primary_stamp is None:
+            db = SessionLocal()
+            try:
+                self._primary_stamp = database_stamp(db)
+            finally:
+                db.close()
+        return self._primary_stamp
+
+    def _check_build(self, business_unit: str, shard_engine):
+        """Refuse a shard built from another primary database; upgrade shards built by earlier versions"""
+        from migrations import ensure_journal_cycle
+        with shard_engine.begin() as conn:
+            ensure_journal_cycle(conn)
+            if not conn.exec_driver_sql(
+                "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (self.BUILD_TABLE,)
+            ).first():
+                logger.warning("Shard for business unit %s has no build stamp; assuming it matches the primary",
+                               business_unit)
+                self._stamp(conn)
+                return
+            stamp = conn.exec_driver_sql(f'SELECT primary_stamp FROM main."{self.BUILD_TABLE}"').scalar()
+        if stamp != self.primary_stamp():
+            # The shard holds the business unit's only copy of its edits, so it is never replaced silently
+            raise RuntimeError(
+                f"Shard {self.path(business_unit)} was built from another database (stamp {stamp}, the primary "
+                f"is {self.primary_stamp()}). If the primary was recreated, delete {self.directory} to rebuild the shards."
+            )
+
+    def _stamp(self, conn):
+        conn.exec_driver_sql(
+            f'CREATE TABLE IF NOT EXISTS main."{self.BUILD_TABLE}" (primary_stamp VARCHAR NOT NULL, built_at DATETIME NOT NULL)'
+        )
+        conn.exec_driver_sql(f'DELETE FROM main."{self.BUILD_TABLE}"')
+        conn.exec_driver_sql(
+            f'INSERT INTO main."{self.BUILD_TABLE}" (primary_stamp, built_at) VALUES (?, ?)',
+            (self.primary_stamp(), datetime.utcnow())
+        )
+
+    def _build(self, business_unit: str, path: str):
+        """Copy the business unit's rows out of the primary into a new shard file"""
+        from budget_search import ensure_search_indexes
+        os.makedirs(self.directory, exist_ok=True)
+        # Built under a temporary name, so a crash never leaves a half-copied shard behind
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        build_engine = self._open(tmp_path)
+        try:
+            # checkfirst would find the primary's tables through the attached schema
+            Base.metadata.create_all(bind=build_engine, tables=SHARD_TABLES, checkfirst=False)
+            source = self.PRIMARY_SCHEMA
+            rows = China2025B.__tablename__
+            filters = {
+                rows: "business_unit = ?",
+                BudgetFact.__tablename__: f'row_id IN (SELECT id FROM main."{rows}")',
+                ChangeJournal.__tablename__: "business_unit = ?",
+                DataVersion.__tablename__: "business_unit = ?",
+            }
+            with build_engine.begin() as conn:
+                for table in SHARD_TABLES:
+                    if not conn.exec_driver_sql(
+                        f"SELECT 1 FROM \"{source}\".sqlite_master WHERE type = 'table' AND name = ?", (table.name,)
+                    ).first():
+                        continue
+                    names = ", ".join(f'"{column.name}"' for column in table.columns)
+                    where = filters[table.name]
+                    conn.exec_driver_sql(
+                        f'INSERT INTO main."{table.name}" ({names}) '
+                        f'SELECT {names} FROM "{source}"."{table.name}" WHERE {where}',
+                        (business_unit,) if '?' in where else ()
+                    )
+                ensure_search_indexes(conn)
+                self._stamp(conn)
+        finally:
+            build_engine.dispose()
+        os.replace(tmp_path, path)
+        logger.info("Created shard for business unit %s: %s", business_unit, path)
+
+    def engine(self, business_unit: str):
+        """The business unit's shard engine, building the shard on first use (None if the BU is unknown)"""
+        with self._lock:
+            shard_engine = self._engines.get(business_unit)
+            if shard_engine is None:
+                path = self.path(business_unit)
+                if not os.path.exists(path):
+                    if not self._known(business_unit):
+                        return None
+                    self._build(business_unit, path)
+                shard_engine = self._open(path)
+                try:
+                    self._check_build(business_unit, shard_engine)
+                except Exception:
+                    shard_engine.dispose()
+                    raise
+                self._engines[business_unit] = shard_engine
+            return shard_engine
+
+    def session(self, business_unit: str):
+        """Session on the business unit's shard; the primary for business units without one"""
+        shard_engine = self.engine(business_unit)
+        return SessionLocal(bind=shard_engine) if shard_engine is not None else SessionLocal()
+
+    def ensure_shards(self):
+        """Build a shard for every business unit with rows or users in the primary"""
+        with engine.connect() as conn:
+            business_units = set(conn.execute(select(UserSession.business_unit).distinct()).scalars())
+            business_units.update(conn.execute(select(China2025B.business_unit).distinct()).scalars())
+        for business_unit in sorted(business_units):
+            self.engine(business_unit)
+
+    def map(self, fn: Callable, business_units: Optional[Iterable[str]] = None) -> list:
+        """fn(session) on every shard (or the listed business units) in parallel, in business unit order"""
+        if business_units is None:
+            business_units = self.business_units()
+        business_units = [bu for bu in business_units if self.engine(bu) is not None]
+
+        def run(business_unit):
+            db = self.session(business_unit)
+            try:
+                return fn(db)
+            finally:
+                db.close()
+
+        if len(business_units) <= 1:
+            return [run(business_unit) for business_unit in business_units]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=config.SHARD_FANOUT_WORKERS, thread_name_prefix="shard-fanout"
+                )
+        return list(self._executor.map(run, business_units))
+
+if config.SQLITE_SHARD_DIR and engine.dialect.name != 'sqlite':
+    logger.warning("SQLITE_SHARD_DIR only applies to SQLite databases; ignoring it")
+if config.SQLITE_SHARD_DIR and config.BUDGET_CYCLE_DB_DIR and engine.dialect.name == 'sqlite':
+    raise RuntimeError("SQLITE_SHARD_DIR and BUDGET_CYCLE_DB_DIR cannot be combined")
+shard_router = ShardRouter(config.SQLITE_SHARD_DIR if engine.dialect.name == 'sqlite' else '')
+
+def business_unit_session(business_unit: Optional[str]):
+    """Session on the database holding a business unit's rows (the primary unless sharded)"""
+    if business_unit and shard_router.enabled:
+        return shard_router.session(business_unit)
+    return SessionLocal()
+
+def all_data_versions(db) -> Dict[str, int]:
+    """Data version of every business unit, read from every shard when sharded"""
+    def read(session):
+        return dict(session.query(DataVersion.business_unit, DataVersion.version).all())
+    if not shard_router.enabled:
+        return read(db)
+    versions = {}
+    for part in shard_router.map(read):
+        versions.update(part)
+    return versions
+
+def get_data_version(db, business_unit: str) -> int:
+    """Current data version of a business unit (0 if it was never updated)"""
+    row = db.query(DataVersion).filter(DataVersion.business_unit == business_unit).first()
+    return row.version if row else 0
+
+def database_stamp(db) -> str:
+    """Identity of this database build: when its first schema migration was applied
+
+    A database recreated by GetData.py gets a new stamp, while its data versions start again from 0.
+    """
+    applied_at = db.query(func.min(SchemaVersion.applied_at)).scalar()
+    return applied_at.strftime('%Y%m%d%H%M%S%f') if applied_at else '0'
+
+def bump_data_version(db, business_unit: str) -> int:
+    """Increment the business unit's data version inside the caller's transaction"""
+    row = db.query(DataVersion).filter(DataVersion.business_unit == business_unit).first()
+    if row:
+        row.version += 1
+        row.updated_at = datetime.utcnow()
+    else:
+        row = DataVersion(business_unit=business_unit, version=1, updated_at=datetime.utcnow())
+        db.add(row)
+    return row.version
+
 def create_tables():
-    Base.metadata.create_all(bind=engine)
+    from migrations import run_migrations, schema_is_current
+    from budget_cycles import ensure_cycle_partition
+    from budget_search import ensure_search_indexes
+    if schema_is_current(engine, Base.metadata.sorted_tables):
+        # Restart of an up-to-date database: skip create_all's per-table checks and the migrations
+        logger.info("Database schema is current")
+        if shard_router.enabled:
+            # Business units added to the primary since the last start get their shard
+            shard_router.ensure_shards()
+        return
+    if engine.dialect.name == 'postgresql':
+        # The cycle table is created as a partition of budget_rows, not by create_all
+        Base.metadata.create_all(
+            bind=engine,
+            tables=[table for table in Base.metadata.sorted_tables if table is not China2025B.__table__]
+        )
+        run_migrations(engine)
+        ensure_cycle_partition(engine, BUDGET_CYCLE)
+    else:
+        Base.metadata.create_all(bind=engine)
+        # Changes to tables that already exist are applied by the migrations
+        run_migrations(engine)
+    # A cycle started after the search migration ran still needs its note index
+    with engine.begin() as conn:
+        ensure_search_indexes(conn)
+    if shard_router.enabled:
+        shard_router.ensure_shards()
 
 def get_db():
     db = SessionLocal()
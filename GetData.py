@@ -1,7 +1,15 @@
+import logging
 import os
 import random
 import sqlite3
 import pandas as pd
+import pyarrow as pa
+
+from DatabaseManager import BUDGET_CYCLE, DIMENSION_COLUMNS, cycle_table_name
+from export_service import SOURCE_SCHEMA, SUBMISSION_SCHEMA, SOURCE_FEED_NAME, SUBMISSION_FEED_NAME, write_parquet
+from portal_logging import setup_logging
+
+logger = logging.getLogger("GetData")
 
 def retrieve_data():
     try:
@@ -30,40 +38,42 @@ def retrieve_data():
 
         df['Sales_Remark'] = ''
         df['Sales_Remark'] = df['Sales_Remark'].astype(str)
-        print(df.columns)
+        logger.debug("Columns: %s", list(df.columns))
         return df
         
     except FileNotFoundError:
-        print("Error: 2025B_Rev.xlsx file not found")
+        logger.error("2025B_Rev.xlsx file not found")
     except KeyError as e:
-        print(f"Error: Column not found - {str(e)}")
+        logger.error("Column not found - %s", e)
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception("Could not read 2025B_Rev.xlsx: %s", e)
         
 def create_database():
     db_path = "China_2025B.db"
     if os.path.exists(db_path):
         os.remove(db_path)
-        print(f"Removed existing database: {db_path}")
+        logger.info("Removed existing database: %s", db_path)
     
-    print("Generating data...")
+    logger.info("Generating data...")
     df = retrieve_data()
     if df is not None:
         conn = sqlite3.connect(db_path)
         
-        # Create China_2025B table
-        create_table_sql = """
-        CREATE TABLE China_2025B (
+        # Create the budget cycle's table (China_2025B unless BUDGET_CYCLE is set)
+        table_name = cycle_table_name(BUDGET_CYCLE)
+        create_table_sql = f"""
+        CREATE TABLE {table_name} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            budget_cycle TEXT NOT NULL DEFAULT '{BUDGET_CYCLE}',
             user_id TEXT NOT NULL,
             business_unit TEXT NOT NULL,
-            Sales_Region VARCHAR(100),
+            Sales_Region_id INTEGER,
             Customer_Note VARCHAR(255),
-            Customer_Group VARCHAR(100),
-            BizType VARCHAR(50),
-            Vendor_Category VARCHAR(100),
-            Vendor_Grouping VARCHAR(100),
-            ProductNature VARCHAR(100),
+            Customer_Group_id INTEGER,
+            BizType_id INTEGER,
+            Vendor_Category_id INTEGER,
+            Vendor_Grouping_id INTEGER,
+            ProductNature_id INTEGER,
             Y2019A DECIMAL(15,2),
             Y2020A DECIMAL(15,2),
             Y2021A DECIMAL(15,2),
@@ -95,54 +105,63 @@ def create_database():
         """
         
         conn.execute(create_sessions_sql)
-        df.to_sql('China_2025B', conn, if_exists='append', index=False)
+        
+        # Descriptive columns repeat a handful of labels: store each label once in
+        # a dim_<column> table and keep only its integer key on the budget rows
+        rows = df.copy()
+        for col in DIMENSION_COLUMNS:
+            conn.execute(f"""
+            CREATE TABLE dim_{col} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                value VARCHAR NOT NULL UNIQUE
+            );
+            """)
+            codes, labels = pd.factorize(rows[col])
+            pd.DataFrame({'id': range(1, len(labels) + 1), 'value': labels}).to_sql(
+                f'dim_{col}', conn, if_exists='append', index=False
+            )
+            rows[f'{col}_id'] = pd.Series(codes + 1, index=rows.index).where(codes >= 0).astype('Int64')
+            rows = rows.drop(columns=col)
+        rows.to_sql(table_name, conn, if_exists='append', index=False)
         
         user_sessions = df[['user_id', 'business_unit']].drop_duplicates()
         user_sessions.to_sql('user_sessions', conn, if_exists='append', index=False)
 
         # Create indexes
-        conn.execute("CREATE INDEX idx_user_id ON China_2025B(user_id);")
+        conn.execute(f"CREATE INDEX idx_user_id ON {table_name}(user_id);")
         conn.execute("CREATE INDEX idx_user_sessions_user_id ON user_sessions(user_id);")
         
         conn.commit()
         conn.close()
         
-        print(f"✅ Sample database created: {db_path}")
-        
-        # Display summary
-        print("\n📊 Sample Data Summary:")
-        print(f"Total records: {len(df)}")
-        print(f"Business units: {df['business_unit'].nunique()}")
-        print(f"Users: {df['user_id'].nunique()}")
+        logger.info("Sample database created: %s (%s records, %s business units, %s users)",
+                    db_path, len(df), df['business_unit'].nunique(), df['user_id'].nunique())
 
 def create_powerbi_sample_data():
-    """Create sample data in PowerBI format (CSV files)"""
+    """Create sample data in PowerBI format (typed Parquet files)"""
     
-    print("\n📋 Creating PowerBI sample data files...")
+    logger.info("Creating PowerBI sample data files...")
     
     df = retrieve_data()
     
     if df is not None:
     
         # Create PowerBI source data (read-only columns)
-        powerbi_source = df[['Sales_Region', 'Customer_Note', 'Customer_Group', 'BizType',
-            'Vendor_Category', 'Vendor_Grouping', 'ProductNature', 'user_id',
-            'business_unit', 'Y2019A', 'Y2020A', 'Y2021A', 'Y2022A', 'Y2023A', 'Y2024B',
-            'Y2024Q3F', 'Y2024A08', 'Y2024R08', 'avg1924']].copy()
-
-        powerbi_source.to_csv('China_2025B_powerbi_source_data.csv', index=False)
+        powerbi_source = pa.Table.from_pandas(df, schema=SOURCE_SCHEMA, preserve_index=False)
+        source_path = write_parquet(powerbi_source, SOURCE_FEED_NAME)
         
         # Create PowerBI submission data (editable columns that get updated)
-        submitted_data = df[['user_id', 'business_unit', 'Y2025B', 'Y2026P', 'Y2027P', 'Y2028P', 'Y2029P', 'Sales_Remark']].copy()
-        submitted_data.to_csv('China_2025B_powerbi_submission_data.csv', index=False)
+        submitted_data = pa.Table.from_pandas(df, schema=SUBMISSION_SCHEMA, preserve_index=False)
+        submission_path = write_parquet(submitted_data, SUBMISSION_FEED_NAME)
+        
+        logger.info("PowerBI files written: %s, %s", source_path, submission_path)
         
 
 if __name__ == "__main__":
+    setup_logging()
     try:
         create_database()
         create_powerbi_sample_data()
         
     except Exception as e:
-        print(f"❌ Error generating sample data: {str(e)}")
-        import traceback
-        traceback.print_exc()
\ No newline at end of file
+        logger.exception("Error generating sample data: %s", e)
\ No newline at end of file
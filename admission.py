@@ -0,0 +1,206 @@
+"""Admission control: bounded in-flight API requests per endpoint class
+
+Every request is classified (read, write, export) and must take one of its
+class's slots before it runs, so the requests in flight stay below the
+database pool size instead of piling up on connection checkouts. Requests
+waiting for a slot are queued per user and admitted round-robin across
+users, so one client retrying a burst cannot starve the others. A request
+that would wait longer than ADMISSION_WAIT_SECONDS, or finds the queue full,
+gets 503 with Retry-After right away.
+
+All bookkeeping happens on the event loop, so it needs no locks.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+
+from starlette.responses import JSONResponse
+
+from config import config
+
+# Long-lived or trivial endpoints that never touch the pool for long
+EXEMPT_PATHS = {'/api/health', '/api/events', '/api/admission', '/docs', '/redoc', '/openapi.json'}
+EXPORT_PREFIXES = ('/api/export/', '/api/arrow')
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+# Paths whose third segment is the user id, e.g. /api/data/{user_id}/{business_unit}
+USER_PATH_PREFIXES = {'data', 'import', 'export', 'submission-status'}
+
+# Weight of the latest request in the moving average of service time
+SERVICE_TIME_SMOOTHING = 0.1
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class FairLimiter:
+    """At most ``limit`` requests in flight; waiting requests are admitted round-robin by user"""
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.queued = 0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "overloaded": 0, "timeout": 0}
+        self.waited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.service_average = 0.0
+
+    def ahead(self, user: str) -> int:
+        """Queued requests admitted before a new one from ``user`` under round-robin"""
+        own = len(self._queues.get(user, ()))
+        return own + sum(min(len(queue), own + 1) for name, queue in self._queues.items() if name != user)
+
+    def expected_wait(self, user: str) -> float:
+        return (self.ahead(user) + 1) / self.limit * self.service_average
+
+    def _reject(self, reason: str, user: str):
+        self.rejected[reason] += 1
+        raise AdmissionRejected(reason, max(1, math.ceil(self.expected_wait(user))))
+
+    async def acquire(self, user: str):
+        if self.in_flight < self.limit and not self.queued:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        queue = self._queues.get(user)
+        if self.queued >= config.ADMISSION_MAX_QUEUE or (
+                queue is not None and len(queue) >= config.ADMISSION_MAX_QUEUED_PER_USER):
+            self._reject("queue_full", user)
+        if self.expected_wait(user) > config.ADMISSION_WAIT_SECONDS:
+            # The requests ahead will not finish within the budget; fail now rather than after waiting
+            self._reject("overloaded", user)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append(future)
+        self.queued += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait({future}, timeout=config.ADMISSION_WAIT_SECONDS)
+        except asyncio.CancelledError:
+            # Client went away while queued
+            if future.done():
+                self.release()
+            else:
+                self._remove(user, future)
+            raise
+        if not future.done():
+            self._remove(user, future)
+            self._reject("timeout", user)
+
+        waited = time.monotonic() - start
+        self.admitted += 1
+        self.waited += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def _remove(self, user: str, future: asyncio.Future):
+        future.cancel()
+        queue = self._queues.get(user)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+            if not queue:
+                del self._queues[user]
+
+    def release(self, service_time: Optional[float] = None):
+        if service_time is not None:
+            self.service_average += SERVICE_TIME_SMOOTHING * (service_time - self.service_average)
+        self.in_flight -= 1
+        # Hand the slot to the first waiting user and move them to the back of the line
+        while self._queues and self.in_flight < self.limit:
+            user, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "queued_users": len(self._queues),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "average_wait_ms": round(self.wait_total / self.waited * 1000, 1) if self.waited else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 1),
+            "average_service_ms": round(self.service_average * 1000, 1)
+        }
+
+def endpoint_class(method: str, path: str) -> Optional[str]:
+    """'read', 'write' or 'export'; None for requests that are never queued"""
+    if method == 'OPTIONS' or path in EXEMPT_PATHS:
+        return None
+    if path.startswith(EXPORT_PREFIXES):
+        return 'export'
+    if method in WRITE_METHODS:
+        return 'write'
+    return 'read'
+
+def request_user(scope) -> str:
+    """The user a request is queued under: X-User-Id, user_id, the path, else the client address"""
+    for name, value in scope.get('headers', []):
+        if name == b'x-user-id' and value:
+            return value.decode('latin-1')
+    for pair in scope.get('query_string', b'').decode('latin-1').split('&'):
+        name, _, value = pair.partition('=')
+        if name == 'user_id' and value:
+            return value
+    parts = scope['path'].split('/')
+    if len(parts) > 3 and parts[1] == 'api' and parts[2] in USER_PATH_PREFIXES:
+        return parts[3]
+    client = scope.get('client')
+    return f"client:{client[0]}" if client else "anonymous"
+
+class AdmissionController:
+    def __init__(self):
+        limits = {
+            'read': config.ADMISSION_READ_LIMIT,
+            'write': config.ADMISSION_WRITE_LIMIT,
+            'export': config.ADMISSION_EXPORT_LIMIT
+        }
+        # A limit of 0 turns admission control off for that class
+        self.limiters = {name: FairLimiter(name, limit) for name, limit in limits.items() if limit > 0}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: limiter.snapshot() for name, limiter in self.limiters.items()}
+
+admission = AdmissionController()
+
+class AdmissionMiddleware:
+    """ASGI middleware holding a slot of the request's class until the response is sent"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        limiter = admission.limiters.get(endpoint_class(scope['method'], scope['path']))
+        if limiter is None:
+            return await self.app(scope, receive, send)
+        try:
+            await limiter.acquire(request_user(scope))
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": f"Server busy ({limiter.name} requests, {e.reason}); "
+                                   f"retry in {e.retry_after} seconds"},
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            return await response(scope, receive, send)
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - start)
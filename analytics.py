@@ -0,0 +1,289 @@
+"""Optional DuckDB analytics sidecar for read-only analytical queries
+
+With ANALYTICS_ENGINE=duckdb, trend and distribution queries run in an
+embedded DuckDB instead of the database that serves grid saves. DuckDB reads
+either a Parquet snapshot of the active cycle's rows (ANALYTICS_SOURCE=parquet,
+any database and storage layout) or the SQLite file itself, attached read-only
+(ANALYTICS_SOURCE=sqlite, wide layout; needs DuckDB's sqlite extension).
+
+Snapshots are rebuilt by a background job once the data versions have moved
+and the current snapshot is ANALYTICS_REFRESH_SECONDS old; queries meanwhile
+use the previous snapshot and report which versions it holds.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Any, Dict, List, Optional
+
+from DatabaseManager import (
+    BUDGET_CYCLE, China2025B, CYCLE_SCHEMA, CYCLE_SCHEMA_MAP, DIMENSION_COLUMNS, PERIOD_COLUMNS,
+    SessionLocal, all_data_versions, cycle_db_path, decode_dimensions, engine, shard_router
+)
+from fact_store import is_long_layout, select_rows
+from config import config
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_NAME = f"{China2025B.__tablename__}_analytics"
+GROUP_COLUMNS = ['business_unit'] + DIMENSION_COLUMNS
+# Snapshots kept on disk; queries started before a refresh may still read the previous one
+KEEP_SNAPSHOTS = 2
+QUANTILES = [0.1, 0.5, 0.9]
+
+class AnalyticsUnavailable(RuntimeError):
+    """Analytics are disabled or DuckDB is not installed"""
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def read_versions(db) -> Dict[str, int]:
+    return all_data_versions(db)
+
+def _snapshot_rows(db, names: List[str]):
+    """Rows of the active cycle, shard after shard when sharded"""
+    if not shard_router.enabled:
+        yield from select_rows(db, names)
+        return
+    for business_unit in shard_router.business_units():
+        shard = shard_router.session(business_unit)
+        try:
+            yield from select_rows(shard, names)
+        finally:
+            shard.close()
+
+def _manifest_path() -> str:
+    return os.path.join(config.ANALYTICS_DIR, f"{SNAPSHOT_NAME}.json")
+
+def read_manifest() -> Optional[Dict[str, Any]]:
+    """The current snapshot: path, data versions, build time and row count"""
+    try:
+        with open(_manifest_path()) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if os.path.exists(manifest.get("path", "")) else None
+
+def _remove_old_snapshots():
+    snapshots = sorted(
+        name for name in os.listdir(config.ANALYTICS_DIR)
+        if name.startswith(f"{SNAPSHOT_NAME}_") and name.endswith(".parquet")
+    )
+    for name in snapshots[:-KEEP_SNAPSHOTS]:
+        try:
+            os.remove(os.path.join(config.ANALYTICS_DIR, name))
+        except OSError:
+            pass
+
+def build_snapshot() -> Dict[str, Any]:
+    """Write the active cycle's rows to a new Parquet file and point the manifest at it"""
+    import pyarrow.parquet as pq
+    from export_service import FULL_SCHEMA, rows_to_table
+
+    os.makedirs(config.ANALYTICS_DIR, exist_ok=True)
+    start = time.perf_counter()
+    path = os.path.join(config.ANALYTICS_DIR, f"{SNAPSHOT_NAME}_{int(time.time() * 1000)}.parquet")
+    db = SessionLocal()
+    try:
+        # Read first: a save during the build only makes the snapshot look older than it is
+        versions = read_versions(db)
+        rows = iter(decode_dimensions(_snapshot_rows(db, FULL_SCHEMA.names), FULL_SCHEMA.names))
+        count = 0
+        with pq.ParquetWriter(path + ".tmp", FULL_SCHEMA, compression=config.PARQUET_COMPRESSION) as writer:
+            while True:
+                chunk = list(islice(rows, config.EXPORT_CHUNK_SIZE))
+                if not chunk:
+                    break
+                writer.write_table(rows_to_table(chunk, FULL_SCHEMA))
+                count += len(chunk)
+    finally:
+        db.close()
+    os.replace(path + ".tmp", path)
+
+    manifest = {
+        "path": path,
+        "versions": versions,
+        "built_at": datetime.utcnow().isoformat(),
+        "rows": count
+    }
+    with open(_manifest_path() + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(_manifest_path() + ".tmp", _manifest_path())
+    _remove_old_snapshots()
+    logger.info("Analytics snapshot of %s rows written in %.2fs", count, time.perf_counter() - start)
+    return manifest
+
+_build_lock = threading.Lock()
+
+def refresh_snapshot() -> Dict[str, Any]:
+    """Build a snapshot unless the current one already holds the latest data versions"""
+    with _build_lock:
+        manifest = read_manifest()
+        if manifest is not None:
+            db = SessionLocal()
+            try:
+                if read_versions(db) == manifest["versions"]:
+                    return manifest
+            finally:
+                db.close()
+        return build_snapshot()
+
+def request_refresh():
+    """Queue a snapshot rebuild (one queued rebuild at a time)"""
+    from job_queue import enqueue
+    db = SessionLocal()
+    try:
+        enqueue(db, "analytics_snapshot", {}, dedupe_key=SNAPSHOT_NAME)
+        db.commit()
+    finally:
+        db.close()
+
+class AnalyticsEngine:
+    """One embedded DuckDB per process; every query runs on its own cursor"""
+    def __init__(self):
+        self._conn = None
+        self.source: Optional[str] = None
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    def _connection(self):
+        if config.ANALYTICS_ENGINE != 'duckdb':
+            raise AnalyticsUnavailable("Analytics are disabled; set ANALYTICS_ENGINE=duckdb")
+        with self._lock:
+            if self._conn is None:
+                try:
+                    import duckdb
+                except ImportError:
+                    raise AnalyticsUnavailable("DuckDB is not installed (pip install duckdb)")
+                settings = {'threads': config.ANALYTICS_THREADS} if config.ANALYTICS_THREADS else {}
+                conn = duckdb.connect(config=settings)
+                self.source = 'parquet'
+                if config.ANALYTICS_SOURCE == 'sqlite':
+                    self.source = 'sqlite' if self._attach(conn) else 'parquet'
+                self._conn = conn
+            return self._conn
+
+    def _attach(self, conn) -> bool:
+        """Expose the SQLite rows, with dimension labels, as the DuckDB view ``budget``"""
+        if engine.dialect.name != 'sqlite' or is_long_layout() or shard_router.enabled:
+            logger.warning("ANALYTICS_SOURCE=sqlite needs one SQLite file with the wide layout; using Parquet snapshots")
+            return False
+        try:
+            conn.execute("INSTALL sqlite")
+            conn.execute("LOAD sqlite")
+            conn.execute(f"ATTACH {_literal(engine.url.database)} AS oltp (TYPE sqlite, READ_ONLY)")
+            rows = 'oltp'
+            if CYCLE_SCHEMA_MAP.get(CYCLE_SCHEMA):
+                # The active cycle lives in its own file
+                conn.execute(f"ATTACH {_literal(cycle_db_path(BUDGET_CYCLE))} AS oltp_cycle (TYPE sqlite, READ_ONLY)")
+                rows = 'oltp_cycle'
+        except Exception as e:
+            logger.warning("Could not attach the SQLite database to DuckDB (%s); using Parquet snapshots", e)
+            return False
+        labels = [f"d{i}.value AS {_quote(column)}" for i, column in enumerate(DIMENSION_COLUMNS)]
+        joins = [
+            f"LEFT JOIN oltp.{_quote('dim_' + column)} d{i} ON d{i}.id = r.{_quote(column + '_id')}"
+            for i, column in enumerate(DIMENSION_COLUMNS)
+        ]
+        periods = [f"CAST(r.{_quote(column)} AS DOUBLE) AS {_quote(column)}" for column in PERIOD_COLUMNS]
+        conn.execute(
+            "CREATE OR REPLACE VIEW budget AS SELECT r.id, r.user_id, r.business_unit, r.Customer_Note, "
+            + ", ".join(labels + periods) + ", r.Sales_Remark "
+            + f"FROM {rows}.{_quote(China2025B.__tablename__)} r " + " ".join(joins)
+        )
+        return True
+
+    def _snapshot(self) -> Dict[str, Any]:
+        manifest = read_manifest()
+        if manifest is None:
+            # Nothing to serve yet: build the first snapshot in this request
+            manifest = refresh_snapshot()
+        elif time.monotonic() - self._last_check >= config.ANALYTICS_REFRESH_SECONDS:
+            self._last_check = time.monotonic()
+            built_at = datetime.fromisoformat(manifest["built_at"])
+            if (datetime.utcnow() - built_at).total_seconds() >= config.ANALYTICS_REFRESH_SECONDS:
+                db = SessionLocal()
+                try:
+                    stale = read_versions(db) != manifest["versions"]
+                finally:
+                    db.close()
+                if stale:
+                    request_refresh()
+        return manifest
+
+    def query(self, sql: str, params: Optional[list] = None) -> Dict[str, Any]:
+        """Run ``sql`` with {source} standing for the budget rows; rows come back as dictionaries"""
+        cursor = self._connection().cursor()
+        try:
+            if self.source == 'sqlite':
+                relation, snapshot = 'budget', None
+            else:
+                snapshot = self._snapshot()
+                relation = f"read_parquet({_literal(snapshot['path'])})"
+            result = cursor.execute(sql.format(source=relation), params or [])
+            names = [column[0] for column in result.description]
+            rows = [dict(zip(names, row)) for row in result.fetchall()]
+        finally:
+            cursor.close()
+        return {
+            "source": self.source,
+            "snapshot": {key: snapshot[key] for key in ("versions", "built_at", "rows")} if snapshot else None,
+            "rows": rows
+        }
+
+    def status(self) -> Dict[str, Any]:
+        self._connection()
+        manifest = read_manifest() if self.source == 'parquet' else None
+        return {
+            "engine": "duckdb",
+            "source": self.source,
+            "snapshot": manifest,
+            "refresh_seconds": config.ANALYTICS_REFRESH_SECONDS
+        }
+
+analytics_engine = AnalyticsEngine()
+
+def _filters(business_unit: Optional[str]):
+    return ("WHERE business_unit = ?", [business_unit]) if business_unit else ("", [])
+
+def trends(group_columns: List[str], periods: List[str], business_unit: Optional[str] = None) -> Dict[str, Any]:
+    """Totals of each period per group, as one series per group"""
+    groups = ", ".join(_quote(column) for column in group_columns)
+    sums = ", ".join(f"sum({_quote(period)}) AS {_quote(period)}" for period in periods)
+    where, params = _filters(business_unit)
+    result = analytics_engine.query(
+        f"SELECT {groups}, count(*) AS records, {sums} FROM {{source}} {where} "
+        f"GROUP BY {groups} ORDER BY {groups}",
+        params
+    )
+    result["series"] = [
+        {
+            "group": {column: row[column] for column in group_columns},
+            "records": row["records"],
+            "values": {period: float(row[period] or 0) for period in periods}
+        }
+        for row in result.pop("rows")
+    ]
+    return result
+
+def distribution(period: str, group_columns: List[str], business_unit: Optional[str] = None) -> Dict[str, Any]:
+    """Count, total, mean, spread and quantiles of one period's row values per group"""
+    value = _quote(period)
+    groups = ", ".join(_quote(column) for column in group_columns)
+    where, params = _filters(business_unit)
+    result = analytics_engine.query(
+        f"SELECT {groups}, count({value}) AS count, sum({value}) AS sum, avg({value}) AS mean, "
+        f"stddev_samp({value}) AS stddev, min({value}) AS min, max({value}) AS max, "
+        f"quantile_cont({value}, {QUANTILES}) AS quantiles "
+        f"FROM {{source}} {where} GROUP BY {groups} ORDER BY {groups}",
+        params
+    )
+    for row in result["rows"]:
+        row["quantiles"] = dict(zip([f"p{int(q * 100)}" for q in QUANTILES], row["quantiles"] or []))
+    return result
@@ -0,0 +1,131 @@
+"""Budget cycles: one China_<cycle> table per cycle
+
+PostgreSQL: ``budget_rows`` is partitioned by LIST (budget_cycle) and every
+cycle table is one partition, so queries on the active cycle's table (or on
+budget_rows filtered by budget_cycle) scan only that cycle. SQLite: with
+BUDGET_CYCLE_DB_DIR set, each new cycle is its own database file attached as
+schema "cycle_<cycle>". Earlier cycles stay queryable through ``cycle_table``.
+"""
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, Integer, MetaData, Sequence, Table, func, select, text
+from sqlalchemy.orm import Session
+
+from DatabaseManager import BUDGET_CYCLE, China2025B, DIMENSION_COLUMNS, cycle_table_name
+
+PARTITION_PARENT = "budget_rows"
+ID_SEQUENCE_NAME = "budget_rows_id_seq"
+
+CYCLE_NAME = re.compile(r'^[A-Za-z0-9]+$')
+CYCLE_TABLE_NAME = re.compile(r'^China_([A-Za-z0-9]+)$')
+
+def _validate_cycle(cycle: str) -> str:
+    # Cycle names end up in table names and partition bounds
+    if not CYCLE_NAME.match(cycle):
+        raise ValueError(f"Invalid budget cycle name: {cycle!r}")
+    return cycle
+
+def _parent_table(metadata: MetaData) -> Table:
+    """budget_rows: the model's columns, partitioned by cycle, ids from one shared sequence"""
+    id_sequence = Sequence(ID_SEQUENCE_NAME, metadata=metadata)
+    columns = [
+        Column('id', Integer, id_sequence, server_default=id_sequence.next_value(), nullable=False)
+        if column.name == 'id' else Column(column.name, column.type, nullable=column.nullable)
+        for column in China2025B.__table__.columns
+    ]
+    return Table(PARTITION_PARENT, metadata, *columns, postgresql_partition_by='LIST (budget_cycle)')
+
+def _advance_id_sequence(conn):
+    """Move the shared id sequence past every id in budget_rows (it never moves back)
+
+    An attached table already holds ids 1..N from its own sequence; without this
+    the next cycle's rows would be numbered from 1 again and reuse those ids.
+    """
+    conn.execute(text(
+        f"SELECT setval('{ID_SEQUENCE_NAME}', used.max_id) "
+        f"FROM (SELECT MAX(id) AS max_id FROM {PARTITION_PARENT}) used, {ID_SEQUENCE_NAME} seq "
+        f"WHERE used.max_id >= CASE WHEN seq.is_called THEN seq.last_value + 1 ELSE seq.last_value END"
+    ))
+
+def ensure_cycle_partition(engine, cycle: str):
+    """Create budget_rows and the cycle's partition (PostgreSQL)
+
+    A cycle table that already exists as a plain table (e.g. China_2025B from
+    before partitioning) is attached as the cycle's partition instead, and the
+    shared id sequence is moved past its ids so row ids stay unique across cycles.
+    """
+    name = cycle_table_name(_validate_cycle(cycle))
+    metadata = MetaData()
+    _parent_table(metadata)
+    with engine.begin() as conn:
+        metadata.create_all(conn)
+        is_partition = conn.execute(
+            text("SELECT relispartition FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p')"),
+            {"name": name}
+        ).scalar()
+        if is_partition is None:
+            conn.execute(text(
+                f'CREATE TABLE "{name}" PARTITION OF {PARTITION_PARENT} FOR VALUES IN (\'{cycle}\')'
+            ))
+            conn.execute(text(f'ALTER TABLE "{name}" ADD PRIMARY KEY (id)'))
+        elif not is_partition:
+            conn.execute(text(
+                f'ALTER TABLE {PARTITION_PARENT} ATTACH PARTITION "{name}" FOR VALUES IN (\'{cycle}\')'
+            ))
+            # The attached table kept its own id sequence; new rows take ids from the shared one
+            conn.execute(text(f'ALTER TABLE "{name}" ALTER COLUMN id SET DEFAULT nextval(\'{ID_SEQUENCE_NAME}\')'))
+        _advance_id_sequence(conn)
+        if cycle == BUDGET_CYCLE:
+            for index in China2025B.__table__.indexes:
+                index.create(conn, checkfirst=True)
+
+def cycle_schemas(db: Session) -> Dict[str, Optional[str]]:
+    """Every stored cycle and the schema holding its table (None is the default schema)"""
+    cycles: Dict[str, Optional[str]] = {}
+    if db.get_bind().dialect.name == 'postgresql':
+        rows = db.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :parent"
+        ), {"parent": PARTITION_PARENT}).all()
+        for (name,) in rows:
+            match = CYCLE_TABLE_NAME.match(name)
+            if match:
+                cycles[match.group(1)] = None
+        return cycles
+
+    # SQLite: the main file plus every attached cycle file
+    for _, schema, _ in db.execute(text("PRAGMA database_list")).all():
+        names = db.execute(text(f'SELECT name FROM "{schema}".sqlite_master WHERE type = \'table\'')).all()
+        for (name,) in names:
+            match = CYCLE_TABLE_NAME.match(name)
+            if match and match.group(1) not in cycles:
+                cycles[match.group(1)] = None if schema == 'main' else schema
+    return cycles
+
+def list_cycles(db: Session) -> List[str]:
+    return sorted(cycle_schemas(db))
+
+def cycle_table(db: Session, cycle: str) -> Table:
+    """Core table of any stored cycle, for read queries on earlier cycles"""
+    schemas = cycle_schemas(db)
+    if cycle not in schemas:
+        raise KeyError(cycle)
+    return China2025B.__table__.to_metadata(MetaData(), schema=schemas[cycle], name=cycle_table_name(cycle))
+
+def cycle_totals(
+    db: Session,
+    cycle: str,
+    group_columns: List[str],
+    periods: List[str],
+    business_unit: Optional[str] = None
+) -> List[tuple]:
+    """Rows of (*group keys, row count, *period sums) for a stored cycle's wide table"""
+    table = cycle_table(db, cycle)
+    keys = [table.c[f"{name}_id"] if name in DIMENSION_COLUMNS else table.c[name] for name in group_columns]
+    query = select(*keys, func.count(table.c.id), *[func.sum(table.c[period]) for period in periods])
+    if business_unit:
+        query = query.where(table.c.business_unit == business_unit)
+    return [tuple(row) for row in db.execute(query.group_by(*keys)).all()]
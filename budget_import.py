@@ -0,0 +1,171 @@
+"""Bulk import of edited budgets from an uploaded XLSX or CSV file
+
+The file is read a row at a time (csv module / openpyxl read-only mode) and
+handled in chunks of IMPORT_CHUNK_SIZE rows. Each chunk is matched, validated
+with ``budget_validation`` and written with the same set-based update and
+journal as /api/update. Memory therefore depends on the chunk size, the
+business unit's row count and IMPORT_MAX_RESULTS (per-row results listed in
+the report), not on the file size. Rows are matched by ``id``
+or, when it is blank or absent, by the descriptive columns. Empty cells leave
+the stored value unchanged.
+"""
+import codecs
+import csv
+import os
+import zipfile
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from DatabaseManager import China2025B, DESCRIPTIVE_COLUMNS, EDITABLE_COLUMNS, decode_dimensions
+from budget_validation import BudgetRowUpdate, validate_updates
+from change_journal import apply_updates
+from fact_store import select_rows
+from config import config
+
+IMPORT_FORMATS = ('.csv', '.xlsx')
+
+class ImportFormatError(ValueError):
+    """The upload is not a readable CSV/XLSX file with the expected header"""
+
+def _iter_csv(file: BinaryIO) -> Iterator[list]:
+    # utf-8-sig drops the byte order mark Excel writes at the start of CSV files
+    yield from csv.reader(codecs.getreader('utf-8-sig')(file))
+
+def _iter_xlsx(file: BinaryIO) -> Iterator[tuple]:
+    from openpyxl import load_workbook
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def iter_upload_rows(file: BinaryIO, filename: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(line number, {header: value}) for every non-empty data row of the upload"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension not in IMPORT_FORMATS:
+        raise ImportFormatError(f"Unsupported file type {extension or '(none)'}; upload one of: {', '.join(IMPORT_FORMATS)}")
+    rows = _iter_csv(file) if extension == '.csv' else _iter_xlsx(file)
+    try:
+        header = [str(name).strip() if name is not None else '' for name in next(rows)]
+    except StopIteration:
+        raise ImportFormatError("The file is empty")
+    except (ValueError, csv.Error, OSError, KeyError, zipfile.BadZipFile) as e:
+        raise ImportFormatError(f"Could not read the file: {str(e)}")
+    if not set(EDITABLE_COLUMNS) & set(header):
+        raise ImportFormatError(f"No editable columns in the header; expected some of: {', '.join(EDITABLE_COLUMNS)}")
+    if 'id' not in header and not set(DESCRIPTIVE_COLUMNS) <= set(header):
+        raise ImportFormatError(f"Rows need an id column or all of: {', '.join(DESCRIPTIVE_COLUMNS)}")
+
+    for line, values in enumerate(rows, start=2):
+        if not any(value not in (None, '') for value in values):
+            continue
+        yield line, dict(zip(header, values))
+
+def _blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+def _natural_key(values: Dict[str, Any]) -> tuple:
+    return tuple('' if _blank(values.get(name)) else str(values.get(name)).strip() for name in DESCRIPTIVE_COLUMNS)
+
+def natural_key_index(db: Session, user_id: str, business_unit: str) -> Dict[tuple, Optional[int]]:
+    """Descriptive columns -> row id for the user's rows (None where the key is not unique)"""
+    index: Dict[tuple, Optional[int]] = {}
+    names = ['id'] + DESCRIPTIVE_COLUMNS
+    rows = select_rows(
+        db, names, China2025B.user_id == user_id, China2025B.business_unit == business_unit
+    )
+    for row in decode_dimensions(rows, names):
+        key = _natural_key(dict(zip(DESCRIPTIVE_COLUMNS, row[1:])))
+        index[key] = None if key in index else row[0]
+    return index
+
+class BudgetImport:
+    """Matches, validates and applies uploaded rows chunk by chunk; the caller commits"""
+    def __init__(self, db: Session, user_id: str, business_unit: str):
+        self.db = db
+        self.user_id = user_id
+        self.business_unit = business_unit
+        self.results: List[Dict[str, Any]] = []
+        self.summary: Dict[str, int] = {}
+        self.changed_cells = 0
+        self._natural_keys: Optional[Dict[tuple, Optional[int]]] = None
+
+    def _result(self, result: Dict[str, Any]):
+        self.summary[result["status"]] = self.summary.get(result["status"], 0) + 1
+        if len(self.results) < config.IMPORT_MAX_RESULTS:
+            self.results.append(result)
+
+    def _match(self, values: Dict[str, Any]) -> Tuple[Optional[int], Optional[str]]:
+        if not _blank(values.get('id')):
+            try:
+                return int(float(values['id'])), None
+            except (TypeError, ValueError):
+                return None, f"Invalid id: {values['id']!r}"
+        if self._natural_keys is None:
+            # Built on the first row without an id, once per import
+            self._natural_keys = natural_key_index(self.db, self.user_id, self.business_unit)
+        key = _natural_key(values)
+        if key not in self._natural_keys:
+            return None, "No row with these descriptive columns"
+        if self._natural_keys[key] is None:
+            return None, "Several rows have these descriptive columns; add the id column"
+        return self._natural_keys[key], None
+
+    def _apply_chunk(self, chunk: List[Tuple[int, Dict[str, Any]]]):
+        updates, lines = [], {}
+        for line, values in chunk:
+            row_id, error = self._match(values)
+            if error:
+                self._result({"row": line, "id": row_id, "status": "not_matched", "errors": [error]})
+                continue
+            if row_id in lines:
+                self._result({"row": line, "id": row_id, "status": "rejected",
+                                     "errors": [f"Same row as line {lines[row_id]}"]})
+                continue
+            fields = {column: values[column] for column in EDITABLE_COLUMNS
+                      if column in values and not _blank(values[column])}
+            if 'Sales_Remark' in fields:
+                fields['Sales_Remark'] = str(fields['Sales_Remark'])
+            try:
+                updates.append(BudgetRowUpdate(id=row_id, **fields))
+            except ValidationError as e:
+                self._result({"row": line, "id": row_id, "status": "rejected",
+                                     "errors": [f"{error['loc'][0]}: {error['msg']}" for error in e.errors()]})
+                continue
+            lines[row_id] = line
+
+        clean, errors = validate_updates(self.db, self.user_id, self.business_unit, updates)
+        errors_by_id: Dict[int, List[str]] = {}
+        for error in errors:
+            message = f"{error['column']}: {error['error']}" if error['column'] else error['error']
+            errors_by_id.setdefault(error['id'], []).append(message)
+        for row_id, messages in errors_by_id.items():
+            self._result({"row": lines[row_id], "id": row_id, "status": "rejected", "errors": messages})
+
+        applied, change_count = apply_updates(self.db, self.user_id, self.business_unit, clean)
+        self.changed_cells += change_count
+        for row_id in applied:
+            self._result({"row": lines[row_id], "id": row_id, "status": "applied", "errors": []})
+
+    def run(self, rows: Iterator[Tuple[int, Dict[str, Any]]]) -> Dict[str, Any]:
+        chunk_size = config.IMPORT_CHUNK_SIZE
+        chunk = []
+        for line, values in rows:
+            chunk.append((line, values))
+            if len(chunk) >= chunk_size:
+                self._apply_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._apply_chunk(chunk)
+
+        self.results.sort(key=lambda result: result["row"])
+        rows = sum(self.summary.values())
+        return {
+            "rows": rows,
+            "changed_cells": self.changed_cells,
+            "summary": self.summary,
+            "results": self.results,
+            "results_truncated": rows > len(self.results)
+        }
@@ -0,0 +1,186 @@
+"""Filtered row queries across business units, pushed down into indexed SQL
+
+Dimension filters become ``<column>_id IN (...)`` on indexed key columns.
+Customer_Note search uses a trigram index: an FTS5 table with the trigram
+tokenizer on SQLite (kept in sync by triggers) and a pg_trgm GIN index on
+PostgreSQL, so prefix and contains matches do not scan the table.
+"""
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, column, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from DatabaseManager import (
+    China2025B, CYCLE_SCHEMA, CYCLE_SCHEMA_MAP, DESCRIPTIVE_COLUMNS, DIMENSION_COLUMNS, PERIOD_COLUMNS,
+    dimension_cache, dimension_tables, decode_dimensions
+)
+from fact_store import select_rows, period_expression
+
+logger = logging.getLogger(__name__)
+
+# Trigram indexes need at least three characters to narrow a search
+MIN_INDEXED_TERM = 3
+
+ROW_COLUMNS = (
+    ['id', 'user_id', 'business_unit'] + DESCRIPTIVE_COLUMNS + PERIOD_COLUMNS + ['Sales_Remark']
+)
+SORT_COLUMNS = ['id', 'user_id', 'business_unit'] + DESCRIPTIVE_COLUMNS + PERIOD_COLUMNS
+
+def note_index_name() -> str:
+    return f"{China2025B.__tablename__}_note_fts"
+
+def _schema_prefix() -> str:
+    schema = CYCLE_SCHEMA_MAP.get(CYCLE_SCHEMA)
+    return f'"{schema}".' if schema else ''
+
+def _ensure_sqlite_note_index(conn):
+    table, fts, prefix = China2025B.__tablename__, note_index_name(), _schema_prefix()
+    exists = conn.execute(text(
+        f"SELECT 1 FROM {prefix}sqlite_master WHERE type = 'table' AND name = :name"
+    ), {"name": fts}).first()
+    if exists:
+        return
+    try:
+        conn.execute(text(
+            f'CREATE VIRTUAL TABLE {prefix}"{fts}" USING fts5('
+            f"Customer_Note, content='{table}', content_rowid='id', tokenize='trigram')"
+        ))
+    except DBAPIError as e:
+        # The trigram tokenizer needs SQLite 3.34; searches then fall back to LIKE
+        logger.warning("Customer_Note search index not created: %s", e)
+        return
+    # Trigger bodies may only name tables of their own database, so they stay unqualified
+    conn.execute(text(
+        f'CREATE TRIGGER {prefix}"{fts}_ai" AFTER INSERT ON "{table}" BEGIN '
+        f'INSERT INTO "{fts}"(rowid, Customer_Note) VALUES (new.id, new.Customer_Note); END'
+    ))
+    conn.execute(text(
+        f'CREATE TRIGGER {prefix}"{fts}_ad" AFTER DELETE ON "{table}" BEGIN '
+        f'INSERT INTO "{fts}"("{fts}", rowid, Customer_Note) VALUES (\'delete\', old.id, old.Customer_Note); END'
+    ))
+    conn.execute(text(
+        f'CREATE TRIGGER {prefix}"{fts}_au" AFTER UPDATE OF Customer_Note ON "{table}" BEGIN '
+        f'INSERT INTO "{fts}"("{fts}", rowid, Customer_Note) VALUES (\'delete\', old.id, old.Customer_Note); '
+        f'INSERT INTO "{fts}"(rowid, Customer_Note) VALUES (new.id, new.Customer_Note); END'
+    ))
+    conn.execute(text(f'INSERT INTO {prefix}"{fts}"("{fts}") VALUES (\'rebuild\')'))
+
+def _ensure_postgres_note_index(conn):
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except DBAPIError as e:
+        logger.warning("Customer_Note search index not created (pg_trgm unavailable): %s", e)
+        return
+    # On the active cycle's table; a new cycle gets its own when it is first started
+    conn.execute(text(
+        f'CREATE INDEX IF NOT EXISTS "idx_{China2025B.__tablename__}_note_trgm" '
+        f'ON "{China2025B.__tablename__}" USING gin ("Customer_Note" gin_trgm_ops)'
+    ))
+
+def ensure_search_indexes(conn):
+    """Create the dimension key indexes and the Customer_Note trigram index if missing"""
+    for index in China2025B.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    if conn.dialect.name == 'sqlite':
+        _ensure_sqlite_note_index(conn)
+    elif conn.dialect.name == 'postgresql':
+        _ensure_postgres_note_index(conn)
+    _note_index_available.clear()
+
+_note_index_available: Dict[str, bool] = {}
+_note_index_lock = threading.Lock()
+
+def note_index_available(db: Session) -> bool:
+    """Whether the SQLite FTS5 table exists (checked once per process)"""
+    with _note_index_lock:
+        if 'sqlite' not in _note_index_available:
+            _note_index_available['sqlite'] = db.execute(text(
+                f"SELECT 1 FROM {_schema_prefix()}sqlite_master WHERE type = 'table' AND name = :name"
+            ), {"name": note_index_name()}).first() is not None
+        return _note_index_available['sqlite']
+
+def _like_pattern(term: str, match: str) -> str:
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"{escaped}%" if match == 'prefix' else f"%{escaped}%"
+
+def note_criterion(db: Session, term: str, match: str = 'contains'):
+    """Case-insensitive prefix/contains match on Customer_Note, using the trigram index if possible"""
+    pattern = _like_pattern(term, match)
+    # pg_trgm's GIN index serves ILIKE directly
+    like = China2025B.Customer_Note.ilike(pattern, escape='\\')
+    if db.get_bind().dialect.name == 'sqlite' and len(term) >= MIN_INDEXED_TERM and note_index_available(db):
+        # A trigram phrase query finds every row containing the term from the index
+        # (LIKE with ESCAPE would scan it); LIKE then checks the few candidates exactly
+        fts = f'{_schema_prefix()}"{note_index_name()}"'
+        phrase = '"' + term.replace('"', '""') + '"'
+        return and_(China2025B.id.in_(
+            text(f'SELECT rowid FROM {fts} WHERE Customer_Note MATCH :note_phrase')
+            .bindparams(note_phrase=phrase)
+            .columns(column('rowid'))
+        ), like)
+    return like
+
+def sort_expression(name: str):
+    """Sort key for an API column; dimension columns sort by label, not by key"""
+    if name in DIMENSION_COLUMNS:
+        table = dimension_tables[name]
+        return select(table.c.value).where(
+            table.c.id == getattr(China2025B, f"{name}_id")
+        ).scalar_subquery()
+    if name in PERIOD_COLUMNS:
+        return period_expression(name)
+    return getattr(China2025B, name)
+
+def search_rows(
+    db: Session,
+    filters: Dict[str, List[str]],
+    business_units: Optional[List[str]] = None,
+    note: Optional[str] = None,
+    match: str = 'contains',
+    sort: str = 'id',
+    descending: bool = False,
+    limit: int = 100,
+    offset: int = 0
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """Matching rows as API dictionaries and whether more rows follow the page"""
+    criteria = []
+    for name, labels in filters.items():
+        keys = [key for key in (dimension_cache.key(name, label) for label in labels) if key is not None]
+        if not keys:
+            # None of the labels exist, so nothing can match
+            return [], False
+        criteria.append(getattr(China2025B, f"{name}_id").in_(keys))
+    if business_units:
+        criteria.append(China2025B.business_unit.in_(business_units))
+    if note:
+        criteria.append(note_criterion(db, note, match))
+
+    key = sort_expression(sort)
+    order_by = [key.desc() if descending else key.asc()]
+    if sort != 'id':
+        # Ties keep a stable order across pages
+        order_by.append(China2025B.id.desc() if descending else China2025B.id)
+    # One extra row tells whether there is a next page
+    rows = select_rows(db, ROW_COLUMNS, *criteria, order_by=order_by, limit=limit + 1, offset=offset)
+    records = [dict(zip(ROW_COLUMNS, row)) for row in decode_dimensions(rows, ROW_COLUMNS)]
+    return records[:limit], len(records) > limit
+
+def _merge_key(sort: str):
+    # Same order as the SQL sort: NULLs first when ascending, then ties by id
+    return lambda record: (record[sort] is not None, record[sort] if record[sort] is not None else 0, record['id'])
+
+def merge_pages(
+    pages: List[Tuple[List[Dict[str, Any]], bool]],
+    sort: str = 'id',
+    descending: bool = False,
+    limit: int = 100,
+    offset: int = 0
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """One page from the results of several shards, each searched with offset 0 and limit offset + limit"""
+    records = sorted((record for rows, _ in pages for record in rows), key=_merge_key(sort), reverse=descending)
+    has_more = len(records) > offset + limit or any(more for _, more in pages)
+    return records[offset:offset + limit], has_more
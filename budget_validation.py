@@ -0,0 +1,152 @@
+"""Typed budget update rows and batch validation
+
+A whole batch is checked one column at a time with NumPy: numeric coercion,
+value range, and growth against the row's Y2024R08 history. Only the error
+messages are built per failing cell. Rows with any error are rejected with
+per-row details; the remaining rows are applied.
+"""
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict, field_validator
+from sqlalchemy.orm import Session
+
+from DatabaseManager import China2025B, PLAN_COLUMNS
+from fact_store import select_rows
+from config import config
+
+# History column the plan years are compared against
+BASELINE_COLUMN = 'Y2024R08'
+
+# SQLite limits the number of bound parameters per statement
+ID_CHUNK_SIZE = 5000
+
+PlanValue = Optional[Union[float, str]]
+
+class BudgetRowUpdate(BaseModel):
+    """One edited row; only the fields that were sent are applied"""
+    model_config = ConfigDict(extra='ignore')
+
+    id: int
+    Y2025B: PlanValue = None
+    Y2026P: PlanValue = None
+    Y2027P: PlanValue = None
+    Y2028P: PlanValue = None
+    Y2029P: PlanValue = None
+    Sales_Remark: Optional[str] = None
+
+    @field_validator('Sales_Remark', mode='before')
+    @classmethod
+    def _remark_text(cls, value: Any) -> Any:
+        # Spreadsheet pastes send numeric remarks as numbers; store them as text
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        return value
+
+def _coerce(raw: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """float64 values, null mask and not-a-number mask for an object array"""
+    null = np.equal(raw, None) | np.equal(raw, '')
+    filled = np.where(null, np.nan, raw)
+    try:
+        return filled.astype(np.float64), null, np.zeros(len(raw), dtype=bool)
+    except (TypeError, ValueError):
+        # Slow path only for batches that contain an unparseable value
+        values = np.full(len(raw), np.nan)
+        bad = np.zeros(len(raw), dtype=bool)
+        for i, value in enumerate(filled):
+            try:
+                values[i] = float(value)
+            except (TypeError, ValueError):
+                bad[i] = True
+        return values, null, bad
+
+def _baselines(db: Session, user_id: str, business_unit: str, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Y2024R08 per requested id and whether the id belongs to the user's business unit"""
+    unique_ids = np.unique(ids).tolist()
+    found_ids, found_values = [], []
+    for start in range(0, len(unique_ids), ID_CHUNK_SIZE):
+        rows = select_rows(
+            db, ['id', BASELINE_COLUMN],
+            China2025B.id.in_(unique_ids[start:start + ID_CHUNK_SIZE]),
+            China2025B.user_id == user_id,
+            China2025B.business_unit == business_unit
+        )
+        for row_id, value in rows:
+            found_ids.append(row_id)
+            found_values.append(np.nan if value is None else value)
+
+    keys = np.asarray(found_ids, dtype=np.int64)
+    order = np.argsort(keys)
+    keys = keys[order]
+    values = np.asarray(found_values, dtype=np.float64)[order]
+    if not len(keys):
+        return np.full(len(ids), np.nan), np.zeros(len(ids), dtype=bool)
+    positions = np.clip(np.searchsorted(keys, ids), 0, len(keys) - 1)
+    found = keys[positions] == ids
+    return np.where(found, values[positions], np.nan), found
+
+def range_failures(values: np.ndarray, baseline: np.ndarray) -> List[Tuple[np.ndarray, str]]:
+    """(mask, message) for plan values below the minimum, above the maximum or the growth limit"""
+    minimum = config.BUDGET_VALUE_MIN
+    maximum = config.BUDGET_VALUE_MAX
+    max_growth = config.BUDGET_MAX_GROWTH
+    with np.errstate(invalid='ignore'):
+        return [
+            (values < minimum, f"Below the minimum of {minimum:g}"),
+            (values > maximum, f"Above the maximum of {maximum:g}"),
+            ((baseline > 0) & (values > baseline * max_growth), f"More than {max_growth:g}x {BASELINE_COLUMN}"),
+        ]
+
+def validate_updates(
+    db: Session,
+    user_id: str,
+    business_unit: str,
+    updates: List[BudgetRowUpdate]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Split a batch into clean update dicts (values coerced) and per-cell errors"""
+    rows = [update.model_dump(exclude_unset=True) for update in updates]
+    if not rows:
+        return [], []
+    count = len(rows)
+    ids = np.fromiter((row['id'] for row in rows), dtype=np.int64, count=count)
+    baseline, found = _baselines(db, user_id, business_unit, ids)
+
+    failures = [(~found, None, "Row not found for this user and business unit")]
+    coerced = {}
+    with np.errstate(invalid='ignore'):
+        for column in PLAN_COLUMNS:
+            present = np.fromiter((column in row for row in rows), dtype=bool, count=count)
+            if not present.any():
+                continue
+            values, null, bad = _coerce(np.array([row.get(column) for row in rows], dtype=object))
+            coerced[column] = (values, null)
+            failures += [
+                (present & bad, column, "Not a number"),
+                (present & ~null & ~bad & ~np.isfinite(values), column, "Not a finite number"),
+            ]
+            failures += [(present & mask, column, message) for mask, message in range_failures(values, baseline)]
+        remark_lengths = np.fromiter((len(row.get('Sales_Remark') or '') for row in rows), dtype=np.int64, count=count)
+        failures.append((remark_lengths > config.SALES_REMARK_MAX_LENGTH, 'Sales_Remark',
+                         f"Longer than {config.SALES_REMARK_MAX_LENGTH} characters"))
+
+    rejected = np.zeros(count, dtype=bool)
+    errors = []
+    for mask, column, message in failures:
+        for i in np.flatnonzero(mask):
+            rejected[i] = True
+            value = rows[i].get(column) if column else None
+            errors.append({
+                "id": int(ids[i]),
+                "column": column,
+                "value": value[:100] if isinstance(value, str) else value,
+                "error": message
+            })
+
+    clean = []
+    for i in np.flatnonzero(~rejected):
+        row = rows[i]
+        for column, (values, null) in coerced.items():
+            if column in row:
+                row[column] = None if null[i] else float(values[i])
+        clean.append(row)
+    return clean, errors
@@ -0,0 +1,152 @@
+"""Change notifications for clients: (business_unit, data_version) events over SSE
+
+Endpoints publish an event after their transaction commits. Every subscriber
+is a coalescing mailbox on the event loop (only the latest event per
+business unit is kept), so an idle connection costs one suspended coroutine.
+A single poller per process reads data_versions every CHANGE_POLL_SECONDS
+while anyone is subscribed, which also picks up commits made by other API
+workers.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Dict, Optional, Set
+
+from DatabaseManager import SessionLocal, all_data_versions
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class Subscriber:
+    def __init__(self, business_unit: Optional[str]):
+        self.business_unit = business_unit
+        self.pending: Dict[str, Dict] = {}
+        self.ready = asyncio.Event()
+
+    def offer(self, event: Dict):
+        if self.business_unit and event["business_unit"] != self.business_unit:
+            return
+        # A newer event for the same business unit replaces an undelivered one
+        self.pending[event["business_unit"]] = event
+        self.ready.set()
+
+    def take(self) -> list:
+        events = list(self.pending.values())
+        self.pending.clear()
+        self.ready.clear()
+        return events
+
+class ChangeBroker:
+    """Fans change events out to SSE subscribers of this process"""
+    def __init__(self):
+        self.versions: Dict[str, int] = {}
+        self._versions_loaded = False
+        self.subscribers: Set[Subscriber] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._poller: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Bind to the running event loop and start the data version poller"""
+        self._loop = asyncio.get_running_loop()
+        if self._poller is None and config.CHANGE_POLL_SECONDS > 0:
+            self._poller = self._loop.create_task(self._poll())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    def publish(self, business_unit: str, data_version: int, kind: str = "update"):
+        """Notify subscribers; safe to call from worker threads"""
+        event = {
+            "business_unit": business_unit,
+            "data_version": data_version,
+            "event": kind,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        if self._loop is None:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._deliver(event)
+        else:
+            self._loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event: Dict):
+        business_unit = event["business_unit"]
+        if event["event"] == "update":
+            if event["data_version"] <= self.versions.get(business_unit, 0):
+                return
+            self.versions[business_unit] = event["data_version"]
+        for subscriber in self.subscribers:
+            subscriber.offer(event)
+
+    def _read_versions(self) -> Dict[str, int]:
+        db = SessionLocal()
+        try:
+            return all_data_versions(db)
+        finally:
+            db.close()
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(config.CHANGE_POLL_SECONDS)
+            if not self.subscribers:
+                continue
+            try:
+                versions = await asyncio.to_thread(self._read_versions)
+            except Exception as e:
+                logger.warning("Change poller could not read data versions: %s", e)
+                continue
+            for business_unit, version in versions.items():
+                if version > self.versions.get(business_unit, 0):
+                    self._deliver({
+                        "business_unit": business_unit,
+                        "data_version": version,
+                        "event": "update",
+                        "timestamp": datetime.utcnow().isoformat()
+                    })
+
+    async def stream(self, business_unit: Optional[str], is_disconnected) -> AsyncIterator[str]:
+        """SSE frames: the current version(s) first, then changes and keep-alive comments"""
+        if not self._versions_loaded:
+            for name, version in (await asyncio.to_thread(self._read_versions)).items():
+                self.versions[name] = max(version, self.versions.get(name, 0))
+            self._versions_loaded = True
+        subscriber = Subscriber(business_unit)
+        snapshot = {business_unit: self.versions.get(business_unit, 0)} if business_unit else dict(self.versions)
+        for name, version in snapshot.items():
+            subscriber.offer({"business_unit": name, "data_version": version, "event": "snapshot",
+                              "timestamp": datetime.utcnow().isoformat()})
+        self.subscribers.add(subscriber)
+        deadline = asyncio.get_running_loop().time() + config.CHANGE_STREAM_SECONDS
+        try:
+            # Tells EventSource clients how long to wait before reconnecting
+            yield f"retry: {config.CHANGE_RETRY_MS}\n\n"
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(
+                        subscriber.ready.wait(), timeout=min(config.CHANGE_KEEPALIVE_SECONDS, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                for event in subscriber.take():
+                    yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            self.subscribers.discard(subscriber)
+
+change_broker = ChangeBroker()
@@ -0,0 +1,169 @@
+"""Append-only journal of cell edits, written in the same transaction as the edit"""
+import math
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, insert, text, update
+from sqlalchemy.orm import Session
+
+from DatabaseManager import BUDGET_CYCLE, China2025B, ChangeJournal, EDITABLE_COLUMNS, PLAN_COLUMNS
+from fact_store import is_long_layout, read_cells, write_cells
+
+def _encode(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+def _decode(column_name: str, value: Optional[str]) -> Any:
+    if value is None or column_name not in PLAN_COLUMNS:
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+def _unchanged(old_value: Any, new_value: Any) -> bool:
+    # Values that went through Excel can differ in the 17th significant digit
+    if isinstance(old_value, float) and isinstance(new_value, float):
+        return math.isclose(old_value, new_value, rel_tol=1e-12)
+    return old_value == new_value
+
+def _lock_journal(db: Session):
+    """Serialize journal writers on PostgreSQL so sequence numbers commit in order
+
+    Without this, a transaction holding seq 11 can commit before one holding
+    seq 10, and a consumer that already synced past 11 would never see 10.
+    SQLite already allows only one writer at a time.
+    """
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext('change_journal'))"))
+
+def apply_updates(
+    db: Session,
+    user_id: str,
+    business_unit: str,
+    updates: List[Dict[str, Any]]
+) -> Tuple[List[int], int]:
+    """Apply editable-column updates and journal every changed cell
+
+    Returns the ids of the matched records and the number of journaled changes.
+    Only the editable columns are read, and the changed rows are written with
+    one executemany UPDATE by primary key. The caller owns the transaction and commits.
+    """
+    ids = [update.get("id") for update in updates if update.get("id")]
+    if not ids:
+        return [], 0
+    
+    # In the long layout the plan values are budget_facts cells, not row columns
+    long_layout = is_long_layout()
+    row_columns = [column for column in EDITABLE_COLUMNS if not (long_layout and column in PLAN_COLUMNS)]
+    current = {
+        row[0]: dict(zip(row_columns, row[1:]))
+        for row in db.query(China2025B.id, *[getattr(China2025B, column) for column in row_columns]).filter(
+            and_(
+                China2025B.id.in_(ids),
+                China2025B.user_id == user_id,
+                China2025B.business_unit == business_unit
+            )
+        )
+    }
+    cells = read_cells(db, current, PLAN_COLUMNS) if long_layout else {}
+    changed_cells = []
+    changed_rows: Dict[int, Dict[str, Any]] = {}
+    
+    _lock_journal(db)
+    updated_records = []
+    changed_at = datetime.utcnow()
+    entries = []
+    for row in updates:
+        row_id = row.get("id")
+        if row_id not in current:
+            continue
+        
+        # Update editable fields only
+        for column in EDITABLE_COLUMNS:
+            if column not in row:
+                continue
+            if long_layout and column in PLAN_COLUMNS:
+                old_value = cells.get(row_id, {}).get(column)
+            else:
+                old_value = current[row_id][column]
+            new_value = row[column]
+            if _unchanged(old_value, new_value):
+                continue
+            if long_layout and column in PLAN_COLUMNS:
+                changed_cells.append((row_id, column, new_value))
+            else:
+                changed_rows.setdefault(row_id, {"id": row_id})[column] = new_value
+            entries.append({
+                "row_id": row_id,
+                "business_unit": business_unit,
+                "column_name": column,
+                "old_value": _encode(old_value),
+                "new_value": _encode(new_value),
+                "user_id": user_id,
+                "changed_at": changed_at,
+            })
+        
+        updated_records.append(row_id)
+    
+    if changed_rows:
+        # Bulk UPDATE by primary key; rows with the same changed columns share one statement
+        db.execute(update(China2025B), list(changed_rows.values()))
+    if changed_cells:
+        existing = {(row_id, period) for row_id, values in cells.items() for period in values}
+        write_cells(db, changed_cells, existing)
+    if entries:
+        db.execute(insert(ChangeJournal), entries)
+    return updated_records, len(entries)
+
+def journal_cells(
+    db: Session,
+    user_id: str,
+    business_unit: str,
+    cells: List[Tuple[int, str, Any, Any]]
+) -> int:
+    """Journal (row_id, column, old_value, new_value) cells changed by a set-based statement
+
+    Call it in the transaction that writes the cells, before the write.
+    """
+    if not cells:
+        return 0
+    _lock_journal(db)
+    changed_at = datetime.utcnow()
+    db.execute(insert(ChangeJournal), [
+        {
+            "row_id": row_id,
+            "business_unit": business_unit,
+            "column_name": column,
+            "old_value": _encode(old_value),
+            "new_value": _encode(new_value),
+            "user_id": user_id,
+            "changed_at": changed_at,
+        } for row_id, column, old_value, new_value in cells
+    ])
+    return len(cells)
+
+def changes_since(
+    db: Session,
+    since: int,
+    limit: int = 1000,
+    business_unit: Optional[str] = None,
+    cycle: str = BUDGET_CYCLE
+) -> List[Dict[str, Any]]:
+    """Journal entries of a budget cycle with a sequence number greater than ``since``, oldest first"""
+    query = db.query(ChangeJournal).filter(ChangeJournal.seq > since, ChangeJournal.budget_cycle == cycle)
+    if business_unit:
+        query = query.filter(ChangeJournal.business_unit == business_unit)
+    entries = query.order_by(ChangeJournal.seq).limit(limit).all()
+    return [
+        {
+            "seq": entry.seq,
+            "row_id": entry.row_id,
+            "budget_cycle": entry.budget_cycle,
+            "business_unit": entry.business_unit,
+            "column": entry.column_name,
+            "old_value": _decode(entry.column_name, entry.old_value),
+            "new_value": _decode(entry.column_name, entry.new_value),
+            "user_id": entry.user_id,
+            "changed_at": entry.changed_at.isoformat(),
+        } for entry in entries
+    ]
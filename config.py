@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -29,7 +29,121 @@ class Config:
         self.POWERBI_TENANT_ID = os.getenv('POWERBI_TENANT_ID', '')
         self.POWERBI_WORKSPACE_ID = os.getenv('POWERBI_WORKSPACE_ID', '')
         self.POWERBI_DATASET_ID = os.getenv('POWERBI_DATASET_ID', '')
-        
+        self.POWERBI_API_URL = os.getenv('POWERBI_API_URL', 'https://api.powerbi.com/v1.0/myorg')
+        self.POWERBI_TABLE_NAME = os.getenv('POWERBI_TABLE_NAME', 'BudgetSubmissions')
+
+        # Incremental push-dataset sync (PowerBI allows 10,000 rows per POST and 5 pending POSTs per dataset)
+        self.POWERBI_SYNC_ENABLED = os.getenv('POWERBI_SYNC_ENABLED', 'false').lower() == 'true'
+        self.POWERBI_ROWS_PER_REQUEST = int(os.getenv('POWERBI_ROWS_PER_REQUEST', '10000'))
+        self.POWERBI_MAX_CONCURRENT_PUSHES = int(os.getenv('POWERBI_MAX_CONCURRENT_PUSHES', '5'))
+        self.POWERBI_MAX_RETRIES = int(os.getenv('POWERBI_MAX_RETRIES', '5'))
+        self.POWERBI_REFRESH_AFTER_SYNC = os.getenv('POWERBI_REFRESH_AFTER_SYNC', 'false').lower() == 'true'
+        # Optional file that keeps the MSAL token cache across restarts
+        self.POWERBI_TOKEN_CACHE_PATH = os.getenv('POWERBI_TOKEN_CACHE_PATH', '')
+
+        # PowerBI feed files (Parquet, optionally one partition per business unit)
+        self.POWERBI_EXPORT_DIR = os.getenv('POWERBI_EXPORT_DIR', './powerbi_feed')
+        self.POWERBI_PARTITION_BY_BU = os.getenv('POWERBI_PARTITION_BY_BU', 'false').lower() == 'true'
+        self.PARQUET_COMPRESSION = os.getenv('PARQUET_COMPRESSION', 'snappy')
+
+        # Excel exports, cached on disk per (business_unit, data_version)
+        self.EXPORT_CACHE_DIR = os.getenv('EXPORT_CACHE_DIR', './exports')
+        self.EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))
+
+        # Background job queue (submissions and exports)
+        self.JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+        self.JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '1.0'))
+        self.JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+        self.JOB_RETRY_BASE_SECONDS = float(os.getenv('JOB_RETRY_BASE_SECONDS', '5'))
+        self.JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '600'))
+
+        # Validation of saved budget values (growth is measured against Y2024R08).
+        # No lower bound by default: credits and returns are negative plan values
+        self.BUDGET_VALUE_MIN = float(os.getenv('BUDGET_VALUE_MIN', '-inf'))
+        self.BUDGET_VALUE_MAX = float(os.getenv('BUDGET_VALUE_MAX', '1e12'))
+        self.BUDGET_MAX_GROWTH = float(os.getenv('BUDGET_MAX_GROWTH', '10'))
+        self.SALES_REMARK_MAX_LENGTH = int(os.getenv('SALES_REMARK_MAX_LENGTH', '1000'))
+        # Uploaded XLSX/CSV imports are matched, validated and applied this many rows at a time
+        self.IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '2000'))
+        self.IMPORT_MAX_RESULTS = int(os.getenv('IMPORT_MAX_RESULTS', '10000'))
+
+        # Read replicas (comma separated URLs) for GET endpoints. After a save, the saving
+        # user and business unit read from the primary for READ_YOUR_WRITES_SECONDS
+        self.DATABASE_REPLICA_URLS = [
+            url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+        ]
+        self.READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', '10'))
+        self.REPLICA_RETRY_SECONDS = float(os.getenv('REPLICA_RETRY_SECONDS', '30'))
+
+        # Change notifications (GET /api/events). Data versions are polled while clients are
+        # connected so commits made by other API workers are pushed too (0 disables polling)
+        self.CHANGE_POLL_SECONDS = float(os.getenv('CHANGE_POLL_SECONDS', '2'))
+        self.CHANGE_KEEPALIVE_SECONDS = float(os.getenv('CHANGE_KEEPALIVE_SECONDS', '15'))
+        self.CHANGE_RETRY_MS = int(os.getenv('CHANGE_RETRY_MS', '3000'))
+        # Streams end after this long and clients reconnect (keeps proxies and shutdowns from waiting on them)
+        self.CHANGE_STREAM_SECONDS = float(os.getenv('CHANGE_STREAM_SECONDS', '300'))
+
+        # Active budget cycle: its rows live in China_<cycle>. PostgreSQL keeps every cycle
+        # as a partition of budget_rows; on SQLite, setting BUDGET_CYCLE_DB_DIR keeps each
+        # new cycle in its own database file, attached next to the main one
+        self.BUDGET_CYCLE = os.getenv('BUDGET_CYCLE', '2025B')
+        self.BUDGET_CYCLE_DB_DIR = os.getenv('BUDGET_CYCLE_DB_DIR', '')
+        # SQLite only: keep each business unit's rows in its own database file in this
+        # directory, so saves to different business units do not queue on one write lock
+        self.SQLITE_SHARD_DIR = os.getenv('SQLITE_SHARD_DIR', '')
+        # Threads reading the shards in parallel for cross-business-unit endpoints
+        self.SHARD_FANOUT_WORKERS = int(os.getenv('SHARD_FANOUT_WORKERS', '8'))
+
+        # Where the year columns live: 'wide' (one column per period on China_2025B)
+        # or 'long' (one budget_facts row per cell, pivoted back to the wide shape)
+        self.STORAGE_LAYOUT = os.getenv('STORAGE_LAYOUT', 'wide').lower()
+        self.PIVOT_CACHE_SIZE = int(os.getenv('PIVOT_CACHE_SIZE', '64'))
+        # Database connection pool per engine (primary and each read replica)
+        self.DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+        self.DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+
+        # Admission control: requests in flight per endpoint class (0 disables the limit).
+        # Keep the sum below DB_POOL_SIZE + DB_MAX_OVERFLOW, leaving room for the job workers
+        self.ADMISSION_READ_LIMIT = int(os.getenv('ADMISSION_READ_LIMIT', '12'))
+        self.ADMISSION_WRITE_LIMIT = int(os.getenv('ADMISSION_WRITE_LIMIT', '8'))
+        self.ADMISSION_EXPORT_LIMIT = int(os.getenv('ADMISSION_EXPORT_LIMIT', '4'))
+        # Longest a request waits for a slot before 503 + Retry-After
+        self.ADMISSION_WAIT_SECONDS = float(os.getenv('ADMISSION_WAIT_SECONDS', '5'))
+        self.ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '200'))
+        self.ADMISSION_MAX_QUEUED_PER_USER = int(os.getenv('ADMISSION_MAX_QUEUED_PER_USER', '10'))
+
+        # Optional DuckDB analytics sidecar ('' disables, 'duckdb' enables; needs `pip install duckdb`).
+        # Source 'parquet' queries snapshots written to ANALYTICS_DIR, 'sqlite' attaches the database file
+        self.ANALYTICS_ENGINE = os.getenv('ANALYTICS_ENGINE', '').lower()
+        self.ANALYTICS_SOURCE = os.getenv('ANALYTICS_SOURCE', 'parquet').lower()
+        self.ANALYTICS_DIR = os.getenv('ANALYTICS_DIR', './analytics')
+        self.ANALYTICS_REFRESH_SECONDS = float(os.getenv('ANALYTICS_REFRESH_SECONDS', '60'))
+        # DuckDB worker threads (0 uses every core)
+        self.ANALYTICS_THREADS = int(os.getenv('ANALYTICS_THREADS', '0'))
+
+        # Largest page /api/query returns
+        self.QUERY_MAX_LIMIT = int(os.getenv('QUERY_MAX_LIMIT', '1000'))
+
+        # Baseline forecasts cached per (business unit, data version, method, window)
+        self.FORECAST_CACHE_SIZE = int(os.getenv('FORECAST_CACHE_SIZE', '16'))
+
+        # Logging: records pass through a bounded queue to a background writer thread, so requests
+        # never wait on log I/O (records are dropped and counted when the queue is full)
+        self.LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+        # Per-logger levels, e.g. "api.access=WARNING,job_queue=DEBUG"
+        self.LOG_LEVELS = self._get_log_levels(os.getenv('LOG_LEVELS', ''))
+        self.LOG_FORMAT = os.getenv('LOG_FORMAT', 'json' if self.is_production() else 'text').lower()
+        self.LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+        # Fraction of requests whose payloads are logged (0 disables), truncated to LOG_PAYLOAD_MAX_CHARS
+        self.LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0'))
+        self.LOG_PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '2000'))
+        # Requests slower than this are logged as warnings
+        self.LOG_SLOW_REQUEST_MS = float(os.getenv('LOG_SLOW_REQUEST_MS', '2000'))
+
+        # Admin endpoints (e.g. submit all business units) require this token in X-Admin-Token
+        self.ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+        self.BATCH_EXPORT_PROCESSES = int(os.getenv('BATCH_EXPORT_PROCESSES', str(os.cpu_count() or 2)))
+
         # Security
         self.SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
         self.SESSION_TIMEOUT_HOURS = int(os.getenv('SESSION_TIMEOUT_HOURS', '8'))
@@ -58,6 +172,15 @@ class Config:
         # Default to SQLite for development
         return "sqlite:///./China_2025B.db"
 
+    def _get_log_levels(self, value: str) -> Dict[str, str]:
+        """Parse "logger=LEVEL,..." into {logger: LEVEL}"""
+        levels = {}
+        for item in value.split(','):
+            name, _, level = item.partition('=')
+            if name.strip() and level.strip():
+                levels[name.strip()] = level.strip().upper()
+        return levels
+
     def is_production(self) -> bool:
         return self.ENVIRONMENT.lower() == 'production'
     
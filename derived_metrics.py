@@ -0,0 +1,108 @@
+"""Derived metric columns computed in bulk with NumPy
+
+Each metric is a vectorized function of year columns. Row metrics are
+computed for a whole business unit at once and cached per
+(business_unit, data_version); rollups apply the same functions to the
+group totals, so a group's growth is its total growth, not an average.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from fact_store import row_arrays
+from versioned_cache import VersionedCache
+from config import config
+
+Columns = Dict[str, np.ndarray]
+
+# Years from Y2024R08 to Y2029P
+CAGR_YEARS = 5
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    # Undefined (NaN) where the base is zero or negative
+    return np.divide(numerator, denominator, out=np.full(len(numerator), np.nan), where=denominator > 0)
+
+# name -> (input columns, description, function of the input columns)
+METRICS: Dict[str, Tuple[List[str], str, Callable[[Columns], np.ndarray]]] = {
+    'yoy_2025B': (
+        ['Y2025B', 'Y2024R08'], "Growth of Y2025B over Y2024R08",
+        lambda c: _ratio(c['Y2025B'] - c['Y2024R08'], c['Y2024R08'])
+    ),
+    'cagr_2024_2029': (
+        ['Y2029P', 'Y2024R08'], f"Compound annual growth from Y2024R08 to Y2029P ({CAGR_YEARS} years)",
+        lambda c: np.power(_ratio(c['Y2029P'], c['Y2024R08']), 1 / CAGR_YEARS) - 1
+    ),
+    'var_avg1924': (
+        ['Y2025B', 'avg1924'], "Y2025B minus avg1924",
+        lambda c: c['Y2025B'] - c['avg1924']
+    ),
+    'var_avg1924_pct': (
+        ['Y2025B', 'avg1924'], "Y2025B minus avg1924, relative to avg1924",
+        lambda c: _ratio(c['Y2025B'] - c['avg1924'], c['avg1924'])
+    ),
+}
+
+METRIC_INPUTS = sorted({column for inputs, _, _ in METRICS.values() for column in inputs})
+
+def parse_metrics(value: Optional[str]) -> List[str]:
+    """Metric names from a comma separated query parameter; 'all' selects every metric"""
+    if not value:
+        return []
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    if names == ['all']:
+        return list(METRICS)
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}; available: {', '.join(METRICS)}")
+    return names
+
+def compute(columns: Columns, names: List[str]) -> Columns:
+    """Metric arrays for the given input column arrays (missing inputs give NaN)"""
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        return {name: METRICS[name][2](columns) for name in names}
+
+def to_values(array: np.ndarray) -> List[Optional[float]]:
+    """JSON-ready values: NaN and infinities become None"""
+    return [float(value) if np.isfinite(value) else None for value in array]
+
+class MetricsCache(VersionedCache):
+    """Every metric for every row of a business unit, cached per data version"""
+    def __init__(self, size: Optional[int] = None):
+        super().__init__(size or config.PIVOT_CACHE_SIZE)
+
+    def get(self, db: Session, business_unit: str) -> Tuple[np.ndarray, Columns]:
+        """(sorted row ids, {metric: values aligned with the ids}) for the BU's current data version"""
+        def build():
+            ids, data = row_arrays(db, business_unit, METRIC_INPUTS)
+            return ids, compute(dict(zip(METRIC_INPUTS, data.T)), list(METRICS))
+        return super().get(db, business_unit, build)[1]
+
+metrics_cache = MetricsCache()
+
+def attach_row_metrics(db: Session, business_unit: str, records: List[Dict[str, Any]], names: List[str]) -> List[Dict[str, Any]]:
+    """Add the selected metric columns to serialized rows of one business unit"""
+    if not names or not records:
+        return records
+    ids, metrics = metrics_cache.get(db, business_unit)
+    wanted = np.fromiter((record["id"] for record in records), dtype=np.int64, count=len(records))
+    if not len(ids):
+        for record in records:
+            record.update(dict.fromkeys(names))
+        return records
+    positions = np.clip(np.searchsorted(ids, wanted), 0, len(ids) - 1)
+    found = ids[positions] == wanted
+    for name in names:
+        for record, value in zip(records, to_values(np.where(found, metrics[name][positions], np.nan))):
+            record[name] = value
+    return records
+
+def attach_group_metrics(groups: List[Dict[str, Any]], names: List[str]) -> List[Dict[str, Any]]:
+    """Add the selected metrics to rollup groups, computed from each group's totals"""
+    if not names or not groups:
+        return groups
+    columns = {column: np.array([group[column] for group in groups], dtype=np.float64) for column in METRIC_INPUTS}
+    for name, values in compute(columns, names).items():
+        for group, value in zip(groups, to_values(values)):
+            group[name] = value
+    return groups
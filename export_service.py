@@ -0,0 +1,268 @@
+"""Exports of the budget data: Parquet / Arrow IPC for PowerBI, streamed XLSX for users"""
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import groupby
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import xlsxwriter
+
+from DatabaseManager import (
+    BUDGET_CYCLE, China2025B, DataVersion, DESCRIPTIVE_COLUMNS, HISTORY_COLUMNS, PLAN_COLUMNS,
+    database_stamp, get_data_version, decode_dimensions, shard_router
+)
+from fact_store import select_rows
+from config import config
+
+# PowerBI feed file names follow the active cycle's table
+SOURCE_FEED_NAME = f"{China2025B.__tablename__}_powerbi_source_data"
+SUBMISSION_FEED_NAME = f"{China2025B.__tablename__}_powerbi_submission_data"
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Typed schemas so the year columns stay float64 instead of being re-guessed from text
+SOURCE_SCHEMA = pa.schema(
+    [(col, pa.string()) for col in DESCRIPTIVE_COLUMNS]
+    + [('user_id', pa.string()), ('business_unit', pa.string())]
+    + [(col, pa.float64()) for col in HISTORY_COLUMNS]
+)
+
+SUBMISSION_SCHEMA = pa.schema(
+    [('user_id', pa.string()), ('business_unit', pa.string())]
+    + [(col, pa.float64()) for col in PLAN_COLUMNS]
+    + [('Sales_Remark', pa.string())]
+)
+
+FULL_SCHEMA = pa.schema(
+    [('id', pa.int64()), ('user_id', pa.string()), ('business_unit', pa.string())]
+    + [(col, pa.string()) for col in DESCRIPTIVE_COLUMNS]
+    + [(col, pa.float64()) for col in HISTORY_COLUMNS + PLAN_COLUMNS]
+    + [('Sales_Remark', pa.string())]
+)
+
+def rows_to_table(rows: List[tuple], schema: pa.Schema) -> pa.Table:
+    """Build an Arrow table from query result tuples ordered like the schema"""
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    arrays = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def write_parquet(
+    table: pa.Table,
+    name: str,
+    partition_by_bu: Optional[bool] = None,
+    export_dir: Optional[str] = None
+) -> str:
+    """Write a table to the PowerBI feed directory and return the written path
+
+    When partitioning by business unit, only the partitions present in ``table``
+    are replaced, so a single BU submission does not rewrite the other BUs.
+    """
+    export_dir = export_dir or config.POWERBI_EXPORT_DIR
+    if partition_by_bu is None:
+        partition_by_bu = config.POWERBI_PARTITION_BY_BU
+    os.makedirs(export_dir, exist_ok=True)
+
+    if partition_by_bu:
+        root_path = os.path.join(export_dir, name)
+        pq.write_to_dataset(
+            table,
+            root_path=root_path,
+            partition_cols=['business_unit'],
+            existing_data_behavior='delete_matching',
+            compression=config.PARQUET_COMPRESSION
+        )
+        return root_path
+
+    path = os.path.join(export_dir, f"{name}.parquet")
+    # Write next to the target and swap, so PowerBI never reads a half-written file
+    # (a unique name per writer, since two job workers may write the feed at once)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    pq.write_table(table, tmp_path, compression=config.PARQUET_COMPRESSION)
+    os.replace(tmp_path, path)
+    return path
+
+# Single-BU submits rewrite the consolidated feed read-modify-write; one writer at a time in this process
+_feed_lock = threading.Lock()
+
+def replace_business_unit_rows(
+    table: pa.Table,
+    name: str,
+    business_unit: str,
+    export_dir: Optional[str] = None
+) -> str:
+    """Replace one business unit's rows in a feed, keeping every other BU's rows, and return the path"""
+    if config.POWERBI_PARTITION_BY_BU:
+        # Only the BU's partition is replaced
+        return write_parquet(table, name, partition_by_bu=True, export_dir=export_dir)
+    path = os.path.join(export_dir or config.POWERBI_EXPORT_DIR, f"{name}.parquet")
+    with _feed_lock:
+        if os.path.exists(path):
+            existing = pq.read_table(path, schema=table.schema)
+            keep = pc.fill_null(pc.not_equal(existing['business_unit'], business_unit), True)
+            table = pa.concat_tables([existing.filter(keep), table])
+        return write_parquet(table, name, partition_by_bu=False, export_dir=export_dir)
+
+def to_arrow_ipc(table: pa.Table) -> bytes:
+    """Serialize a table to the Arrow IPC streaming format"""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _file_name(business_unit: str) -> str:
+    # Percent-encoded like shard files, so different business units never share a name
+    return quote(business_unit, safe='')
+
+def xlsx_export_path(business_unit: str, stamp: str, data_version: int) -> str:
+    """Location of the cached workbook for a business unit at a data version of one database build
+
+    The database stamp keeps a rebuilt database (versions back at 0) from
+    being served the previous database's workbooks.
+    """
+    return os.path.join(
+        config.EXPORT_CACHE_DIR, f"{BUDGET_CYCLE}_{stamp}_{_file_name(business_unit)}_v{data_version}.xlsx"
+    )
+
+def write_xlsx(rows, path: str, columns: List[str]) -> int:
+    """Stream rows into a workbook in xlsxwriter constant-memory mode
+
+    ``rows`` can be any iterable of tuples ordered like ``columns``; each row is
+    flushed to disk as soon as the next one starts, so memory stays flat.
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        worksheet = workbook.add_worksheet('Budget')
+        header_format = workbook.add_format({'bold': True})
+        worksheet.write_row(0, 0, columns, header_format)
+        row_count = 0
+        for row_count, row in enumerate(rows, start=1):
+            worksheet.write_row(row_count, 0, ['' if value is None else value for value in row])
+    finally:
+        workbook.close()
+    return row_count
+
+def _build_xlsx_file(path: str, rows, columns: List[str]):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        write_xlsx(rows, tmp_path, columns)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _remove_old_versions(business_unit: str, keep_path: str):
+    # Older versions of this BU, and any version of an earlier database build, can no longer be requested
+    pattern = re.compile(rf"{re.escape(BUDGET_CYCLE)}_(\d+_)?{re.escape(_file_name(business_unit))}_v\d+\.xlsx")
+    for name in os.listdir(config.EXPORT_CACHE_DIR):
+        if pattern.fullmatch(name) and name != os.path.basename(keep_path):
+            try:
+                os.remove(os.path.join(config.EXPORT_CACHE_DIR, name))
+            except OSError:
+                pass
+
+def get_or_build_xlsx(db, business_unit: str) -> str:
+    """Return the cached workbook for the BU's current data version, building it if needed"""
+    data_version = get_data_version(db, business_unit)
+    path = xlsx_export_path(business_unit, database_stamp(db), data_version)
+    if os.path.exists(path):
+        return path
+
+    columns = [field.name for field in FULL_SCHEMA]
+    rows = select_rows(
+        db, columns, China2025B.business_unit == business_unit, order_by=[China2025B.id]
+    )
+
+    _build_xlsx_file(path, decode_dimensions(rows, columns), columns)
+    _remove_old_versions(business_unit, path)
+    return path
+
+def _build_bu_export(business_unit: str, stamp: str, data_version: int, rows: List[tuple]) -> Dict[str, Any]:
+    """Process-pool worker: the BU's cached workbook plus its slice of the submission feed"""
+    started = time.perf_counter()
+    columns = [field.name for field in FULL_SCHEMA]
+    path = xlsx_export_path(business_unit, stamp, data_version)
+    if not os.path.exists(path):
+        _build_xlsx_file(path, rows, columns)
+        _remove_old_versions(business_unit, path)
+    submission = rows_to_table(rows, FULL_SCHEMA).select(SUBMISSION_SCHEMA.names)
+    return {
+        "business_unit": business_unit,
+        "records": len(rows),
+        "data_version": data_version,
+        "xlsx_path": path,
+        "seconds": round(time.perf_counter() - started, 3),
+        "submission": submission
+    }
+
+def _read_snapshot(db) -> Tuple[Dict[str, int], List[tuple]]:
+    """Data versions and every row of one database, ordered by business unit and id"""
+    if db.get_bind().dialect.name == 'postgresql':
+        # Both reads below see the same snapshot
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    # Versions are read first: if a save slips in between on SQLite, a workbook
+    # is labelled with an older version (rebuilt later), never a stale one newer
+    versions = dict(db.query(DataVersion.business_unit, DataVersion.version).all())
+    # A single SELECT sees one consistent snapshot of all business units
+    columns = [field.name for field in FULL_SCHEMA]
+    snapshot = list(select_rows(db, columns, order_by=[China2025B.business_unit, China2025B.id]))
+    db.commit()
+    return versions, snapshot
+
+def export_all_business_units(db) -> Dict[str, Any]:
+    """Snapshot every BU in one read, build per-BU exports in parallel, consolidate the feed"""
+    started = time.perf_counter()
+    columns = [field.name for field in FULL_SCHEMA]
+    stamp = database_stamp(db)
+    if shard_router.enabled:
+        # One snapshot per shard, read in parallel; each business unit is still consistent with its version
+        versions, snapshot = {}, []
+        for shard_versions, shard_rows in shard_router.map(_read_snapshot):
+            versions.update(shard_versions)
+            snapshot.extend(shard_rows)
+    else:
+        versions, snapshot = _read_snapshot(db)
+    snapshot_seconds = round(time.perf_counter() - started, 3)
+
+    business_unit_index = columns.index('business_unit')
+    # Labels are resolved here so the worker processes need no database access
+    groups = [
+        (business_unit, list(decode_dimensions(rows, columns)))
+        for business_unit, rows in groupby(snapshot, key=lambda row: row[business_unit_index])
+    ]
+    if not groups:
+        return {"business_units": [], "records": 0, "snapshot_seconds": snapshot_seconds,
+                "total_seconds": round(time.perf_counter() - started, 3)}
+
+    results = []
+    workers = max(1, min(len(groups), config.BATCH_EXPORT_PROCESSES))
+    # spawn: the API process runs threads, which fork does not copy safely
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [
+            executor.submit(_build_bu_export, business_unit, stamp, versions.get(business_unit, 0), rows)
+            for business_unit, rows in groups
+        ]
+        for future in as_completed(futures):
+            results.append(future.result())
+    results.sort(key=lambda result: result["business_unit"])
+
+    consolidated = pa.concat_tables([result.pop("submission") for result in results])
+    # Every BU is in the snapshot, so the whole feed is replaced
+    with _feed_lock:
+        consolidated_path = write_parquet(consolidated, SUBMISSION_FEED_NAME)
+    return {
+        "business_units": results,
+        "records": consolidated.num_rows,
+        "consolidated_path": consolidated_path,
+        "snapshot_seconds": snapshot_seconds,
+        "total_seconds": round(time.perf_counter() - started, 3)
+    }
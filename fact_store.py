@@ -0,0 +1,274 @@
+"""Long-format storage of the year columns: one budget_facts row per (row, period)
+
+With STORAGE_LAYOUT=long the year values are read from and written to
+``budget_facts`` instead of the wide China_2025B columns. An edit touches only
+the cells involved, a new period is new rows instead of a schema change, and
+the wide shape the API returns is rebuilt by a pivot cached per
+(business_unit, data_version).
+
+    python fact_store.py load      # copy the wide year columns into budget_facts
+    python fact_store.py unload    # write budget_facts back into the wide columns
+"""
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import delete, func, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from DatabaseManager import (
+    SessionLocal, China2025B, BudgetFact, PERIOD_COLUMNS, column_expression,
+    bump_data_version
+)
+from versioned_cache import VersionedCache
+from config import config
+
+# SQLite limits the number of bound parameters per statement
+ID_CHUNK_SIZE = 5000
+
+Cells = Dict[int, Dict[str, Optional[float]]]
+
+def is_long_layout() -> bool:
+    return config.STORAGE_LAYOUT == 'long'
+
+def ordered_periods(periods: Iterable[str]) -> List[str]:
+    """Known year columns in their usual order, followed by any new periods"""
+    periods = set(periods)
+    return [p for p in PERIOD_COLUMNS if p in periods] + sorted(periods - set(PERIOD_COLUMNS))
+
+def list_periods(db: Session) -> List[str]:
+    if not is_long_layout():
+        return list(PERIOD_COLUMNS)
+    return ordered_periods(period for (period,) in db.query(BudgetFact.period).distinct())
+
+def read_cells(db: Session, row_ids: Iterable[int], periods: Optional[Iterable[str]] = None) -> Cells:
+    """Stored period values per row id (missing cells are absent from the result)"""
+    row_ids = list(row_ids)
+    periods = list(periods) if periods is not None else None
+    cells: Cells = {}
+    for start in range(0, len(row_ids), ID_CHUNK_SIZE):
+        query = db.query(BudgetFact.row_id, BudgetFact.period, BudgetFact.value).filter(
+            BudgetFact.row_id.in_(row_ids[start:start + ID_CHUNK_SIZE])
+        )
+        if periods is not None:
+            query = query.filter(BudgetFact.period.in_(periods))
+        for row_id, period, value in query:
+            cells.setdefault(row_id, {})[period] = value
+    return cells
+
+def write_cells(
+    db: Session,
+    cells: List[Tuple[int, str, Optional[float]]],
+    existing: Optional[Set[Tuple[int, str]]] = None
+):
+    """Set individual (row_id, period, value) cells; the caller owns the transaction
+
+    ``existing`` are the (row_id, period) keys already stored, if the caller
+    has just read them; otherwise they are looked up here.
+    """
+    if not cells:
+        return
+    if existing is None:
+        stored = read_cells(db, {row_id for row_id, _, _ in cells}, {period for _, period, _ in cells})
+        existing = {(row_id, period) for row_id, values in stored.items() for period in values}
+    updates = [{"row_id": r, "period": p, "value": v} for r, p, v in cells if (r, p) in existing]
+    inserts = [{"row_id": r, "period": p, "value": v} for r, p, v in cells if (r, p) not in existing]
+    if updates:
+        # Bulk UPDATE by primary key: one statement, executed for each cell
+        db.execute(update(BudgetFact), updates)
+    if inserts:
+        db.execute(insert(BudgetFact), inserts)
+
+def select_rows(
+    db: Session,
+    names: List[str],
+    *criteria,
+    order_by: Optional[list] = None,
+    chunk_size: Optional[int] = None,
+    limit: Optional[int] = None,
+    offset: Optional[int] = None
+) -> Iterator[tuple]:
+    """Stream query result tuples ordered like ``names``, whichever layout holds the year columns
+
+    Dimension columns come back as keys (see ``DatabaseManager.decode_dimensions``).
+    In the long layout the year values are filled in from budget_facts a chunk of rows at a time.
+    """
+    chunk_size = chunk_size or config.EXPORT_CHUNK_SIZE
+    if not is_long_layout():
+        query = db.query(*[column_expression(name) for name in names]).filter(*criteria)
+        if order_by is not None:
+            query = query.order_by(*order_by)
+        yield from query.limit(limit).offset(offset).yield_per(chunk_size)
+        return
+
+    periods = [name for name in names if name in PERIOD_COLUMNS]
+    others = [name for name in names if name not in PERIOD_COLUMNS]
+    query = db.query(China2025B.id, *[column_expression(name) for name in others]).filter(*criteria)
+    if order_by is not None:
+        query = query.order_by(*order_by)
+    query = query.limit(limit).offset(offset)
+
+    def emit(chunk):
+        cells = read_cells(db, [row[0] for row in chunk], periods)
+        for row in chunk:
+            values = dict(zip(others, row[1:]))
+            values.update(cells.get(row[0], {}))
+            yield tuple(values.get(name) for name in names)
+
+    chunk = []
+    for row in query.yield_per(chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from emit(chunk)
+            chunk = []
+    if chunk:
+        yield from emit(chunk)
+
+def row_arrays(db: Session, business_unit: str, names: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted row ids of a business unit and a float64 (rows, names) array of their values"""
+    # Plain tuples: NumPy probes result rows for array attributes one by one
+    rows = [tuple(row) for row in select_rows(
+        db, ['id'] + names, China2025B.business_unit == business_unit, order_by=[China2025B.id]
+    )]
+    # None becomes NaN in a float array
+    data = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), len(names))
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    return ids, data
+
+def period_expression(period: str):
+    """SQL expression for a period's value of each China2025B row, in either layout"""
+    if not is_long_layout():
+        return getattr(China2025B, period)
+    return select(BudgetFact.value).where(
+        BudgetFact.row_id == China2025B.id, BudgetFact.period == period
+    ).scalar_subquery()
+
+def period_values(db: Session, period: str, *criteria) -> List[Tuple[int, Optional[float]]]:
+    """(row_id, value) of one period for the rows matching ``criteria``"""
+    if not is_long_layout():
+        if period not in PERIOD_COLUMNS:
+            return []
+        query = db.query(China2025B.id, getattr(China2025B, period))
+    else:
+        query = db.query(BudgetFact.row_id, BudgetFact.value).join(
+            China2025B, China2025B.id == BudgetFact.row_id
+        ).filter(BudgetFact.period == period)
+    return [tuple(row) for row in query.filter(*criteria).order_by(China2025B.id).all()]
+
+def grouped_totals(db: Session, keys: list, periods: List[str], *criteria) -> List[tuple]:
+    """Rows of (*keys, row count, *period sums) grouped by the given key columns"""
+    if not is_long_layout():
+        query = db.query(
+            *keys,
+            func.count(China2025B.id),
+            *[func.sum(getattr(China2025B, period)) for period in periods]
+        ).filter(*criteria)
+        return [tuple(row) for row in query.group_by(*keys).all()]
+
+    counts = db.query(*keys, func.count(China2025B.id)).filter(*criteria).group_by(*keys).all()
+    sums: Dict[tuple, Dict[str, Any]] = {}
+    query = db.query(*keys, BudgetFact.period, func.sum(BudgetFact.value)).join(
+        BudgetFact, BudgetFact.row_id == China2025B.id
+    ).filter(BudgetFact.period.in_(periods), *criteria).group_by(*keys, BudgetFact.period)
+    for row in query.all():
+        sums.setdefault(tuple(row[:len(keys)]), {})[row[len(keys)]] = row[-1]
+    return [
+        tuple(row) + tuple(sums.get(tuple(row[:len(keys)]), {}).get(period) for period in periods)
+        for row in counts
+    ]
+
+def merge_grouped_totals(parts: Iterable[List[tuple]], key_count: int) -> List[tuple]:
+    """Combine grouped_totals results of several databases (shards) into one row per key"""
+    merged: Dict[tuple, list] = {}
+    for rows in parts:
+        for row in rows:
+            key = tuple(row[:key_count])
+            if key not in merged:
+                merged[key] = list(row[key_count:])
+                continue
+            totals = merged[key]
+            totals[0] += row[key_count]
+            for i, value in enumerate(row[key_count + 1:], start=1):
+                if value is not None:
+                    # SUM is NULL only when every value is NULL
+                    totals[i] = value if totals[i] is None else totals[i] + value
+    return [key + tuple(totals) for key, totals in merged.items()]
+
+class PivotCache(VersionedCache):
+    """Wide-shaped period values per business unit, cached per data version"""
+    def __init__(self, size: Optional[int] = None):
+        super().__init__(size or config.PIVOT_CACHE_SIZE)
+
+    def get(self, db: Session, business_unit: str) -> Tuple[List[str], Cells]:
+        """(periods, {row_id: {period: value}}) for the BU's current data version"""
+        return super().get(db, business_unit, lambda: self._pivot(db, business_unit))[1]
+
+    @staticmethod
+    def _pivot(db: Session, business_unit: str) -> Tuple[List[str], Cells]:
+        cells: Cells = {}
+        query = db.query(BudgetFact.row_id, BudgetFact.period, BudgetFact.value).join(
+            China2025B, China2025B.id == BudgetFact.row_id
+        ).filter(China2025B.business_unit == business_unit)
+        for row_id, period, value in query:
+            cells.setdefault(row_id, {})[period] = value
+        periods = ordered_periods(set(PERIOD_COLUMNS).union(*[values.keys() for values in cells.values()]))
+        return periods, cells
+
+pivot_cache = PivotCache()
+
+def overlay_periods(db: Session, business_unit: str, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Replace the year values of serialized rows with the BU's pivoted facts (long layout only)"""
+    if not is_long_layout() or not records:
+        return records
+    periods, cells = pivot_cache.get(db, business_unit)
+    for record in records:
+        values = cells.get(record["id"], {})
+        for period in periods:
+            record[period] = values.get(period)
+    return records
+
+def load_from_wide(db: Session) -> int:
+    """Copy the wide year columns into budget_facts, replacing existing facts; returns cells written"""
+    db.execute(delete(BudgetFact))
+    written = 0
+    for period in PERIOD_COLUMNS:
+        result = db.execute(insert(BudgetFact).from_select(
+            ['row_id', 'period', 'value'],
+            select(China2025B.id, literal(period), getattr(China2025B, period))
+        ))
+        written += result.rowcount or 0
+    for (business_unit,) in db.query(China2025B.business_unit).distinct():
+        bump_data_version(db, business_unit)
+    return written
+
+def unload_to_wide(db: Session) -> List[str]:
+    """Write budget_facts back into the wide columns; returns periods that have no column"""
+    for period in PERIOD_COLUMNS:
+        db.execute(update(China2025B).values({
+            period: select(BudgetFact.value).where(
+                BudgetFact.row_id == China2025B.id, BudgetFact.period == period
+            ).scalar_subquery()
+        }))
+    for (business_unit,) in db.query(China2025B.business_unit).distinct():
+        bump_data_version(db, business_unit)
+    stored = {period for (period,) in db.query(BudgetFact.period).distinct()}
+    return sorted(stored - set(PERIOD_COLUMNS))
+
+if __name__ == "__main__":
+    # Switch layouts: run `load` before setting STORAGE_LAYOUT=long, `unload` before going back
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    db = SessionLocal()
+    try:
+        if command == 'load':
+            print(f"Loaded {load_from_wide(db)} cells into budget_facts")
+        elif command == 'unload':
+            extra = unload_to_wide(db)
+            print("Wrote budget_facts back to the wide columns")
+            if extra:
+                print(f"Periods without a wide column were left in budget_facts: {', '.join(extra)}")
+        else:
+            print("Usage: python fact_store.py load|unload")
+            sys.exit(1)
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,244 @@
+"""Database-backed job queue with a bounded worker pool
+
+Jobs survive restarts and redeploys because they live in the ``jobs`` table.
+Each process runs a small pool of worker threads that claim queued jobs, so a
+burst of submissions only adds rows to the table instead of export work to the
+request workers.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+from DatabaseManager import SessionLocal, Job
+from config import config
+from portal_logging import request_id_var
+
+logger = logging.getLogger(__name__)
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+
+def register_handler(kind: str):
+    """Decorator registering the function that runs jobs of ``kind``"""
+    def decorator(func: Callable[[Dict[str, Any]], Any]):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+def enqueue(
+    db: Session,
+    kind: str,
+    payload: Dict[str, Any],
+    dedupe_key: Optional[str] = None,
+    max_attempts: Optional[int] = None
+) -> Job:
+    """Queue a job in the caller's transaction, reusing a queued job with the same key"""
+    now = datetime.utcnow()
+    if dedupe_key:
+        existing = db.query(Job).filter(
+            and_(Job.kind == kind, Job.dedupe_key == dedupe_key, Job.status == 'queued')
+        ).order_by(Job.id).first()
+        if existing:
+            existing.payload = json.dumps(payload)
+            existing.run_after = min(existing.run_after, now)
+            existing.updated_at = now
+            return existing
+
+    job = Job(
+        kind=kind,
+        dedupe_key=dedupe_key,
+        payload=json.dumps(payload),
+        status='queued',
+        attempts=0,
+        max_attempts=max_attempts or config.JOB_MAX_ATTEMPTS,
+        run_after=now,
+        created_at=now,
+        updated_at=now
+    )
+    db.add(job)
+    db.flush()
+    if worker_pool is not None:
+        worker_pool.wake()
+    return job
+
+def job_to_dict(job: Job) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "run_after": job.run_after.isoformat() if job.run_after else None,
+        "coalesced_into": job.coalesced_into,
+        "last_error": job.last_error,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat(),
+    }
+
+def get_job(db: Session, job_id: int) -> Optional[Dict[str, Any]]:
+    job = db.query(Job).filter(Job.id == job_id).first()
+    return job_to_dict(job) if job else None
+
+class JobWorkerPool:
+    """Fixed number of threads claiming and running queued jobs"""
+    def __init__(self, workers: Optional[int] = None, poll_seconds: Optional[float] = None):
+        self.workers = workers or config.JOB_WORKERS
+        self.poll_seconds = poll_seconds or config.JOB_POLL_SECONDS
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self):
+        self.requeue_stale()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def requeue_stale(self):
+        """Put back jobs whose worker died mid-run (lease expired)"""
+        db = SessionLocal()
+        try:
+            cutoff = datetime.utcnow() - timedelta(seconds=config.JOB_LEASE_SECONDS)
+            db.query(Job).filter(
+                and_(Job.status == 'running', Job.locked_at < cutoff)
+            ).update({Job.status: 'queued', Job.locked_by: None}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _claim(self, db: Session) -> Optional[Job]:
+        now = datetime.utcnow()
+        query = db.query(Job.id).filter(
+            and_(Job.status == 'queued', Job.run_after <= now)
+        ).order_by(Job.run_after, Job.id)
+        if db.get_bind().dialect.name == 'postgresql':
+            query = query.with_for_update(skip_locked=True)
+        candidate = query.first()
+        if not candidate:
+            db.rollback()
+            return None
+
+        # Conditional update: only one worker (in any process) wins the job
+        claimed = db.query(Job).filter(
+            and_(Job.id == candidate.id, Job.status == 'queued')
+        ).update({
+            Job.status: 'running',
+            Job.locked_by: self.worker_id,
+            Job.locked_at: now,
+            Job.attempts: Job.attempts + 1,
+            Job.updated_at: now
+        }, synchronize_session=False)
+        if not claimed:
+            db.rollback()
+            return None
+
+        job = db.query(Job).filter(Job.id == candidate.id).first()
+        # Anything queued for the same key before now is covered by this run
+        if job.dedupe_key:
+            db.query(Job).filter(
+                and_(
+                    Job.kind == job.kind,
+                    Job.dedupe_key == job.dedupe_key,
+                    Job.status == 'queued',
+                    Job.id != job.id,
+                    Job.created_at <= now
+                )
+            ).update({
+                Job.status: 'coalesced',
+                Job.coalesced_into: job.id,
+                Job.updated_at: now
+            }, synchronize_session=False)
+        db.commit()
+        return job
+
+    def _finish(self, db: Session, job: Job, result: Any = None, error: Optional[str] = None):
+        now = datetime.utcnow()
+        job.updated_at = now
+        job.locked_by = None
+        if error is None:
+            job.status = 'succeeded'
+            job.result = json.dumps(result) if result is not None else None
+            job.last_error = None
+        elif job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.last_error = error
+            job.run_after = now + timedelta(
+                seconds=config.JOB_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1))
+            )
+        else:
+            job.status = 'failed'
+            job.last_error = error
+        db.commit()
+
+    def run_one(self) -> bool:
+        """Claim and run a single job; returns False when nothing was ready"""
+        db = SessionLocal()
+        try:
+            job = self._claim(db)
+            if not job:
+                return False
+            handler = HANDLERS.get(job.kind)
+            if handler is None:
+                job.max_attempts = job.attempts
+                self._finish(db, job, error=f"No handler registered for job kind '{job.kind}'")
+                return True
+            # Records logged while the job runs carry the job's id
+            token = request_id_var.set(f"job-{job.id}")
+            try:
+                result = handler(json.loads(job.payload) if job.payload else {})
+            except Exception as e:
+                logger.exception("Job %s (%s) failed: %s", job.id, job.kind, e)
+                self._finish(db, job, error=str(e))
+            else:
+                self._finish(db, job, result=result)
+            finally:
+                request_id_var.reset(token)
+            return True
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                ran = self.run_one()
+            except Exception as e:
+                logger.exception("Job worker error: %s", e)
+                ran = False
+            if not ran:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+# Started by the API on startup
+worker_pool: Optional[JobWorkerPool] = None
+
+def start_workers() -> JobWorkerPool:
+    global worker_pool
+    if worker_pool is None:
+        worker_pool = JobWorkerPool()
+        worker_pool.start()
+    return worker_pool
+
+def stop_workers():
+    global worker_pool
+    if worker_pool is not None:
+        worker_pool.stop()
+        worker_pool = None
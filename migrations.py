@@ -0,0 +1,129 @@
+"""Schema migrations for existing databases
+
+``create_all`` only creates missing tables. Changes to tables that already hold
+data are applied here in order, each in its own transaction, and recorded in
+the ``schema_version`` table so they run once per database.
+"""
+import logging
+import sqlite3
+from datetime import datetime
+
+from sqlalchemy import inspect, text, func, insert, select
+
+from DatabaseManager import SchemaVersion, BUDGET_CYCLE, CYCLE_SCHEMA_MAP, DIMENSION_COLUMNS, dimension_cache
+
+logger = logging.getLogger(__name__)
+
+def _supports_drop_column(conn) -> bool:
+    if conn.dialect.name != 'sqlite':
+        return True
+    return sqlite3.sqlite_version_info >= (3, 35, 0)
+
+def _migrate_dimension_keys(conn):
+    """Move the descriptive string columns into dim_* tables, keeping integer keys on the rows"""
+    inspector = inspect(conn)
+    if 'China_2025B' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('China_2025B')}
+    for col in DIMENSION_COLUMNS:
+        if col not in existing:
+            continue
+        conn.execute(text(
+            f'INSERT INTO "dim_{col}" (value) '
+            f'SELECT DISTINCT "{col}" FROM "China_2025B" '
+            f'WHERE "{col}" IS NOT NULL AND "{col}" NOT IN (SELECT value FROM "dim_{col}") '
+            f'ORDER BY "{col}"'
+        ))
+        if f'{col}_id' not in existing:
+            conn.execute(text(f'ALTER TABLE "China_2025B" ADD COLUMN "{col}_id" INTEGER'))
+        conn.execute(text(
+            f'UPDATE "China_2025B" SET "{col}_id" = '
+            f'(SELECT d.id FROM "dim_{col}" d WHERE d.value = "China_2025B"."{col}")'
+        ))
+        if _supports_drop_column(conn):
+            conn.execute(text(f'ALTER TABLE "China_2025B" DROP COLUMN "{col}"'))
+        else:
+            logger.warning("SQLite %s cannot drop columns; %s is left unused", sqlite3.sqlite_version, col)
+
+def _migrate_budget_cycle(conn):
+    """Tag the original China_2025B rows with their budget cycle and give its facts the cycle name"""
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+    if 'China_2025B' in tables:
+        existing = {column['name'] for column in inspector.get_columns('China_2025B')}
+        if 'budget_cycle' not in existing:
+            conn.execute(text(
+                'ALTER TABLE "China_2025B" ADD COLUMN budget_cycle VARCHAR NOT NULL DEFAULT \'2025B\''
+            ))
+    if 'budget_facts' in tables:
+        if 'budget_facts_2025B' in tables:
+            conn.execute(text(
+                'INSERT INTO "budget_facts_2025B" (row_id, period, value) '
+                'SELECT row_id, period, value FROM budget_facts'
+            ))
+            conn.execute(text('DROP TABLE budget_facts'))
+        else:
+            conn.execute(text('ALTER TABLE budget_facts RENAME TO "budget_facts_2025B"'))
+
+def _migrate_search_indexes(conn):
+    """Index the dimension keys and Customer_Note of the active cycle's rows"""
+    from budget_search import ensure_search_indexes
+    ensure_search_indexes(conn)
+
+def ensure_journal_cycle(conn):
+    """Give change_journal its budget_cycle column; earlier entries are taken to be the active cycle's
+
+    Also applied to shard files built before the column existed.
+    """
+    inspector = inspect(conn)
+    if 'change_journal' not in inspector.get_table_names():
+        return
+    if 'budget_cycle' not in {column['name'] for column in inspector.get_columns('change_journal')}:
+        conn.execute(text(
+            f'ALTER TABLE change_journal ADD COLUMN budget_cycle VARCHAR NOT NULL DEFAULT \'{BUDGET_CYCLE}\''
+        ))
+
+# (version, description, function); append new migrations at the end
+MIGRATIONS = [
+    (1, "dimension keys for descriptive columns", _migrate_dimension_keys),
+    (2, "budget cycle column", _migrate_budget_cycle),
+    (3, "search indexes for dimension keys and Customer_Note", _migrate_search_indexes),
+    (4, "budget cycle of change journal entries", ensure_journal_cycle),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn) -> int:
+    if 'schema_version' not in inspect(conn).get_table_names():
+        return 0
+    return conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+
+def schema_is_current(engine, tables) -> bool:
+    """True if every table exists and every migration is applied (one catalog query per schema)"""
+    expected = {}
+    for table in tables:
+        schema = CYCLE_SCHEMA_MAP.get(table.schema, table.schema)
+        expected.setdefault(schema, set()).add(table.name)
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        for schema, names in expected.items():
+            if not names <= set(inspector.get_table_names(schema=schema)):
+                return False
+        return conn.execute(select(func.max(SchemaVersion.version))).scalar() == LATEST_VERSION
+
+def run_migrations(engine) -> int:
+    """Apply pending migrations and return the resulting schema version"""
+    with engine.connect() as conn:
+        current = get_schema_version(conn)
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Applying schema migration %s: %s", version, description)
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(insert(SchemaVersion).values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+        current = version
+    dimension_cache.invalidate()
+    return current
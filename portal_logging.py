@@ -0,0 +1,205 @@
+"""Structured logging that never blocks the caller
+
+Records go through a bounded in-memory queue to one background thread that
+formats and writes them (JSON lines or text on stdout). A caller only puts the
+record on the queue; when the queue is full the record is dropped and counted
+instead of waiting. Every record carries the request id of the API request
+(or background job) that logged it. Levels are set with LOG_LEVEL and
+per-logger LOG_LEVELS.
+
+Request payloads are logged only for a LOG_PAYLOAD_SAMPLE_RATE fraction of
+requests, chosen by request id so a request is either fully logged or not.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from config import config
+
+REQUEST_ID_HEADER = 'x-request-id'
+# Client-supplied ids are kept only if short and printable
+VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('request_id', default=None)
+
+access_logger = logging.getLogger('api.access')
+payload_logger = logging.getLogger('api.payload')
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id (runs in the caller's thread, before queueing)"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking or raising when the queue is full"""
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; extra={"fields": {...}} adds structured fields"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry["request_id"] = record.request_id
+        entry.update(getattr(record, 'fields', None) or {})
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Readable lines for development: time, level, logger, [request id], message, key=value fields"""
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s%(request)s %(message)s%(extra_fields)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        request_id = getattr(record, 'request_id', None)
+        record.request = f" [{request_id}]" if request_id else ''
+        fields = getattr(record, 'fields', None) or {}
+        record.extra_fields = ''.join(f" {name}={value}" for name, value in fields.items())
+        return super().format(record)
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+def setup_logging():
+    """Send the root logger's records through the queue (idempotent; safe on Streamlit reruns)"""
+    global _handler, _listener
+    with _setup_lock:
+        if _handler is not None:
+            return
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if config.LOG_FORMAT == 'json' else TextFormatter())
+        log_queue: queue.Queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+        _handler = DroppingQueueHandler(log_queue)
+        _handler.addFilter(RequestIdFilter())
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(config.LOG_LEVEL)
+        for name, level in config.LOG_LEVELS.items():
+            logging.getLogger(name).setLevel(level)
+        atexit.register(stop_logging)
+
+def stop_logging():
+    """Write out the queued records and stop the writer thread"""
+    global _handler, _listener
+    with _setup_lock:
+        if _handler is None:
+            return
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        _handler, _listener = None, None
+
+def dropped_records() -> int:
+    """Records dropped because the queue was full since startup"""
+    return _handler.dropped if _handler is not None else 0
+
+def payload_sampled() -> bool:
+    """Whether the current request's payloads are logged (the same answer for the whole request)"""
+    rate = config.LOG_PAYLOAD_SAMPLE_RATE
+    if rate <= 0:
+        return False
+    if rate >= 1:
+        return True
+    request_id = request_id_var.get()
+    if request_id is None:
+        return random.random() < rate
+    return zlib.crc32(request_id.encode()) / 2 ** 32 < rate
+
+def log_payload(message: str, payload: Any):
+    """Log a (truncated) request payload if this request is sampled; nothing is serialized otherwise
+
+    ``payload`` is a string, a JSON-serializable value or a pydantic model.
+    """
+    if not payload_sampled() or not payload_logger.isEnabledFor(logging.INFO):
+        return
+    if isinstance(payload, str):
+        text = payload
+    elif hasattr(payload, 'model_dump_json'):
+        text = payload.model_dump_json()
+    else:
+        text = json.dumps(payload, default=str)
+    payload_logger.info(message, extra={"fields": {
+        "payload": text[:config.LOG_PAYLOAD_MAX_CHARS], "payload_chars": len(text)
+    }})
+
+class RequestLoggingMiddleware:
+    """ASGI middleware giving every request an id (X-Request-ID) and logging one access record for it"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        request_id = None
+        for name, value in scope.get('headers', []):
+            if name == REQUEST_ID_HEADER.encode():
+                request_id = value.decode('latin-1')
+                break
+        if not request_id or not VALID_REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        status = None
+        retry_after = False
+        start = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status, retry_after
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                retry_after = any(name.lower() == b'retry-after' for name, _ in message.get('headers', []))
+                message['headers'] = list(message.get('headers', [])) + [
+                    (REQUEST_ID_HEADER.encode(), request_id.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        except Exception:
+            status = status or 500
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if status == 503 and retry_after:
+                # Intended rejections (admission control, analytics turned off), not failures
+                level = logging.WARNING
+            elif status is None or status >= 500:
+                level = logging.ERROR
+            elif duration_ms >= config.LOG_SLOW_REQUEST_MS:
+                level = logging.WARNING
+            else:
+                level = logging.INFO
+            if access_logger.isEnabledFor(level):
+                access_logger.log(level, "%s %s %s", scope['method'], scope['path'], status, extra={"fields": {
+                    "method": scope['method'],
+                    "path": scope['path'],
+                    "status": status,
+                    "duration_ms": round(duration_ms, 1),
+                }})
+            request_id_var.reset(token)
@@ -0,0 +1,264 @@
+"""PowerBI REST API client
+
+One pooled HTTP session and one MSAL confidential-client token cache are shared
+by the whole process. The access token is refreshed in the background before
+it expires, so pushes never wait on Azure AD, and the number of requests in
+flight adapts to 429 throttling (halved on 429, grown back on success).
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+POWERBI_SCOPE = ["https://analysis.windows.net/powerbi/api/.default"]
+
+# Refresh the access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+
+class PowerBIPushError(Exception):
+    """A PowerBI request that failed; ``retryable`` failures are retried with backoff"""
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+class PowerBIAuthError(Exception):
+    """Azure AD did not return an access token"""
+
+def raise_for_push_status(response: requests.Response):
+    """Translate a PowerBI REST response into PowerBIPushError where needed"""
+    if response.status_code < 300:
+        return
+    retry_after = response.headers.get('Retry-After')
+    raise PowerBIPushError(
+        f"PowerBI returned {response.status_code}: {response.text[:200]}",
+        status_code=response.status_code,
+        retryable=response.status_code == 429 or response.status_code >= 500,
+        retry_after=float(retry_after) if retry_after else None
+    )
+
+def call_with_retry(
+    func: Callable[..., Any],
+    *args,
+    max_retries: Optional[int] = None,
+    backoff_seconds: float = 1.0
+) -> Tuple[Any, int]:
+    """Call ``func`` until it succeeds, returning its result and the number of retries
+
+    429 responses wait for their Retry-After; other retryable failures back off
+    exponentially with jitter.
+    """
+    max_retries = config.POWERBI_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        try:
+            return func(*args), attempt
+        except PowerBIPushError as e:
+            if not e.retryable or attempt >= max_retries:
+                raise
+            if e.retry_after is not None:
+                delay = e.retry_after
+            else:
+                delay = backoff_seconds * (2 ** attempt) * (0.5 + random.random() / 2)
+            time.sleep(min(delay, 60))
+            attempt += 1
+
+class AdaptiveConcurrency:
+    """Additive-increase / multiplicative-decrease limit on requests in flight"""
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = self.maximum
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+class PowerBIService:
+    """Client for the PowerBI push-dataset REST API"""
+    def __init__(self):
+        self.base_url = config.POWERBI_API_URL.rstrip('/')
+        self.dataset_url = (
+            f"{self.base_url}/groups/{config.POWERBI_WORKSPACE_ID}"
+            f"/datasets/{config.POWERBI_DATASET_ID}"
+        )
+        self.limiter = AdaptiveConcurrency(config.POWERBI_MAX_CONCURRENT_PUSHES)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=config.POWERBI_MAX_CONCURRENT_PUSHES)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._msal_app = None
+        self._token_cache = None
+        self._access_token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    def has_credentials(self) -> bool:
+        return bool(config.POWERBI_CLIENT_ID and config.POWERBI_CLIENT_SECRET and config.POWERBI_TENANT_ID)
+
+    def is_configured(self) -> bool:
+        return bool(config.POWERBI_WORKSPACE_ID and config.POWERBI_DATASET_ID)
+
+    def is_connected(self) -> bool:
+        """Whether requests can be sent right now without acquiring a new token"""
+        if not self.is_configured():
+            return False
+        return not self.has_credentials() or time.time() < self._token_expires_at
+
+    # Token handling
+
+    def _get_msal_app(self):
+        if self._msal_app is None:
+            import msal
+            self._token_cache = msal.SerializableTokenCache()
+            if config.POWERBI_TOKEN_CACHE_PATH and os.path.exists(config.POWERBI_TOKEN_CACHE_PATH):
+                with open(config.POWERBI_TOKEN_CACHE_PATH) as f:
+                    self._token_cache.deserialize(f.read())
+            self._msal_app = msal.ConfidentialClientApplication(
+                config.POWERBI_CLIENT_ID,
+                authority=f"https://login.microsoftonline.com/{config.POWERBI_TENANT_ID}",
+                client_credential=config.POWERBI_CLIENT_SECRET,
+                token_cache=self._token_cache
+            )
+        return self._msal_app
+
+    def _refresh_token(self) -> str:
+        result = self._get_msal_app().acquire_token_for_client(scopes=POWERBI_SCOPE)
+        if "access_token" not in result:
+            raise PowerBIAuthError(
+                f"Token acquisition failed: {result.get('error')} - {result.get('error_description')}"
+            )
+        self._access_token = result["access_token"]
+        self._token_expires_at = time.time() + int(result.get("expires_in", 3600))
+        if config.POWERBI_TOKEN_CACHE_PATH and self._token_cache.has_state_changed:
+            with open(config.POWERBI_TOKEN_CACHE_PATH, 'w') as f:
+                f.write(self._token_cache.serialize())
+        return self._access_token
+
+    def get_token(self, force_refresh: bool = False) -> Optional[str]:
+        """Cached access token, refreshed when it is within the refresh margin"""
+        if not self.has_credentials():
+            return None
+        if not force_refresh and time.time() < self._token_expires_at - TOKEN_REFRESH_MARGIN:
+            return self._access_token
+        with self._token_lock:
+            if force_refresh or time.time() >= self._token_expires_at - TOKEN_REFRESH_MARGIN:
+                self._refresh_token()
+            return self._access_token
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            wait = max(30.0, self._token_expires_at - TOKEN_REFRESH_MARGIN - time.time())
+            if self._stop.wait(wait):
+                return
+            try:
+                self.get_token()
+            except Exception as e:
+                logger.warning("PowerBI token refresh error: %s", e)
+
+    def start(self):
+        """Acquire the first token, open a pooled connection and keep the token fresh"""
+        if not self.is_configured():
+            return
+        try:
+            self.get_token()
+            self._request("GET", self.dataset_url)
+        except Exception as e:
+            logger.warning("PowerBI warm-up error: %s", e)
+        if self.has_credentials() and self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="powerbi-token", daemon=True)
+            self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+        self.session.close()
+
+    # Requests
+
+    def _request(self, method: str, url: str, payload: Optional[Dict[str, Any]] = None) -> requests.Response:
+        """Send one request through the concurrency limiter (no retries)"""
+        headers = {"Content-Type": "application/json"}
+        for attempt in range(2):
+            token = self.get_token(force_refresh=attempt > 0)
+            if token:
+                headers["Authorization"] = f"Bearer {token}"
+            self.limiter.acquire()
+            throttled = False
+            try:
+                response = self.session.request(
+                    method, url,
+                    data=json.dumps(payload) if payload is not None else None,
+                    headers=headers,
+                    timeout=60
+                )
+                throttled = response.status_code == 429
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                raise PowerBIPushError(f"PowerBI request failed: {str(e)}", retryable=True)
+            finally:
+                self.limiter.release(throttled=throttled)
+            # An expired or revoked token gets one forced refresh
+            if response.status_code == 401 and token and attempt == 0:
+                continue
+            raise_for_push_status(response)
+            return response
+
+    def push_rows(self, rows: List[Dict[str, Any]], table_name: Optional[str] = None):
+        """Append one batch (at most POWERBI_ROWS_PER_REQUEST rows) to a push-dataset table"""
+        table_name = table_name or config.POWERBI_TABLE_NAME
+        self._request("POST", f"{self.dataset_url}/tables/{table_name}/rows", {"rows": rows})
+
+    def push_data_to_dataset(self, data: List[Dict[str, Any]], table_name: Optional[str] = None) -> bool:
+        """Push any number of rows in concurrent batches, retrying throttled batches"""
+        size = config.POWERBI_ROWS_PER_REQUEST
+        batches = [data[i:i + size] for i in range(0, len(data), size)]
+        with ThreadPoolExecutor(max_workers=self.limiter.maximum) as executor:
+            list(executor.map(lambda batch: call_with_retry(self.push_rows, batch, table_name), batches))
+        return True
+
+    def delete_rows(self, table_name: Optional[str] = None):
+        """Remove all rows from a push-dataset table"""
+        table_name = table_name or config.POWERBI_TABLE_NAME
+        call_with_retry(self._request, "DELETE", f"{self.dataset_url}/tables/{table_name}/rows")
+
+    def refresh_dataset(self) -> bool:
+        """Queue a dataset refresh"""
+        call_with_retry(self._request, "POST", f"{self.dataset_url}/refreshes", {"notifyOption": "NoNotification"})
+        return True
+
+# Global client instance
+powerbi_service = PowerBIService()
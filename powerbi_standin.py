@@ -0,0 +1,118 @@
+"""Local stand-in for the PowerBI push-dataset REST API
+
+Mimics the rows/refresh endpoints closely enough to exercise the sync engine
+offline: the 10,000 rows per request limit, the pending-request limit (429 with
+Retry-After), and optional injected latency, throttling and server errors.
+
+    python powerbi_standin.py --port 8765 --failure-rate 0.05 --throttle-rate 0.1
+    POWERBI_API_URL=http://127.0.0.1:8765/v1.0/myorg python powerbi_sync.py
+"""
+import argparse
+import asyncio
+import os
+import random
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+MAX_ROWS_PER_REQUEST = 10000
+MAX_PENDING_REQUESTS = int(os.getenv('STANDIN_MAX_PENDING', '5'))
+LATENCY_MS = int(os.getenv('STANDIN_LATENCY_MS', '50'))
+FAILURE_RATE = float(os.getenv('STANDIN_FAILURE_RATE', '0'))
+THROTTLE_RATE = float(os.getenv('STANDIN_THROTTLE_RATE', '0'))
+
+app = FastAPI(title="PowerBI Stand-in", version="1.0.0")
+
+stats_lock = threading.Lock()
+tables: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+stats = {"requests": 0, "rows": 0, "throttled": 0, "failed": 0, "refreshes": 0}
+pending = {"count": 0}
+
+def _count(key: str, amount: int = 1):
+    with stats_lock:
+        stats[key] += amount
+
+@app.get("/v1.0/myorg/groups/{group_id}/datasets/{dataset_id}")
+async def get_dataset(group_id: str, dataset_id: str):
+    """Dataset metadata (used by clients to warm up their connection)"""
+    return {"id": dataset_id, "name": "Budget Portal", "addRowsAPIEnabled": True}
+
+@app.post("/v1.0/myorg/groups/{group_id}/datasets/{dataset_id}/tables/{table_name}/rows")
+async def post_rows(group_id: str, dataset_id: str, table_name: str, request: Request):
+    """Append rows to a table"""
+    _count("requests")
+    if pending["count"] >= MAX_PENDING_REQUESTS or random.random() < THROTTLE_RATE:
+        _count("throttled")
+        return JSONResponse(status_code=429, content={"error": {"code": "TooManyRequests"}},
+                            headers={"Retry-After": "1"})
+
+    pending["count"] += 1
+    try:
+        await asyncio.sleep(LATENCY_MS / 1000)
+        if random.random() < FAILURE_RATE:
+            _count("failed")
+            return JSONResponse(status_code=503, content={"error": {"code": "ServiceUnavailable"}})
+
+        body = await request.json()
+        rows = body.get("rows", [])
+        if len(rows) > MAX_ROWS_PER_REQUEST:
+            return JSONResponse(status_code=400, content={"error": {
+                "code": "InvalidRequest",
+                "message": f"Too many rows: {len(rows)} > {MAX_ROWS_PER_REQUEST}"
+            }})
+
+        with stats_lock:
+            tables[f"{dataset_id}/{table_name}"].extend(rows)
+            stats["rows"] += len(rows)
+        return JSONResponse(status_code=200, content={})
+    finally:
+        pending["count"] -= 1
+
+@app.delete("/v1.0/myorg/groups/{group_id}/datasets/{dataset_id}/tables/{table_name}/rows")
+async def delete_rows(group_id: str, dataset_id: str, table_name: str):
+    """Remove all rows from a table"""
+    with stats_lock:
+        tables.pop(f"{dataset_id}/{table_name}", None)
+    return JSONResponse(status_code=200, content={})
+
+@app.post("/v1.0/myorg/groups/{group_id}/datasets/{dataset_id}/refreshes")
+async def refresh_dataset(group_id: str, dataset_id: str):
+    """Accept a dataset refresh"""
+    _count("refreshes")
+    return JSONResponse(status_code=202, content={})
+
+@app.get("/standin/stats")
+async def get_stats():
+    """Request counters and stored row counts per table"""
+    with stats_lock:
+        return {
+            **stats,
+            "pending": pending["count"],
+            "tables": {name: len(rows) for name, rows in tables.items()}
+        }
+
+@app.post("/standin/reset")
+async def reset():
+    """Clear stored rows and counters"""
+    with stats_lock:
+        tables.clear()
+        for key in stats:
+            stats[key] = 0
+    return {"success": True}
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Local PowerBI REST API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=int, default=LATENCY_MS)
+    parser.add_argument("--failure-rate", type=float, default=FAILURE_RATE)
+    parser.add_argument("--throttle-rate", type=float, default=THROTTLE_RATE)
+    args = parser.parse_args()
+    LATENCY_MS = args.latency_ms
+    FAILURE_RATE = args.failure_rate
+    THROTTLE_RATE = args.throttle_rate
+    uvicorn.run(app, host=args.host, port=args.port)
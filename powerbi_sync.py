@@ -0,0 +1,165 @@
+"""Incremental sync of edited budget rows into the PowerBI push dataset
+
+Only rows with change-journal entries after the stored watermark are pushed.
+Push datasets append rather than upsert, so every pushed row carries its
+``id`` and ``sync_seq`` (the latest journal sequence for that row); the report
+keeps the row with the highest ``sync_seq`` per ``id``. With sharded storage
+each business unit's journal numbers its own entries, so every shard keeps its
+own watermark (``powerbi:<business unit>``).
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func
+
+from DatabaseManager import (
+    BUDGET_CYCLE, SessionLocal, China2025B, ChangeJournal, SyncState, EDITABLE_COLUMNS, business_unit_session, shard_router
+)
+from fact_store import select_rows
+from powerbi_service import powerbi_service, call_with_retry
+from config import config
+
+SYNC_NAME = "powerbi"
+
+# SQLite limits the number of bound parameters per statement
+ID_CHUNK_SIZE = 5000
+
+class PowerBISync:
+    """Pushes rows changed since the durable watermark in concurrent, bounded batches"""
+    def __init__(
+        self,
+        push_batch: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+        batch_size: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_seconds: float = 1.0,
+        name: str = SYNC_NAME,
+        business_unit: Optional[str] = None
+    ):
+        self.push_batch = push_batch or powerbi_service.push_rows
+        self.batch_size = batch_size or config.POWERBI_ROWS_PER_REQUEST
+        self.max_concurrency = max_concurrency or config.POWERBI_MAX_CONCURRENT_PUSHES
+        self.max_retries = config.POWERBI_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = backoff_seconds
+        self.name = name
+        # Shard whose journal is synced (None: the primary database)
+        self.business_unit = business_unit
+        # One sync at a time per process; a waiting caller finds little left to push
+        self._lock = threading.Lock()
+
+    def _push_with_retry(self, batch: List[Dict[str, Any]]) -> int:
+        """Push one batch, returning the number of retries it needed"""
+        _, retries = call_with_retry(
+            self.push_batch, batch,
+            max_retries=self.max_retries,
+            backoff_seconds=self.backoff_seconds
+        )
+        return retries
+
+    def _load_changed_rows(self, db, low_seq: int, high_seq: int) -> List[Dict[str, Any]]:
+        latest_seq = dict(
+            db.query(ChangeJournal.row_id, func.max(ChangeJournal.seq))
+            .filter(
+                ChangeJournal.seq > low_seq, ChangeJournal.seq <= high_seq, ChangeJournal.budget_cycle == BUDGET_CYCLE
+            )
+            .group_by(ChangeJournal.row_id)
+            .all()
+        )
+        row_ids = sorted(latest_seq)
+        names = ['id', 'user_id', 'business_unit'] + EDITABLE_COLUMNS
+        rows = []
+        for start in range(0, len(row_ids), ID_CHUNK_SIZE):
+            chunk = row_ids[start:start + ID_CHUNK_SIZE]
+            for values in select_rows(db, names, China2025B.id.in_(chunk)):
+                row = dict(zip(names, values))
+                row['sync_seq'] = latest_seq[row['id']]
+                rows.append(row)
+        return rows
+
+    def _save_watermark(self, last_seq: int, rows_pushed: int):
+        # sync_state is in the primary: written through a shard session, the commit
+        # would lock the shard and the primary together
+        db = SessionLocal()
+        try:
+            state = db.query(SyncState).filter(SyncState.name == self.name).first()
+            if not state:
+                state = SyncState(name=self.name, last_seq=0, rows_pushed=0)
+                db.add(state)
+            state.last_seq = last_seq
+            state.last_synced_at = datetime.utcnow()
+            state.rows_pushed = (state.rows_pushed or 0) + rows_pushed
+            db.commit()
+        finally:
+            db.close()
+
+    def run(self) -> Dict[str, Any]:
+        """Push everything changed since the last successful sync and advance the watermark"""
+        with self._lock:
+            started = time.perf_counter()
+            db = business_unit_session(self.business_unit)
+            try:
+                state = db.query(SyncState).filter(SyncState.name == self.name).first()
+                low_seq = state.last_seq if state else 0
+                # Only the active cycle's rows are pushed; its table is the one the row ids refer to
+                high_seq = db.query(func.max(ChangeJournal.seq)).filter(
+                    ChangeJournal.budget_cycle == BUDGET_CYCLE
+                ).scalar() or low_seq
+                if high_seq <= low_seq:
+                    return {"rows": 0, "batches": 0, "retries": 0, "last_seq": low_seq, "seconds": 0.0}
+                rows = self._load_changed_rows(db, low_seq, high_seq)
+                # End the read transaction so no database lock is held during the pushes
+                db.commit()
+
+                batches = [rows[i:i + self.batch_size] for i in range(0, len(rows), self.batch_size)]
+                with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                    # map() re-raises the first failed batch; the watermark then stays put
+                    retries = sum(executor.map(self._push_with_retry, batches))
+
+                self._save_watermark(high_seq, len(rows))
+                return {
+                    "rows": len(rows),
+                    "batches": len(batches),
+                    "retries": retries,
+                    "last_seq": high_seq,
+                    "seconds": round(time.perf_counter() - started, 3)
+                }
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+_syncs: Dict[Optional[str], PowerBISync] = {}
+
+def get_sync(business_unit: Optional[str] = None) -> PowerBISync:
+    """Process-wide sync engine (one per shard when sharded), created on first use"""
+    key = business_unit if shard_router.enabled else None
+    if key not in _syncs:
+        _syncs[key] = PowerBISync(name=f"{SYNC_NAME}:{key}" if key else SYNC_NAME, business_unit=key)
+    return _syncs[key]
+
+def sync_all() -> Dict[str, Any]:
+    """Sync every shard (or the single database) and add up the results"""
+    if not shard_router.enabled:
+        return get_sync().run()
+    results = [get_sync(business_unit).run() for business_unit in shard_router.business_units()]
+    return {
+        "rows": sum(result["rows"] for result in results),
+        "batches": sum(result["batches"] for result in results),
+        "retries": sum(result["retries"] for result in results),
+        "seconds": round(sum(result["seconds"] for result in results), 3),
+        "shards": len(results)
+    }
+
+if __name__ == "__main__":
+    # Run one sync against POWERBI_API_URL, e.g. the local stand-in:
+    #   python powerbi_standin.py &
+    #   POWERBI_API_URL=http://127.0.0.1:8765/v1.0/myorg python powerbi_sync.py
+    result = sync_all()
+    rate = result["rows"] / result["seconds"] if result["seconds"] else 0
+    print(f"Pushed {result['rows']} rows in {result['batches']} batches "
+          f"({result['retries']} retries, {result['seconds']}s, {rate:.0f} rows/s), "
+          + (f"watermark now {result['last_seq']}" if 'last_seq' in result else f"{result['shards']} shards"))
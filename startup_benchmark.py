@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark for the API process
+
+Each run starts a fresh interpreter, so nothing is cached between runs:
+  import    - time to import APIServer
+  startup   - time for the startup work (create_tables) after the import
+  first     - from launching uvicorn until the first successful response
+
+    python startup_benchmark.py                 # 5 runs against /api/health
+    python startup_benchmark.py --runs 10 --path /api/business-units
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+# Runs in the child interpreter
+IMPORT_PROBE = """
+import json, time
+start = time.perf_counter()
+import APIServer
+imported = time.perf_counter()
+APIServer.create_tables()
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "startup": done - imported}))
+"""
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def child_env() -> dict:
+    env = os.environ.copy()
+    env['PYTHONPATH'] = str(ROOT)
+    return env
+
+def measure_import() -> dict:
+    """Import and startup time of APIServer in a fresh interpreter"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=ROOT, env=child_env(), check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def measure_first_response(path: str, timeout: float) -> float:
+    """Seconds from launching uvicorn until ``path`` answers 200"""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}{path}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "APIServer:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT, env=child_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"API server exited with code {server.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"No response from {url} within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+def summarize(name: str, values: list):
+    print(f"{name:<16} median {statistics.median(values) * 1000:8.1f} ms   "
+          f"min {min(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API cold start latency")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/api/health", help="Endpoint used for time-to-first-response")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    imports, startups, firsts = [], [], []
+    for run in range(args.runs):
+        timings = measure_import()
+        imports.append(timings["import"])
+        startups.append(timings["startup"])
+        firsts.append(measure_first_response(args.path, args.timeout))
+        print(f"Run {run + 1}/{args.runs}: import {timings['import'] * 1000:.0f} ms, "
+              f"startup {timings['startup'] * 1000:.0f} ms, first response {firsts[-1] * 1000:.0f} ms")
+
+    print()
+    summarize("import", imports)
+    summarize("startup", startups)
+    summarize("first response", firsts)
+
+if __name__ == "__main__":
+    main()
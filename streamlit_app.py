@@ -2,9 +2,10 @@ import streamlit as st
 import pandas as pd
 import requests
 import json
+import logging
 import os
+import threading
 from datetime import datetime
-from io import BytesIO
 import time
 from typing import Dict, List, Any, Optional
 import plotly.express as px
@@ -12,6 +13,11 @@ import plotly.graph_objects as go
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode
 from st_aggrid.shared import JsCode
 from config import config
+from portal_logging import setup_logging
+
+# Queued, non-blocking log output (set up once per process, not on every rerun)
+setup_logging()
+logger = logging.getLogger("streamlit_app")
 
 # Page configuration
 st.set_page_config(
@@ -24,6 +30,9 @@ st.set_page_config(
 # API Configuration - Use environment-aware URL
 API_BASE_URL = config.get_api_base_url()
 
+# How often the page checks the change listener (no API call involved)
+CHANGE_CHECK_SECONDS = 2
+
 # Custom CSS for Excel-like styling
 st.markdown("""
 <style>
@@ -84,8 +93,20 @@ def init_session_state():
         st.session_state.session_token = ""
     if 'data' not in st.session_state:
         st.session_state.data = pd.DataFrame()
+    if 'row_hashes' not in st.session_state:
+        st.session_state.row_hashes = pd.Series(dtype='uint64')
     if 'last_refresh' not in st.session_state:
         st.session_state.last_refresh = datetime.now()
+    if 'data_version' not in st.session_state:
+        st.session_state.data_version = None
+    if 'has_unsaved' not in st.session_state:
+        st.session_state.has_unsaved = False
+    if 'status_key' not in st.session_state:
+        st.session_state.status_key = None
+        st.session_state.status_result = {}
+    if 'forecast_key' not in st.session_state:
+        st.session_state.forecast_key = None
+        st.session_state.forecast = pd.DataFrame()
 
 
 def api_call(endpoint: str, method: str = "GET", data: Optional[Dict] = None) -> Dict:
@@ -102,6 +123,9 @@ def api_call(endpoint: str, method: str = "GET", data: Optional[Dict] = None) ->
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
+        # The API queues busy periods fairly per user
+        if st.session_state.get('user_id'):
+            headers['X-User-Id'] = st.session_state.user_id
         
         if method == "GET":
             response = requests.get(url, params=data, headers=headers, timeout=timeout)
@@ -116,6 +140,10 @@ def api_call(endpoint: str, method: str = "GET", data: Optional[Dict] = None) ->
         
         if response.status_code == 200:
             return response.json()
+        elif response.status_code == 503 and 'Retry-After' in response.headers:
+            error_msg = f"The server is busy. Please try again in {response.headers['Retry-After']} seconds."
+            st.warning(error_msg)
+            return {"success": False, "error": error_msg}
         else:
             error_msg = f"API Error: {response.status_code}"
             try:
@@ -146,6 +174,64 @@ def api_call(endpoint: str, method: str = "GET", data: Optional[Dict] = None) ->
         st.error(error_msg)
         return {"success": False, "error": str(e)}
 
+class ChangeListener:
+    """Follows GET /api/events for one business unit in a background thread"""
+    def __init__(self, business_unit: str):
+        self.business_unit = business_unit
+        self.data_version: Optional[int] = None
+        self.submissions = 0
+        self.connected = False
+        threading.Thread(target=self._run, name=f"changes-{business_unit}", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                with requests.get(
+                    f"{API_BASE_URL}/api/events",
+                    params={"business_unit": self.business_unit},
+                    stream=True,
+                    timeout=(10, 60)
+                ) as response:
+                    self.connected = response.status_code == 200
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue
+                        event = json.loads(line[len("data:"):])
+                        self.data_version = event["data_version"]
+                        if event["event"] == "submit":
+                            self.submissions += 1
+            except (requests.exceptions.RequestException, ValueError, KeyError):
+                pass
+            self.connected = False
+            time.sleep(5)
+
+@st.cache_resource(show_spinner=False)
+def get_change_listener(business_unit: str) -> ChangeListener:
+    """One event stream per business unit, shared by every session of this process"""
+    return ChangeListener(business_unit)
+
+def has_newer_data(listener: ChangeListener) -> bool:
+    return (
+        listener.data_version is not None
+        and st.session_state.data_version is not None
+        and listener.data_version > st.session_state.data_version
+    )
+
+@st.cache_data(ttl=60, show_spinner=False)
+def check_health() -> Dict:
+    return api_call("/api/health", "GET")
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_business_units() -> List[str]:
+    """Business units known to the API (from user_sessions)
+
+    A failed call raises, so the failure is not cached like an empty list would be.
+    """
+    result = api_call("/api/business-units", "GET")
+    if not result.get("success"):
+        raise RuntimeError(result.get("error") or "Could not load business units")
+    return result.get("business_units", [])
+
 def login_form():
     """Display login form"""
     st.markdown("""
@@ -154,6 +240,15 @@ def login_form():
     </div>
     """, unsafe_allow_html=True)
     
+    try:
+        business_units = load_business_units()
+    except RuntimeError as e:
+        # e.g. a timeout while the API is still starting
+        st.error(f"❌ Could not load business units: {e}")
+        if st.button("Retry"):
+            st.rerun()
+        return
+    
     with st.form("login_form"):
         st.subheader("Authentication")
         col1, col2 = st.columns(2)
@@ -162,17 +257,11 @@ def login_form():
             user_id = st.text_input("User ID", placeholder="Enter your user ID")
         
         with col2:
-            business_units = ['CHINA-01', 'CHINA-02', 'CHINA-03A', 'CHINA-03B', 'CHINA-04', 
-                            'CHINA-05', 'CHINA-06', 'CHINA-07', 'CHINA-08', 'CHINA-09', 
-                            'CHINA-10', 'CHINA-11', 'CHINA-12', 'CHINA-13', 'CHINA-14', 
-                            'CHINA-15', 'CHINA-16', 'CHINA-17', 'CHINA-18', 'CHINA-19', 
-                            'CHINA-20', 'CHINA-21', 'CHINA-22', 'CHINA-23', 'CHINA-24', 
-                            'CHINA-25', 'CHINA-26', 'CHINA-NEW', 'CHINA-ROC']
             business_unit = st.selectbox("Business Unit", business_units)
         
         submitted = st.form_submit_button("Login", use_container_width=True)
         
-        if submitted and user_id:
+        if submitted and user_id and business_unit:
             with st.spinner("Authenticating..."):
                 result = api_call("/api/login", "POST", {
                     "user_id": user_id,
@@ -193,7 +282,6 @@ def load_user_data() -> pd.DataFrame:
     """Load user's budget data"""
     # URL encode business unit to handle spaces
     import urllib.parse
-    print(st.session_state.business_unit)
     business_unit_encoded = urllib.parse.quote(st.session_state.business_unit)
     
     result = api_call(f"/api/data/{st.session_state.user_id}/{business_unit_encoded}", "GET")
@@ -202,83 +290,102 @@ def load_user_data() -> pd.DataFrame:
         data = result.get("data", [])
         if data:
             df = pd.DataFrame(data)
-            print(df)
+            st.session_state.row_hashes = editable_row_hashes(df)
+            st.session_state.data_version = result.get("data_version")
+            logger.debug("Loaded %s rows for %s (data version %s)",
+                         len(df), st.session_state.business_unit, st.session_state.data_version)
             return df
     
     return pd.DataFrame()
 
-def create_excel_grid(df: pd.DataFrame):
-    """Create Excel-like grid with AgGrid"""
-    if df.empty:
-        st.warning("No data available for your business unit.")
-        return {}
-    
-    # Add Index column to df
-    df['Index'] = [i for i in range(len(df))]
-    
-    # Reorder columns to put 'Index' first
-    cols = ['Index'] + [col for col in df.columns if col != 'Index']
-    df = df[cols]
+# Grid column layout
+EDITABLE_COLUMNS = ['Y2025B', 'Y2026P', 'Y2027P', 'Y2028P', 'Y2029P', 'Sales_Remark']
+EDITABLE_NUMERIC_COLUMNS = ['Y2025B', 'Y2026P', 'Y2027P', 'Y2028P', 'Y2029P']
+# Baseline projections shown next to the plan columns for comparison
+FORECAST_COLUMNS = [f"Forecast_{col}" for col in EDITABLE_NUMERIC_COLUMNS]
+FORECAST_METHODS = {'Off': None, 'Trend': 'trend', 'CAGR': 'cagr', 'Moving average (3 years)': 'moving_average'}
+READONLY_COLUMNS = ['Index', 'Sales_Region', 'Customer_Note', 'Customer_Group', 'BizType',
+        'Vendor_Category', 'Vendor_Grouping', 'ProductNature', 'Y2019A', 'Y2020A',
+        'Y2021A', 'Y2022A', 'Y2023A', 'Y2024B', 'Y2024Q3F', 'Y2024A08', 'Y2024R08',
+        'avg1924'] + FORECAST_COLUMNS
+# What-if adjustments select rows by these columns and can copy from any year column
+WHAT_IF_FILTER_COLUMNS = ['Sales_Region', 'Customer_Group', 'BizType', 'Vendor_Category',
+        'Vendor_Grouping', 'ProductNature']
+WHAT_IF_SOURCE_COLUMNS = ['Y2019A', 'Y2020A', 'Y2021A', 'Y2022A', 'Y2023A', 'Y2024B', 'Y2024Q3F',
+        'Y2024A08', 'Y2024R08', 'avg1924'] + EDITABLE_NUMERIC_COLUMNS
+WHAT_IF_KINDS = {'Percent change': 'percent', 'Add an amount': 'absolute', 'Copy from another year': 'copy'}
+PINNED_COLUMNS = ['Index', 'Sales_Region', 'Customer_Note', 'Customer_Group', 'BizType']
+HIDDEN_COLUMNS = ['id', 'user_id', 'business_unit']
+
+PINNED_CELL_STYLE = JsCode("""
+function(params) {
+    return {
+        'background-color': '#f3f4f6',
+        'color': '#6b7280',
+        'font-weight': 'bold'  // Optional: emphasize pinned columns
+    };
+}
+""")
+EDITABLE_CELL_STYLE = JsCode("""
+function(params) {
+    return {
+        'background-color': '#fef3c7',
+        'font-weight': 'bold'
+    };
+}
+""")
+READONLY_CELL_STYLE = JsCode("""
+function(params) {
+    return {
+        'background-color': '#f3f4f6',
+        'color': '#6b7280'
+    };
+}
+""")
+# Row number computed by the grid from the position in the loaded data,
+# so the DataFrame does not need a copied 'Index' column
+INDEX_VALUE_GETTER = JsCode("""
+function(params) {
+    return params.node.sourceRowIndex;
+}
+""")
+
+@st.cache_resource(show_spinner=False)
+def build_grid_options(column_schema: tuple) -> Dict:
+    """Build AgGrid options once per column schema ((name, dtype) pairs)"""
+    schema_df = pd.DataFrame({'Index': pd.Series(dtype='int64')})
+    for col, dtype in column_schema:
+        schema_df[col] = pd.Series(dtype=dtype)
     
-    gb = GridOptionsBuilder.from_dataframe(df)
+    gb = GridOptionsBuilder.from_dataframe(schema_df)
+    gb.configure_column('Index', valueGetter=INDEX_VALUE_GETTER)
     
-    # Define column configurations
-    editable_columns = ['Y2025B', 'Y2026P', 'Y2027P', 'Y2028P', 'Y2029P', 'Sales_Remark']
-    readonly_columns = ['Index', 'Sales_Region', 'Customer_Note', 'Customer_Group', 'BizType',
-            'Vendor_Category', 'Vendor_Grouping', 'ProductNature', 'Y2019A', 'Y2020A',
-            'Y2021A', 'Y2022A', 'Y2023A', 'Y2024B', 'Y2024Q3F', 'Y2024A08', 'Y2024R08',
-            'avg1924']
-    pinned_columns = ['Index', 'Sales_Region', 'Customer_Note', 'Customer_Group', 'BizType']
-    hidden_columns = ['id', 'user_id', 'business_unit']
-
     # Set column properties
-    for col in df.columns:
-        if col in hidden_columns:
+    for col in schema_df.columns:
+        if col in HIDDEN_COLUMNS:
             gb.configure_column(
                 col,
                 hide=True
             )
-        elif col in pinned_columns:
+        elif col in PINNED_COLUMNS:
             gb.configure_column(
                 col, 
                 editable=False,
                 pinned='left',  # Pin to the left
-                cellStyle=JsCode("""
-                function(params) {
-                    return {
-                        'background-color': '#f3f4f6',
-                        'color': '#6b7280',
-                        'font-weight': 'bold'  // Optional: emphasize pinned columns
-                    };
-                }
-                """)
+                cellStyle=PINNED_CELL_STYLE
             )
-        elif col in editable_columns:
+        elif col in EDITABLE_COLUMNS:
             gb.configure_column(
                 col, 
                 editable=True,
-                cellStyle=JsCode("""
-                function(params) {
-                    return {
-                        'background-color': '#fef3c7',
-                        'font-weight': 'bold'
-                    };
-                }
-                """)
+                cellStyle=EDITABLE_CELL_STYLE
             )
-        elif col in readonly_columns:
+        elif col in READONLY_COLUMNS:
             gb.configure_column(
                 col,
                 width=120,
                 editable=False,
-                cellStyle=JsCode("""
-                function(params) {
-                    return {
-                        'background-color': '#f3f4f6',
-                        'color': '#6b7280'
-                    };
-                }
-                """)
+                cellStyle=READONLY_CELL_STYLE
             )
         else:
             continue  # Skip any columns not in editable or readonly lists
@@ -294,7 +401,17 @@ def create_excel_grid(df: pd.DataFrame):
         ensureDomOrder=True
     )
     
-    grid_options = gb.build()
+    return gb.build()
+
+def create_excel_grid(df: pd.DataFrame):
+    """Create Excel-like grid with AgGrid"""
+    if df.empty:
+        st.warning("No data available for your business unit.")
+        return {}
+    
+    column_schema = tuple((col, str(dtype)) for col, dtype in df.dtypes.items())
+    # Shallow copy: AgGrid may set top-level keys on the options it is given
+    grid_options = dict(build_grid_options(column_schema))
     
     # Display the grid
     st.subheader("Budget Data")
@@ -313,10 +430,75 @@ def create_excel_grid(df: pd.DataFrame):
     
     return grid_response
 
-def save_changes(updated_data: pd.DataFrame):
-    """Save changes to the database"""
+def load_forecast(method: str) -> pd.DataFrame:
+    """Server-side baseline projections of the plan years, indexed by row id (fetched once per data version)"""
+    key = (method, st.session_state.business_unit, st.session_state.data_version)
+    if st.session_state.forecast_key != key:
+        result = api_call("/api/forecast", "GET", {"method": method, "business_unit": st.session_state.business_unit})
+        columns = result.get("columns")
+        forecast = pd.DataFrame()
+        if columns:
+            forecast = pd.DataFrame(columns).drop(columns='business_unit').set_index('id')
+            forecast.columns = [f"Forecast_{col}" for col in forecast.columns]
+        st.session_state.forecast = forecast
+        st.session_state.forecast_key = key
+    return st.session_state.forecast
+
+def with_forecast(df: pd.DataFrame, forecast: pd.DataFrame) -> pd.DataFrame:
+    """The grid data with the forecast columns joined on by row id"""
+    if forecast.empty:
+        return df
+    return df.join(forecast, on='id')
+
+def prefill_from_forecast(forecast: pd.DataFrame) -> int:
+    """Fill empty (blank or zero) plan cells with the forecast; returns the number of cells filled"""
+    data = st.session_state.data.set_index('id')
+    filled = 0
+    for col in EDITABLE_NUMERIC_COLUMNS:
+        values = pd.to_numeric(data[col], errors='coerce')
+        projected = forecast[f"Forecast_{col}"].reindex(data.index)
+        empty = (values.isna() | (values == 0)) & projected.notna()
+        data.loc[empty, col] = projected[empty]
+        filled += int(empty.sum())
+    # Filled rows differ from the loaded hashes, so they are saved like manual edits
+    st.session_state.data = data.reset_index()[st.session_state.data.columns]
+    return filled
+
+def editable_row_hashes(df: pd.DataFrame) -> pd.Series:
+    """Hash of each row's editable columns, indexed by record id"""
+    editable = pd.DataFrame(
+        {col: pd.to_numeric(df[col], errors='coerce').astype('float64') for col in EDITABLE_NUMERIC_COLUMNS}
+    )
+    editable['Sales_Remark'] = df['Sales_Remark'].fillna('').astype(str)
+    hashes = pd.util.hash_pandas_object(editable, index=False)
+    hashes.index = df['id'].to_numpy()
+    return hashes
+
+def changed_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Rows of a grid result whose editable values differ from what was loaded"""
+    if df.empty:
+        return df
+    current = editable_row_hashes(df)
+    baseline = st.session_state.row_hashes.reindex(current.index, fill_value=0)
+    return df[current.to_numpy() != baseline.to_numpy()]
+
+def mark_saved(saved_rows: pd.DataFrame):
+    """Make saved rows the new baseline for change detection"""
+    data = st.session_state.data.set_index('id')
+    saved_ids = saved_rows['id'].to_numpy()
+    # Same blank handling as save_changes, so the baseline matches what was stored
+    for col in EDITABLE_NUMERIC_COLUMNS:
+        data.loc[saved_ids, col] = pd.to_numeric(saved_rows[col], errors='coerce').fillna(0).to_numpy(dtype='float64')
+    data.loc[saved_ids, 'Sales_Remark'] = saved_rows['Sales_Remark'].fillna('').astype(str).to_numpy()
+    st.session_state.data = data.reset_index()[st.session_state.data.columns]
+    
+    saved_hashes = editable_row_hashes(data.loc[saved_ids].reset_index())
+    st.session_state.row_hashes.loc[saved_hashes.index] = saved_hashes
+
+def save_changes(updated_data: pd.DataFrame) -> Optional[set]:
+    """Save changes to the database; returns the ids the API rejected (None on failure)"""
     if updated_data.empty:
-        return
+        return set()
     
     # Prepare updates
     updates = []
@@ -347,11 +529,22 @@ def save_changes(updated_data: pd.DataFrame):
         })
         
         if result.get("success"):
+            rejected = result.get("rejected", [])
+            if rejected:
+                st.warning("⚠️ Some rows were not saved:\n" + "\n".join(
+                    f"- Row {error['id']}" + (f" {error['column']}" if error['column'] else "") + f": {error['error']}"
+                    for error in rejected[:20]
+                ))
             st.success(f"✅ {result.get('message', 'Changes saved successfully!')}")
-            return True
+            # Our own save needs no reload; a larger jump means someone else saved too
+            new_version = result.get("data_version")
+            if new_version is not None and st.session_state.data_version is not None \
+                    and new_version == st.session_state.data_version + 1:
+                st.session_state.data_version = new_version
+            return {error['id'] for error in rejected}
         else:
             st.error("❌ Failed to save changes")
-            return False
+            return None
 
 def submit_data():
     """Submit budget data to PowerBI"""
@@ -371,6 +564,13 @@ def submit_data():
 
 def display_dashboard():
     """Main dashboard interface"""
+    listener = get_change_listener(st.session_state.business_unit)
+    # Someone saved this business unit since it was loaded; reload unless there are unsaved edits
+    if has_newer_data(listener) and not st.session_state.has_unsaved:
+        with st.spinner("Loading the latest data..."):
+            st.session_state.data = load_user_data()
+            st.session_state.last_refresh = datetime.now()
+    
     # Header
     st.markdown(f"""
     <div class="main-header">
@@ -389,12 +589,26 @@ def display_dashboard():
             st.rerun()
         
         st.markdown(f"**Last Refresh:** {st.session_state.last_refresh.strftime('%H:%M:%S')}")
+        watch_changes(listener)
+        
+        st.subheader("Baseline Forecast")
+        forecast_method = FORECAST_METHODS[st.selectbox(
+            "Compare plan years with", list(FORECAST_METHODS),
+            help="Projection of each row's 2019-2024 history, shown next to the plan columns"
+        )]
         
-        # Submission status
+        # Submission status, fetched again only after an update or submit event
+        # (or on every rerun while the event stream is not connected)
         st.subheader("Status")
-        import urllib.parse
-        business_unit_encoded = urllib.parse.quote(st.session_state.business_unit)
-        status_result = api_call(f"/api/submission-status/{st.session_state.user_id}/{business_unit_encoded}", "GET")
+        status_key = (listener.data_version, listener.submissions) if listener.connected else None
+        if status_key is None or status_key != st.session_state.status_key:
+            import urllib.parse
+            business_unit_encoded = urllib.parse.quote(st.session_state.business_unit)
+            st.session_state.status_result = api_call(
+                f"/api/submission-status/{st.session_state.user_id}/{business_unit_encoded}", "GET"
+            )
+            st.session_state.status_key = status_key
+        status_result = st.session_state.status_result
         
         if status_result.get("success"):
             status = status_result
@@ -412,8 +626,8 @@ def display_dashboard():
                 st.write(f"**Last Submission:** {status['latest_submission'][:16]}")
         
         # Health check
-        health_result = api_call("/api/health", "GET")
-        if health_result.get("status") == "healthy":
+        health_result = check_health()
+        if listener.connected or health_result.get("status") == "healthy":
             st.success("🟢 API Server Connected")
         else:
             st.error("🔴 API Server Disconnected")
@@ -433,7 +647,13 @@ def display_dashboard():
             st.session_state.business_unit = ""
             st.session_state.session_token = ""
             st.session_state.data = pd.DataFrame()
+            st.session_state.row_hashes = pd.Series(dtype='uint64')
             st.session_state.last_refresh = datetime.now()
+            st.session_state.data_version = None
+            st.session_state.has_unsaved = False
+            st.session_state.status_key = None
+            st.session_state.forecast_key = None
+            st.session_state.forecast = pd.DataFrame()
             st.rerun()
     
     # Load data if not already loaded
@@ -443,16 +663,33 @@ def display_dashboard():
     
     # Main content area
     if not st.session_state.data.empty:
-        grid_response = create_excel_grid(st.session_state.data)
+        forecast = load_forecast(forecast_method) if forecast_method else pd.DataFrame()
+        if not forecast.empty:
+            # Pre-filling rewrites the loaded data, which would drop unsaved grid edits
+            if st.button("Pre-fill empty plan cells from the forecast", disabled=st.session_state.has_unsaved):
+                filled = prefill_from_forecast(forecast)
+                st.info(f"Filled {filled} empty cell(s). Review them and save to keep them.")
+            if st.session_state.has_unsaved:
+                st.caption("Save or discard your grid changes before pre-filling.")
+        grid_response = create_excel_grid(with_forecast(st.session_state.data, forecast))
         
         col1, col2, col3 = st.columns([2, 2, 2])
         
         with col1:
             if st.button("Save Changes", use_container_width=True, type="primary"):
                 if 'data' in grid_response and not grid_response['data'].empty:
-                    if save_changes(grid_response['data']):
-                        time.sleep(1)
-                        st.rerun()
+                    # Only rows whose editable values changed are sent to the API
+                    dirty_rows = changed_rows(grid_response['data'])
+                    if dirty_rows.empty:
+                        st.info("No changes to save.")
+                    else:
+                        rejected_ids = save_changes(dirty_rows)
+                        if rejected_ids is not None:
+                            # Rejected rows stay marked as modified
+                            mark_saved(dirty_rows[~dirty_rows['id'].isin(rejected_ids)])
+                            if not rejected_ids:
+                                time.sleep(1)
+                                st.rerun()
         
         with col2:
             if st.button("Submit to PowerBI", use_container_width=True, type="secondary"):
@@ -462,32 +699,140 @@ def display_dashboard():
         
         with col3:
             if st.button("Export Data", use_container_width=True):
-                export_data(st.session_state.data)
+                export_data()
+        
+        with st.expander("📤 Import edits from Excel/CSV"):
+            import_file()
         
-        # Data change detection
+        with st.expander("📐 What-if adjustment"):
+            what_if_panel()
+        
+        # Data change detection (per-row hashes of the editable columns)
         if 'data' in grid_response:
-            current_data = grid_response['data']
-            if not current_data.equals(st.session_state.data):
-                st.info("🔄 **Data has been modified.** Remember to save your changes!")
+            dirty_rows = changed_rows(grid_response['data'])
+            st.session_state.has_unsaved = not dirty_rows.empty
+            if not dirty_rows.empty:
+                st.info(f"🔄 **{len(dirty_rows)} row(s) modified.** Remember to save your changes!")
     
     else:
         st.info("📝 No budget data found. Data will be loaded from PowerBI when available.")
 
-def export_data(df: pd.DataFrame):
-    """Export data to Excel"""
-    if not df.empty:
-        # Convert to Excel
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False)
-        output.seek(0)
-        
-        st.download_button(
-            label="📥 Download Excel File",
-            data=output,
-            file_name=f"budget_data_{st.session_state.user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+@st.fragment(run_every=CHANGE_CHECK_SECONDS)
+def watch_changes(listener: ChangeListener):
+    """Rerun the page when the event stream reports newer data for this business unit"""
+    if not has_newer_data(listener):
+        return
+    if st.session_state.has_unsaved:
+        st.info("🔔 Newer data is available. Save your changes or press Refresh Data to load it.")
+    else:
+        st.rerun()
+
+def import_file():
+    """Upload an edited export; the API matches, validates and applies it"""
+    uploaded = st.file_uploader(
+        "Edited workbook or CSV (rows matched by id, empty cells are left unchanged)", type=["xlsx", "csv"]
+    )
+    if uploaded is None or not st.button("Import", disabled=st.session_state.has_unsaved):
+        if st.session_state.has_unsaved:
+            st.caption("Save or discard your grid changes before importing.")
+        return
+    
+    import urllib.parse
+    url = (f"{API_BASE_URL}/api/import/{urllib.parse.quote(st.session_state.user_id)}"
+           f"/{urllib.parse.quote(st.session_state.business_unit)}")
+    with st.spinner("Importing..."):
+        try:
+            response = requests.post(url, files={"file": (uploaded.name, uploaded.getvalue())}, timeout=300)
+        except requests.exceptions.RequestException as e:
+            st.error(f"❌ Import failed: {str(e)}")
+            return
+    if response.status_code != 200:
+        st.error(f"❌ Import failed: {response.json().get('detail', response.text)}")
+        return
+    
+    report = response.json()
+    summary = report.get("summary", {})
+    st.success(f"✅ Imported {summary.get('applied', 0)} of {report.get('rows', 0)} rows "
+               f"({report.get('changed_cells', 0)} cells changed)")
+    problems = [result for result in report.get("results", []) if result["status"] != "applied"]
+    if problems:
+        st.warning(f"⚠️ {report['rows'] - summary.get('applied', 0)} row(s) were not imported")
+        st.dataframe(pd.DataFrame([
+            {"Line": result["row"], "id": result["id"], "Status": result["status"],
+             "Errors": "; ".join(result["errors"])}
+            for result in problems
+        ]), hide_index=True)
+    if report.get("changed_cells"):
+        st.session_state.data = load_user_data()
+        st.session_state.last_refresh = datetime.now()
+
+def what_if_adjustment() -> Optional[Dict]:
+    """Form for one adjustment of the loaded rows; None until a year is picked"""
+    data = st.session_state.data
+    filters = {}
+    columns = st.columns(3)
+    for i, column in enumerate(WHAT_IF_FILTER_COLUMNS):
+        options = sorted(data[column].dropna().astype(str).unique()) if column in data else []
+        selected = columns[i % 3].multiselect(column, options, key=f"what_if_{column}")
+        if selected:
+            filters[column] = selected
+    periods = st.multiselect("Years to change", EDITABLE_NUMERIC_COLUMNS, key="what_if_periods")
+    kind = WHAT_IF_KINDS[st.radio("Change", list(WHAT_IF_KINDS), horizontal=True, key="what_if_kind")]
+    source = None
+    if kind == 'copy':
+        source = st.selectbox("Copy from", [col for col in WHAT_IF_SOURCE_COLUMNS if col not in periods],
+                              key="what_if_source")
+    label = {'percent': "Percent", 'absolute': "Amount", 'copy': "Then change the copied values by (percent)"}[kind]
+    value = st.number_input(label, value=0.0, key="what_if_value")
+    if not periods:
+        st.caption("Pick at least one year. Rows matching every selected filter are changed (all rows if none).")
+        return None
+    return {"filters": filters, "periods": periods, "kind": kind, "value": value, "source": source}
+
+def what_if_panel():
+    """Preview and apply an adjustment of many cells in one server-side update"""
+    adjustment = what_if_adjustment()
+    if adjustment is None:
+        return
+    body = {
+        "user_id": st.session_state.user_id,
+        "business_unit": st.session_state.business_unit,
+        "adjustments": [adjustment]
+    }
+    col1, col2 = st.columns(2)
+    if col1.button("Preview", use_container_width=True):
+        preview = api_call("/api/what-if/preview", "POST", body)
+        if "totals" in preview:
+            st.write(f"{preview['matched_rows']} row(s) matched, {preview['changed_cells']} cell(s) would change")
+            if preview["totals"]:
+                st.dataframe(pd.DataFrame(preview["totals"]).T, use_container_width=True)
+            if preview["error_count"]:
+                st.warning(f"⚠️ {preview['error_count']} cell(s) would fail validation; the adjustment cannot be applied")
+                st.dataframe(pd.DataFrame(preview["errors"]), hide_index=True)
+    if col2.button("Apply", use_container_width=True, disabled=st.session_state.has_unsaved):
+        with st.spinner("Applying..."):
+            result = api_call("/api/what-if/apply", "POST", body)
+        if result.get("success"):
+            st.success(f"✅ {result['message']}")
+            if result.get("changed_cells"):
+                st.session_state.data = load_user_data()
+                st.session_state.last_refresh = datetime.now()
+    if st.session_state.has_unsaved:
+        st.caption("Save or discard your grid changes before applying.")
+
+def export_data():
+    """Offer the server-side Excel export for download"""
+    import urllib.parse
+    business_unit_encoded = urllib.parse.quote(st.session_state.business_unit)
+    user_id_encoded = urllib.parse.quote(st.session_state.user_id)
+    
+    # The API streams and caches the workbook, so the browser downloads it
+    # directly instead of building it inside the Streamlit process
+    st.link_button(
+        "📥 Download Excel File",
+        f"{API_BASE_URL}/api/export/{user_id_encoded}/{business_unit_encoded}",
+        use_container_width=True
+    )
 
 def main():
     """Main application function"""
@@ -0,0 +1,45 @@
+"""In-process LRU of values computed from a business unit's rows, keyed by its data version
+
+Every save bumps the business unit's data version, so an entry never needs to
+be invalidated: a lookup at the new version misses, and the entries of older
+versions are dropped when the new one is stored.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+from sqlalchemy.orm import Session
+
+from DatabaseManager import get_data_version
+
+class VersionedCache:
+    """Values per (business_unit, data_version, *variant), least recently used evicted past ``size``"""
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: "OrderedDict[Tuple[Hashable, ...], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, business_unit: str, build: Callable[[], Any], *variant: Hashable) -> Tuple[int, Any]:
+        """(data version, value) for the BU's current data version; ``build()`` computes a missing value"""
+        data_version = get_data_version(db, business_unit)
+        key = (business_unit, data_version) + variant
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return data_version, self._entries[key]
+
+        # Built outside the lock; two requests may build the same entry, the last one is kept
+        value = build()
+
+        with self._lock:
+            # Older versions of this BU can no longer be requested
+            for stale in [k for k in self._entries if k[0] == business_unit and k[1] != data_version]:
+                del self._entries[stale]
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return data_version, value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
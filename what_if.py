@@ -0,0 +1,297 @@
+"""What-if adjustments of many plan cells at once
+
+An adjustment selects a user's rows of a business unit by dimension labels
+(e.g. ProductNature and Sales_Region) and transforms some plan years:
+
+    percent   value * (1 + value_pct / 100)
+    absolute  value + amount
+    copy      another period's value, scaled by (1 + value_pct / 100)
+
+Blank cells stay blank under percent and absolute. A preview evaluates the
+adjustments, in order, with NumPy on the current rows and writes nothing.
+Applying them runs one set-based UPDATE per adjustment (per period in the
+long layout) with the same arithmetic, so the stored values equal the preview,
+and journals every changed cell. Named scenarios store only their adjustments
+and are evaluated against the current rows whenever they are read.
+"""
+import json
+import math
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+from sqlalchemy import exists, insert, literal, select, update
+from sqlalchemy.orm import Session, aliased
+
+from DatabaseManager import (
+    China2025B, BudgetFact, Scenario, DESCRIPTIVE_COLUMNS, DIMENSION_COLUMNS, PERIOD_COLUMNS, PLAN_COLUMNS,
+    dimension_cache, decode_dimensions
+)
+from budget_validation import BASELINE_COLUMN, range_failures
+from change_journal import journal_cells
+from fact_store import is_long_layout, select_rows
+
+KINDS = ('percent', 'absolute', 'copy')
+
+# Rows are read once per evaluation: id, dimension keys and every period
+LOAD_COLUMNS = ['id'] + DIMENSION_COLUMNS + PERIOD_COLUMNS
+
+class Adjustment(BaseModel):
+    """Rows to change (dimension labels, all of the user's rows if empty) and how"""
+    filters: Dict[str, List[str]] = {}
+    periods: List[str]
+    kind: str
+    # Percent for percent and copy, amount for absolute
+    value: float = 0.0
+    # Period copied from (copy only)
+    source: Optional[str] = None
+
+class ScenarioError(ValueError):
+    """An adjustment that cannot be evaluated"""
+
+def check_adjustments(adjustments: List[Adjustment]):
+    """Raise ScenarioError for an adjustment with an unknown kind, filter or period"""
+    if not adjustments:
+        raise ScenarioError("At least one adjustment is required")
+    for number, adjustment in enumerate(adjustments, start=1):
+        prefix = f"Adjustment {number}: "
+        if adjustment.kind not in KINDS:
+            raise ScenarioError(prefix + f"kind must be one of: {', '.join(KINDS)}")
+        unknown = [column for column in adjustment.filters if column not in DIMENSION_COLUMNS]
+        if unknown:
+            raise ScenarioError(prefix + f"cannot filter on {', '.join(unknown)}; use {', '.join(DIMENSION_COLUMNS)}")
+        if not adjustment.periods or any(period not in PLAN_COLUMNS for period in adjustment.periods):
+            raise ScenarioError(prefix + f"periods must be some of: {', '.join(PLAN_COLUMNS)}")
+        if not math.isfinite(adjustment.value):
+            raise ScenarioError(prefix + "value must be a finite number")
+        if adjustment.kind == 'copy':
+            if adjustment.source not in PERIOD_COLUMNS:
+                raise ScenarioError(prefix + f"source must be one of: {', '.join(PERIOD_COLUMNS)}")
+            # One UPDATE sets every period from the old values; copying a target would depend on the order
+            if adjustment.source in adjustment.periods:
+                raise ScenarioError(prefix + "source cannot be one of the adjusted periods")
+
+def _label_keys(column: str, labels: List[str]) -> List[int]:
+    return [key for key in (dimension_cache.key(column, label) for label in labels) if key is not None]
+
+def _transform(adjustment: Adjustment, values):
+    """New values from the target (or copy source) values; works on NumPy arrays and SQL expressions"""
+    if adjustment.kind == 'absolute':
+        return values + adjustment.value
+    # The same double is bound in SQL and used by NumPy, so both compute identical results
+    return values * (1 + adjustment.value / 100)
+
+class Evaluation:
+    """Plan values of a user's business unit before and after a list of adjustments"""
+    def __init__(self, db: Session, user_id: str, business_unit: str, adjustments: List[Adjustment]):
+        check_adjustments(adjustments)
+        self.user_id = user_id
+        self.business_unit = business_unit
+        self.adjustments = adjustments
+        # Plain tuples: NumPy probes result rows for array attributes one by one
+        rows = [tuple(row) for row in select_rows(
+            db, LOAD_COLUMNS,
+            China2025B.user_id == user_id, China2025B.business_unit == business_unit,
+            order_by=[China2025B.id]
+        )]
+        # None becomes NaN; ids and dimension keys stay exact in float64
+        table = np.array(rows, dtype=np.float64).reshape(len(rows), len(LOAD_COLUMNS))
+        self.ids = table[:, 0].astype(np.int64)
+        self.keys = {
+            column: np.nan_to_num(table[:, 1 + i], nan=-1).astype(np.int64)
+            for i, column in enumerate(DIMENSION_COLUMNS)
+        }
+        offset = 1 + len(DIMENSION_COLUMNS)
+        self.before = {period: table[:, offset + i] for i, period in enumerate(PERIOD_COLUMNS)}
+        self.after = {period: values.copy() for period, values in self.before.items()}
+        self.matched = np.zeros(len(rows), dtype=bool)
+        for adjustment in adjustments:
+            mask = self.selection(adjustment)
+            self.matched |= mask
+            source = self.after[adjustment.source] if adjustment.kind == 'copy' else None
+            new_values = {
+                period: _transform(adjustment, (source if source is not None else self.after[period])[mask])
+                for period in adjustment.periods
+            }
+            for period, values in new_values.items():
+                self.after[period][mask] = values
+        self.changed = {
+            period: ~((self.after[period] == self.before[period])
+                      | (np.isnan(self.after[period]) & np.isnan(self.before[period])))
+            for period in PLAN_COLUMNS
+        }
+
+    def selection(self, adjustment: Adjustment) -> np.ndarray:
+        """Rows matched by an adjustment's dimension filters"""
+        mask = np.ones(len(self.ids), dtype=bool)
+        for column, labels in adjustment.filters.items():
+            mask &= np.isin(self.keys[column], _label_keys(column, labels))
+        return mask
+
+    @property
+    def changed_cells(self) -> int:
+        return int(sum(changed.sum() for changed in self.changed.values()))
+
+    def errors(self) -> List[Dict[str, Any]]:
+        """Changed cells that the validation of saved values would reject"""
+        baseline = self.before[BASELINE_COLUMN]
+        errors = []
+        for period in PLAN_COLUMNS:
+            values, changed = self.after[period], self.changed[period]
+            failures = [(np.isinf(values), "Not a finite number")] + range_failures(values, baseline)
+            for mask, message in failures:
+                for i in np.flatnonzero(mask & changed):
+                    errors.append({"id": int(self.ids[i]), "column": period,
+                                   "value": _number(values[i]) if np.isfinite(values[i]) else None, "error": message})
+        return errors
+
+    def cells(self) -> List[Tuple[int, str, Optional[float], Optional[float]]]:
+        """(row_id, period, old value, new value) of every changed cell"""
+        cells = []
+        for period in PLAN_COLUMNS:
+            rows = np.flatnonzero(self.changed[period])
+            cells.extend(zip(
+                self.ids[rows].tolist(), [period] * len(rows),
+                _numbers(self.before[period][rows]), _numbers(self.after[period][rows])
+            ))
+        return cells
+
+    def preview(self, db: Session, sample: int = 20, max_errors: int = 100) -> Dict[str, Any]:
+        """Counts, per-period totals before and after, validation errors and the first changed rows"""
+        totals = {}
+        for period in PLAN_COLUMNS:
+            if not self.changed[period].any():
+                continue
+            before = float(np.nansum(self.before[period]))
+            after = float(np.nansum(self.after[period]))
+            totals[period] = {"before": round(before, 2), "after": round(after, 2), "delta": round(after - before, 2)}
+        errors = self.errors()
+
+        changed_rows = np.zeros(len(self.ids), dtype=bool)
+        for changed in self.changed.values():
+            changed_rows |= changed
+        rows = np.flatnonzero(changed_rows)[:sample]
+        labels = {}
+        if len(rows):
+            names = ['id'] + DESCRIPTIVE_COLUMNS
+            described = select_rows(db, names, China2025B.id.in_(self.ids[rows].tolist()))
+            labels = {row[0]: dict(zip(names, row)) for row in decode_dimensions(described, names)}
+        sample_rows = []
+        for i in rows:
+            record = dict(labels.get(int(self.ids[i]), {"id": int(self.ids[i])}))
+            for period in PLAN_COLUMNS:
+                if self.changed[period][i]:
+                    record[period] = {"before": _number(self.before[period][i]),
+                                      "after": _number(self.after[period][i])}
+            sample_rows.append(record)
+
+        return {
+            "user_id": self.user_id,
+            "business_unit": self.business_unit,
+            "rows": len(self.ids),
+            "matched_rows": int(self.matched.sum()),
+            "changed_rows": int(changed_rows.sum()),
+            "changed_cells": self.changed_cells,
+            "totals": totals,
+            "error_count": len(errors),
+            "errors": errors[:max_errors],
+            "sample": sample_rows
+        }
+
+def _number(value: float) -> Optional[float]:
+    return None if value != value else float(value)
+
+def _numbers(values: np.ndarray) -> List[Optional[float]]:
+    # NaN (blank) becomes None
+    return [None if value != value else value for value in values.tolist()]
+
+def _criteria(user_id: str, business_unit: str, adjustment: Adjustment) -> list:
+    criteria = [China2025B.user_id == user_id, China2025B.business_unit == business_unit]
+    for column, labels in adjustment.filters.items():
+        criteria.append(getattr(China2025B, f"{column}_id").in_(_label_keys(column, labels)))
+    return criteria
+
+def _update_wide(db: Session, adjustment: Adjustment, criteria: list):
+    # Every period in one statement; SET expressions all read the row's old values
+    source = getattr(China2025B, adjustment.source) if adjustment.kind == 'copy' else None
+    db.execute(
+        update(China2025B).where(*criteria).values({
+            period: _transform(adjustment, source if source is not None else getattr(China2025B, period))
+            for period in adjustment.periods
+        }).execution_options(synchronize_session=False)
+    )
+
+def _update_long(db: Session, adjustment: Adjustment, criteria: list):
+    selected = select(China2025B.id).where(*criteria)
+    source = aliased(BudgetFact)
+    for period in adjustment.periods:
+        if adjustment.kind == 'copy':
+            value = select(_transform(adjustment, source.value)).where(
+                source.row_id == BudgetFact.row_id, source.period == adjustment.source
+            ).scalar_subquery()
+        else:
+            value = _transform(adjustment, BudgetFact.value)
+        db.execute(
+            update(BudgetFact).where(BudgetFact.period == period, BudgetFact.row_id.in_(selected))
+            .values(value=value).execution_options(synchronize_session=False)
+        )
+        if adjustment.kind == 'copy':
+            # Target cells that were never stored are created from the source
+            db.execute(insert(BudgetFact).from_select(
+                ['row_id', 'period', 'value'],
+                select(source.row_id, literal(period), _transform(adjustment, source.value)).where(
+                    source.period == adjustment.source,
+                    source.value.isnot(None),
+                    source.row_id.in_(selected),
+                    ~exists().where(BudgetFact.row_id == source.row_id, BudgetFact.period == period)
+                )
+            ))
+
+def apply_adjustments(db: Session, evaluation: Evaluation) -> int:
+    """Write an evaluation's adjustments with set-based statements and journal the changed cells
+
+    The evaluation must have been made in the same transaction (under the
+    business unit's write lock) so the journaled old values are the current ones.
+    Returns the number of changed cells. The caller owns the transaction and commits.
+    """
+    cells = evaluation.cells()
+    if not cells:
+        return 0
+    journal_cells(db, evaluation.user_id, evaluation.business_unit, cells)
+    for adjustment in evaluation.adjustments:
+        criteria = _criteria(evaluation.user_id, evaluation.business_unit, adjustment)
+        if is_long_layout():
+            _update_long(db, adjustment, criteria)
+        else:
+            _update_wide(db, adjustment, criteria)
+    return len(cells)
+
+def scenario_record(scenario: Scenario) -> Dict[str, Any]:
+    return {
+        "id": scenario.id,
+        "name": scenario.name,
+        "user_id": scenario.user_id,
+        "business_unit": scenario.business_unit,
+        "adjustments": json.loads(scenario.adjustments),
+        "created_at": scenario.created_at.isoformat(),
+        "updated_at": scenario.updated_at.isoformat()
+    }
+
+def scenario_adjustments(scenario: Scenario) -> List[Adjustment]:
+    return [Adjustment(**adjustment) for adjustment in json.loads(scenario.adjustments)]
+
+def save_scenario(db: Session, name: str, user_id: str, business_unit: str, adjustments: List[Adjustment]) -> Scenario:
+    """Create the user's named scenario, or replace the adjustments of the one with this name"""
+    check_adjustments(adjustments)
+    scenario = db.query(Scenario).filter(
+        Scenario.user_id == user_id, Scenario.business_unit == business_unit, Scenario.name == name
+    ).first()
+    now = datetime.utcnow()
+    if scenario is None:
+        scenario = Scenario(name=name, user_id=user_id, business_unit=business_unit, created_at=now)
+        db.add(scenario)
+    scenario.adjustments = json.dumps([adjustment.model_dump() for adjustment in adjustments])
+    scenario.updated_at = now
+    db.flush()
+    return scenario
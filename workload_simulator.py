@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Concurrent user workload simulator for the API
+
+Replays Streamlit-like sessions (login, load, edit, save, submit, ...) with
+many virtual users at once, either in-process or against a running server,
+and reports throughput, error rate and latency percentiles per step.
+
+A scenario is a JSONL file with one step per line, run in order by every
+session (see scenarios/). Each step may add:
+  "probability": 0.3        run the step in 30% of the sessions
+  "repeat": [2, 5]          run it a random number of times (or a fixed count)
+Steps: login, load, status, rollup, query, edit, save, submit, export, think.
+"edit" changes "rows" random rows of the loaded grid by up to "change" (a
+fraction) in "columns"; "save" sends them like the Streamlit app does.
+"think" pauses for "seconds" ([min, max]), scaled by --think-scale.
+
+Random choices come from --seed and the session number, so a run against the
+same database makes the same sessions whatever the thread scheduling.
+
+    python workload_simulator.py --users 30 --sessions 120 --seed 7
+    python workload_simulator.py --scenario scenarios/browse.jsonl --think-scale 0
+    python workload_simulator.py --url http://127.0.0.1:8000 --users 50 --json report.json
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_SCENARIO = ROOT / "scenarios" / "deadline_day.jsonl"
+EDITABLE_COLUMNS = ['Y2025B', 'Y2026P', 'Y2027P', 'Y2028P', 'Y2029P', 'Sales_Remark']
+STEPS = {'login', 'load', 'status', 'rollup', 'query', 'edit', 'save', 'submit', 'export', 'think'}
+
+def load_scenario(path: Path) -> List[Dict[str, Any]]:
+    steps = []
+    with open(path) as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            step = json.loads(line)
+            if step.get("step") not in STEPS:
+                raise ValueError(f"{path}:{number}: unknown step {step.get('step')!r}; use one of {sorted(STEPS)}")
+            steps.append(step)
+    return steps
+
+def discover_users() -> List[Tuple[str, str]]:
+    """(user_id, business_unit) of every user who can log in"""
+    from DatabaseManager import SessionLocal, UserSession
+    db = SessionLocal()
+    try:
+        return sorted(db.query(UserSession.user_id, UserSession.business_unit).all())
+    finally:
+        db.close()
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+class Recorder:
+    """Latency and outcome of every request, per step"""
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, step: str, seconds: float, status: Any):
+        with self._lock:
+            self.latencies[step].append(seconds)
+            self.statuses[step][str(status)] += 1
+            if not isinstance(status, int) or status >= 400:
+                self.errors[step] += 1
+
+    def report(self, elapsed: float, sessions: int) -> Dict[str, Any]:
+        steps = {}
+        for step, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            steps[step] = {
+                "requests": len(values),
+                "errors": self.errors[step],
+                "statuses": dict(self.statuses[step]),
+                **{f"p{p}_ms": round(percentile(values, p / 100) * 1000, 1) for p in (50, 90, 95, 99)},
+                "max_ms": round(values[-1] * 1000, 1)
+            }
+        requests_total = sum(len(values) for values in self.latencies.values())
+        errors_total = sum(self.errors.values())
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "sessions": sessions,
+            "requests": requests_total,
+            "throughput_rps": round(requests_total / elapsed, 2) if elapsed else 0.0,
+            "error_rate": round(errors_total / requests_total, 4) if requests_total else 0.0,
+            "steps": steps
+        }
+
+class Session:
+    """One virtual user working through the scenario"""
+    def __init__(self, client, recorder: Recorder, rng: random.Random, user: Tuple[str, str], think_scale: float):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.user_id, self.business_unit = user
+        self.think_scale = think_scale
+        self.path_user = f"{urllib.parse.quote(self.user_id)}/{urllib.parse.quote(self.business_unit)}"
+        self.headers = {'X-User-Id': self.user_id}
+        self.rows: List[Dict[str, Any]] = []
+        self.edited: Dict[int, Dict[str, Any]] = {}
+
+    def _request(self, step: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.client.request(method, path, headers=self.headers, **kwargs)
+        except Exception as e:
+            self.recorder.record(step, time.perf_counter() - start, type(e).__name__)
+            return None
+        self.recorder.record(step, time.perf_counter() - start, response.status_code)
+        return response if response.status_code == 200 else None
+
+    def _count(self, value) -> int:
+        return self.rng.randint(*value) if isinstance(value, list) else int(value)
+
+    def run(self, steps: List[Dict[str, Any]]):
+        for step in steps:
+            if self.rng.random() >= step.get("probability", 1.0):
+                continue
+            for _ in range(self._count(step.get("repeat", 1))):
+                getattr(self, f"step_{step['step']}")(step)
+
+    def step_think(self, step):
+        low, high = step.get("seconds", [1, 5])
+        time.sleep(self.rng.uniform(low, high) * self.think_scale)
+
+    def step_login(self, step):
+        self._request("login", "POST", "/api/login",
+                      json={"user_id": self.user_id, "business_unit": self.business_unit})
+
+    def step_load(self, step):
+        response = self._request("load", "GET", f"/api/data/{self.path_user}")
+        if response is not None:
+            self.rows = sorted(response.json()["data"], key=lambda row: row["id"])
+
+    def step_status(self, step):
+        self._request("status", "GET", f"/api/submission-status/{self.path_user}")
+
+    def step_rollup(self, step):
+        self._request("rollup", "GET", "/api/rollup", params={
+            "group_by": step.get("group_by", "Sales_Region"), "business_unit": self.business_unit
+        })
+
+    def step_query(self, step):
+        params = {"q": step.get("q", ""), "match": step.get("match", "contains"), "limit": step.get("limit", 100)}
+        self._request("query", "GET", "/api/query", params={k: v for k, v in params.items() if v})
+
+    def step_edit(self, step):
+        if not self.rows:
+            return
+        columns = step.get("columns", ['Y2025B'])
+        change = step.get("change", 0.05)
+        for row in self.rng.sample(self.rows, min(self._count(step.get("rows", 1)), len(self.rows))):
+            edited = self.edited.setdefault(row["id"], {col: row.get(col) for col in EDITABLE_COLUMNS})
+            for column in columns:
+                if column == 'Sales_Remark':
+                    edited[column] = f"simulated edit {self.rng.randint(0, 9999)}"
+                else:
+                    edited[column] = round((edited[column] or 0) * (1 + self.rng.uniform(-change, change)), 2)
+
+    def step_save(self, step):
+        if not self.edited:
+            return
+        updates = [
+            {"id": row_id, **{col: (value if value is not None else (0 if col != 'Sales_Remark' else ""))
+                              for col, value in values.items()}}
+            for row_id, values in sorted(self.edited.items())
+        ]
+        response = self._request("save", "POST", "/api/update", json={
+            "user_id": self.user_id, "business_unit": self.business_unit, "updates": updates
+        })
+        if response is not None:
+            # Like the grid: the saved values are now the loaded ones
+            by_id = {row["id"]: row for row in self.rows}
+            for row_id, values in self.edited.items():
+                by_id[row_id].update(values)
+            self.edited = {}
+
+    def step_submit(self, step):
+        self._request("submit", "POST", "/api/submit",
+                      params={"user_id": self.user_id, "business_unit": self.business_unit})
+
+    def step_export(self, step):
+        self._request("export", "GET", f"/api/export/{self.path_user}")
+
+class LiveClient:
+    """requests against a running server, one connection pool per thread"""
+    def __init__(self, url: str, timeout: float):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, **kwargs):
+        import requests
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session.request(method, self.url + path, timeout=self.timeout, **kwargs)
+
+def simulate(client, steps, users, sessions: int, concurrency: int, seed: int,
+             think_scale: float, ramp_up: float) -> Dict[str, Any]:
+    recorder = Recorder()
+
+    def run_session(number: int):
+        # Seeded per session, so the sessions do not depend on which thread runs them
+        rng = random.Random(f"{seed}:{number}")
+        if ramp_up and number < concurrency:
+            time.sleep(ramp_up * number / concurrency)
+        Session(client, recorder, rng, users[rng.randrange(len(users))], think_scale).run(steps)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(run_session, number) for number in range(sessions)]:
+            future.result()
+    return recorder.report(time.perf_counter() - start, sessions)
+
+def print_report(report: Dict[str, Any]):
+    print(f"\n{report['sessions']} sessions, {report['requests']} requests in {report['elapsed_s']}s: "
+          f"{report['throughput_rps']} req/s, error rate {report['error_rate'] * 100:.2f}%\n")
+    print(f"{'step':<10}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, stats in report["steps"].items():
+        print(f"{step:<10}{stats['requests']:>9}{stats['errors']:>8}{stats['p50_ms']:>10}{stats['p90_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    statuses = {step: stats["statuses"] for step, stats in report["steps"].items()
+                if set(stats["statuses"]) - {"200"}}
+    if statuses:
+        print(f"\nNon-200 responses: {json.dumps(statuses)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent budget portal users")
+    parser.add_argument("--scenario", type=Path, default=DEFAULT_SCENARIO)
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--sessions", type=int, default=None, help="Sessions to run (default: 3 per user)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--think-scale", type=float, default=1.0, help="Multiplies think times (0 = no pauses)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which the first users start")
+    parser.add_argument("--url", help="Running API server; default runs the app in-process")
+    parser.add_argument("--user", action="append", default=[], metavar="USER_ID:BUSINESS_UNIT",
+                        help="User to simulate (repeatable); default: every user in user_sessions")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json", type=Path, help="Also write the report to this file")
+    args = parser.parse_args()
+
+    steps = load_scenario(args.scenario)
+    users = [tuple(value.split(':', 1)) for value in args.user] or discover_users()
+    if not users:
+        parser.error("No users to simulate; pass --user or create user sessions first")
+    sessions = args.sessions or args.users * 3
+    print(f"Scenario {args.scenario.name}: {len(steps)} steps, {sessions} sessions, "
+          f"{args.users} concurrent users from {len(users)} accounts, seed {args.seed}")
+
+    if args.url:
+        report = simulate(LiveClient(args.url, args.timeout), steps, users, sessions, args.users,
+                          args.seed, args.think_scale, args.ramp_up)
+    else:
+        import logging
+        from fastapi.testclient import TestClient
+        from config import config
+        import APIServer
+        for name in ('api.access', 'httpx'):
+            if name not in config.LOG_LEVELS:
+                # One record per simulated request would bury the report
+                logging.getLogger(name).setLevel(logging.WARNING)
+        with TestClient(APIServer.app) as client:
+            report = simulate(client, steps, users, sessions, args.users,
+                              args.seed, args.think_scale, args.ramp_up)
+
+    report.update({"scenario": args.scenario.name, "seed": args.seed, "users": args.users})
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()